@@ -1,7 +1,9 @@
 import streamlit as st
 import pandas as pd
 import re
-from src.db_snowflake import get_session
+from src.db_snowflake import get_session, recompute_derivados_tables, search_doc_task_config, setup_search_docs, stream_to_pandas
+from src.snapshot import get_apr_snapshot, get_cor_snapshot, get_main_snapshot
+from src.variables import FQN_MAIN
 from src.auth import current_user
 
 st.set_page_config(page_title="Catálogo • Tabelas", layout="wide")
@@ -46,7 +48,8 @@ def _esc_str(s: str) -> str:
 
 @st.cache_data(show_spinner=False, ttl=300)
 def load_table(fqn: str) -> pd.DataFrame:
-    return session.table(fqn).to_pandas()
+    # dentro do cache: leitura em lotes, sem elementos de progresso
+    return stream_to_pandas(session.table(fqn), progress=False)
 
 
 def apply_changes(target_fqn: str, id_col: str, value_col: str, original: pd.DataFrame, edited: pd.DataFrame):
@@ -176,3 +179,44 @@ for tab, label, tb in zip(tabs, cols, tbs):
                             st.cache_data.clear()
                         except Exception as e:
                             st.error(f"Erro ao salvar: {e}")
+
+# ==============================
+# Documento de busca (ADMIN)
+# ==============================
+if is_admin:
+    with st.expander("🔎 Documento de busca (BUSCA)"):
+        task = search_doc_task_config()
+        st.caption(
+            "Cria/recalcula a coluna BUSCA das tabelas do catálogo (filtro de palavra-chave). "
+            "Linhas alteradas fora do app ficam com BUSCA antiga "
+            + (f"até a próxima execução da task ({task['schedule']})." if task
+               else "até serem gravadas pelo app (configure st.secrets['busca']['warehouse'] para a task periódica).")
+        )
+        if st.button("Instalar / recalcular BUSCA", key="setup_busca"):
+            try:
+                with st.spinner("Recalculando BUSCA..."):
+                    res = setup_search_docs(session)
+                st.success(" • ".join(f"{fqn.split('.')[-1]}: {n} linha(s)" for fqn, n in res.items()))
+            except Exception as e:
+                st.error(f"Erro ao instalar BUSCA: {e}")
+
+    with st.expander("🧮 Derivados (SINONIMO / PALAVRA_CHAVE)"):
+        st.caption(
+            "Recalcula os campos derivados das tabelas do catálogo no próprio Snowflake "
+            "(UDFs com o mesmo código do app). Só grava as linhas cujo valor muda. "
+            "Aprovados/correções ganham DATA_ATUALIZACAO e aparecem no próximo delta; nos pendentes "
+            "(delta por DATA_CADASTRO), outras instâncias do app só veem na recarga completa periódica."
+        )
+        recalc_desc = st.checkbox("Recalcular também DESCRICAO (a partir da ESPECIFICACAO)", key="derivados_desc")
+        if st.button("Recalcular derivados", key="recompute_derivados"):
+            try:
+                with st.spinner("Recalculando derivados..."):
+                    res = recompute_derivados_tables(session, recalc_descricao=recalc_desc)
+                st.success(" • ".join(f"{fqn.split('.')[-1]}: {r['linhas']} linha(s)" for fqn, r in res.items()))
+                # pendentes: delta só por DATA_CADASTRO -> recarga completa neste processo
+                if res.get(FQN_MAIN, {}).get("linhas"):
+                    get_main_snapshot().refresh(session, full=True)
+                get_apr_snapshot().mark_stale()
+                get_cor_snapshot().mark_stale()
+            except Exception as e:
+                st.error(f"Erro ao recalcular derivados: {e}")
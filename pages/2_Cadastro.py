@@ -1,12 +1,14 @@
 import pandas as pd
 import streamlit as st
 import xlsxwriter
-from src.db_snowflake import codigo_produto_exists_any, fetch_existing_codigos_dual, get_session, insert_item
-from src.utils import data_hoje, extrair_valores, campos_obrigatorios_ok, gerar_sinonimo, gerar_palavra_chave, _pick, _to_float_safe, _to_int_safe, gerar_template_excel_catalogo
+from src.db_snowflake import get_session, insert_item, bulk_insert_items
+from src.codigo_index import get_codigo_index
+from src.utils import data_hoje, extrair_valores, campos_obrigatorios_ok, gerar_sinonimo, gerar_palavra_chave, extrair_valores_series, gerar_sinonimo_series, gerar_palavra_chave_series, _pick, _to_float_safe, _to_int_safe, gerar_template_excel_catalogo
 from io import BytesIO
 from src.auth import current_user, require_roles
 import numpy as np
 
+from src.snapshot import get_main_snapshot
 from src.variables import FQN_TBL_GRUPO, FQN_TBL_CATEGORIA, FQN_TBL_SEGMENTO, FQN_TBL_FAMILIA, FQN_TBL_SUBFAMILIA, FQN_TBL_TIPO_CODIGO, FQN_TBL_MARCA, FQN_TBL_FABRICANTE, FQN_TBL_EMB_PRODUTO, FQN_TBL_UN_MED, FQN_TBL_EMB_COMERCIAL
 
 require_roles("OPERACIONAL", "ADMIN")
@@ -127,7 +129,8 @@ with tab_form:
                     "PALAVRA_CHAVE": gerar_palavra_chave(subfamilia, item, marca, fabricante, emb_produto, qtd_med, un_med, familia),
                 }
                 codigo_norm = (codigo_produto or "").strip()
-                exists, origem = codigo_produto_exists_any(session, codigo_norm)
+                # índice local: aviso sem ida ao banco; o INSERT confere de novo no servidor
+                exists, origem = get_codigo_index().exists_any(session, codigo_norm)
                 if exists:
                     if origem == "APROVADOS":
                         st.error(f"CODIGO_PRODUTO '{codigo_norm}' já está APROVADO. Não é permitido novo cadastro.")
@@ -135,6 +138,8 @@ with tab_form:
                         st.error(f"CODIGO_PRODUTO '{codigo_norm}' já existe em pendências. Ajuste e tente novamente.")
                 else:
                     ok, msg = insert_item(session, item_dict)
+                    if ok:
+                        get_main_snapshot().mark_stale()
                     st.success(msg) if ok else st.error(msg)
 
 # =========================
@@ -268,7 +273,7 @@ with tab_excel:
 
         # 3.2) Duplicados NA BASE (apenas para códigos não vazios)
         codigos_unicos_arquivo = sorted({c for c in df_out["CODIGO_PRODUTO"].tolist() if str(c).strip()})
-        exist_pend, exist_aprv = fetch_existing_codigos_dual(session, codigos_unicos_arquivo)
+        exist_pend, exist_aprv = get_codigo_index().existing_dual(session, codigos_unicos_arquivo)
 
         dups_in_db_pend_mask = df_out["CODIGO_PRODUTO"].isin(exist_pend)
         dups_in_db_aprv_mask = df_out["CODIGO_PRODUTO"].isin(exist_aprv)
@@ -378,59 +383,69 @@ with tab_excel:
                 except:
                     return None
 
-            for idx, row in df_valid.iterrows():
-                item_dict = {
-                    "REFERENCIA": row["REFERENCIA"] or None,
-                    "DATA_CADASTRO": data_hoje(),
-                    "USUARIO_CADASTRO": usuario_atual,
-                    "GRUPO": row["GRUPO"],
-                    "CATEGORIA": row["CATEGORIA"],
-                    "SEGMENTO": row["SEGMENTO"],
-                    "FAMILIA": row["FAMILIA"],
-                    "SUBFAMILIA": row["SUBFAMILIA"],
-                    "TIPO_CODIGO": row["TIPO_CODIGO"],
-                    "CODIGO_PRODUTO": row["CODIGO_PRODUTO"],
-                    "INSUMO": row["INSUMO"] or None,
-                    "ITEM": row["ITEM"],
-                    "DESCRICAO": extrair_valores(row["ESPECIFICACAO"]),
-                    "ESPECIFICACAO": row["ESPECIFICACAO"],
-                    "MARCA": row["MARCA"],
-                    "FABRICANTE": row["FABRICANTE"],
-                    "EMB_PRODUTO": row["EMB_PRODUTO"],
-                    "UN_MED": row["UN_MED"],
-                    "QTD_MED": to_float_ok(row["QTD_MED"]),
-                    "EMB_COMERCIAL": row["EMB_COMERCIAL"],
-                    "QTD_EMB_COMERCIAL": to_int_ok(row["QTD_EMB_COMERCIAL"]),
-                    "QTD_EMB_PRODUTO": to_int_ok(row["QTD_EMB_PRODUTO"]),
-                    "SINONIMO": gerar_sinonimo(
-                        row["ITEM"],
-                        extrair_valores(row["ESPECIFICACAO"]),
-                        row["MARCA"],
-                        row["FABRICANTE"],
-                        to_float_ok(row["QTD_MED"]),
-                        row["UN_MED"],
-                        row["EMB_PRODUTO"],
-                        to_int_ok(row["QTD_EMB_COMERCIAL"]),
-                        row["EMB_COMERCIAL"],
-                    ),
-                    "PALAVRA_CHAVE": gerar_palavra_chave(
-                        row["SUBFAMILIA"],
-                        row["ITEM"],
-                        row["MARCA"],
-                        row["FABRICANTE"],
-                        row["EMB_PRODUTO"],
-                        to_float_ok(row["QTD_MED"]),
-                        row["UN_MED"],
-                        row["FAMILIA"],
-                    ),
-                }
-
-                ok, msg = insert_item(session, item_dict)
-                if ok:
-                    ok_count += 1
-                else:
-                    fails.append((idx + 2, msg))  # type: ignore # +2: cabeçalho + base 1
-
+            def col_obj(serie, fn):
+                # dtype object: mantém int/None como no cadastro linha a linha (sem virar float/NaN)
+                return pd.Series([fn(x) for x in serie], index=serie.index, dtype=object)
+
+            # derivados calculados por coluna (SINONIMO/PALAVRA_CHAVE/DESCRICAO), não por linha
+            qtd_med_ok = col_obj(df_valid["QTD_MED"], to_float_ok)
+            qtd_emb_com_ok = col_obj(df_valid["QTD_EMB_COMERCIAL"], to_int_ok)
+            descricao = extrair_valores_series(df_valid["ESPECIFICACAO"])
+            itens = pd.DataFrame({
+                "REFERENCIA": col_obj(df_valid["REFERENCIA"], lambda v: v or None),
+                "DATA_CADASTRO": data_hoje(),
+                "USUARIO_CADASTRO": usuario_atual,
+                "GRUPO": df_valid["GRUPO"],
+                "CATEGORIA": df_valid["CATEGORIA"],
+                "SEGMENTO": df_valid["SEGMENTO"],
+                "FAMILIA": df_valid["FAMILIA"],
+                "SUBFAMILIA": df_valid["SUBFAMILIA"],
+                "TIPO_CODIGO": df_valid["TIPO_CODIGO"],
+                "CODIGO_PRODUTO": df_valid["CODIGO_PRODUTO"],
+                "INSUMO": col_obj(df_valid["INSUMO"], lambda v: v or None),
+                "ITEM": df_valid["ITEM"],
+                "DESCRICAO": descricao,
+                "ESPECIFICACAO": df_valid["ESPECIFICACAO"],
+                "MARCA": df_valid["MARCA"],
+                "FABRICANTE": df_valid["FABRICANTE"],
+                "EMB_PRODUTO": df_valid["EMB_PRODUTO"],
+                "UN_MED": df_valid["UN_MED"],
+                "QTD_MED": qtd_med_ok,
+                "EMB_COMERCIAL": df_valid["EMB_COMERCIAL"],
+                "QTD_EMB_COMERCIAL": qtd_emb_com_ok,
+                "QTD_EMB_PRODUTO": col_obj(df_valid["QTD_EMB_PRODUTO"], to_int_ok),
+                "SINONIMO": gerar_sinonimo_series(
+                    df_valid["ITEM"],
+                    descricao,
+                    df_valid["MARCA"],
+                    df_valid["FABRICANTE"],
+                    qtd_med_ok,
+                    df_valid["UN_MED"],
+                    df_valid["EMB_PRODUTO"],
+                    qtd_emb_com_ok,
+                    df_valid["EMB_COMERCIAL"],
+                ),
+                "PALAVRA_CHAVE": gerar_palavra_chave_series(
+                    df_valid["SUBFAMILIA"],
+                    df_valid["ITEM"],
+                    df_valid["MARCA"],
+                    df_valid["FABRICANTE"],
+                    df_valid["EMB_PRODUTO"],
+                    qtd_med_ok,
+                    df_valid["UN_MED"],
+                    df_valid["FAMILIA"],
+                ),
+            })
+            itens.index = itens.index + 2  # +2: cabeçalho + base 1 (linha do Excel)
+
+            # lote inteiro numa tabela temporária + um INSERT ... SELECT (em vez de 1 INSERT por linha)
+            with st.spinner(f"Inserindo {total_valid} registros..."):
+                res = bulk_insert_items(session, itens)
+            ok_count = int(res["OK"].sum())
+            fails = [(linha, msg) for linha, msg in res.loc[~res["OK"], "MSG"].items()]
+
+            if ok_count:
+                get_main_snapshot().mark_stale()
             if ok_count == total_valid:
                 st.success(f"✅ Inseridos {ok_count}/{total_valid} registros válidos.")
             else:
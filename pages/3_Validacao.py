@@ -1,9 +1,13 @@
 import streamlit as st
 import pandas as pd
-from src.db_snowflake import apply_common_filters, build_user_options, get_session, listar_itens_df, load_user_display_map, log_validacao, log_reprovacao
+from src.db_snowflake import changed_rows, get_session, listar_itens_df, load_user_display_map, refresh_search_doc, table_columns, transition_procedure
 from src.auth import init_auth, is_authenticated, current_user, require_roles
-from src.utils import extrair_valores, gerar_sinonimo 
-from src.variables import FQN_MAIN, FQN_COR, FQN_APR
+from src.utils import extrair_valores_series, gerar_sinonimo_series
+from src.variables import FQN_MAIN, FQN_COR
+from src.snapshot import get_apr_snapshot, get_cor_snapshot, get_main_snapshot
+from src.compact import expand_frame
+from src.filter_panel import FilterPanel
+from src.transitions import APROVAR, REPROVAR, call_transition
 
 # ==============================
 # Constantes / Config
@@ -16,32 +20,9 @@ ORDER_VALIDACAO = [
     "SINONIMO","PALAVRA_CHAVE","DATA_CADASTRO","USUARIO_CADASTRO","REFERENCIA",
 ]
 
-ORDER_CORRECOES = [
-    "ID","GRUPO","CATEGORIA","SEGMENTO","FAMILIA","SUBFAMILIA",
-    "TIPO_CODIGO","CODIGO_PRODUTO","INSUMO","ITEM","DESCRICAO","ESPECIFICACAO",
-    "MARCA","FABRICANTE","QTD_EMB_PRODUTO", "EMB_PRODUTO", "QTD_MED", "UN_MED", "QTD_EMB_COMERCIAL", "EMB_COMERCIAL",
-    "SINONIMO","PALAVRA_CHAVE","REFERENCIA",
-    "DATA_CADASTRO","USUARIO_CADASTRO",
-    "DATA_REPROVACAO","USUARIO_REPROVACAO",
-    "MOTIVO",
-]
-
-EDITABLE_COR_COLS = [
-    "GRUPO","CATEGORIA","SEGMENTO","FAMILIA","SUBFAMILIA","TIPO_CODIGO","CODIGO_PRODUTO",
-    "INSUMO","ITEM","DESCRICAO","ESPECIFICACAO","MARCA","FABRICANTE","QTD_EMB_PRODUTO",
-    "EMB_PRODUTO", "QTD_MED", "UN_MED", "QTD_EMB_COMERCIAL", "EMB_COMERCIAL",
-    "SINONIMO","PALAVRA_CHAVE","REFERENCIA"
-]
-
 # ==============================
 # Helpers
 # ==============================
-def sql_str(v):
-    if v is None or (isinstance(v, float) and pd.isna(v)): 
-        return "NULL"
-    s = str(v).replace("'", "''")
-    return f"'{s}'"
-
 def reorder(df: pd.DataFrame, wanted: list[str], prepend: list[str] | None = None) -> pd.DataFrame:
     prepend = prepend or []
     keep = [c for c in wanted if c in df.columns]
@@ -79,33 +60,6 @@ def _sql_escape(val):
         return str(val)
     return "'" + str(val).replace("'", "''") + "'"
 
-def _build_desc(row_after) -> str:
-    """
-    Recria DESCRICAO a partir de ESPECIFICACAO, seguindo 5_Atualizacao.
-    - Se DESCRICAO está vazio/nulo, tenta extrair de ESPECIFICACAO
-    """
-    desc = row_after.get("DESCRICAO")
-    if (desc is None or str(desc).strip() == "") and "ESPECIFICACAO" in row_after:
-        return extrair_valores(row_after.get("ESPECIFICACAO", "") or "")
-    return desc if desc is not None else ""
-
-def _build_sinonimo_like_update(row_after) -> str:
-    """
-    Recalcula SINONIMO com a MESMA assinatura usada na 5_Atualizacao.
-    """
-    desc = _build_desc(row_after)
-    return gerar_sinonimo(
-        row_after.get("ITEM"),
-        desc or row_after.get("DESCRICAO") or "",
-        row_after.get("MARCA"),
-        row_after.get("FABRICANTE"),
-        row_after.get("QTD_MED"),
-        row_after.get("UN_MED"),
-        row_after.get("EMB_PRODUTO"),
-        row_after.get("QTD_EMB_COMERCIAL"),
-        row_after.get("EMB_COMERCIAL"),
-    )
-
 def _recalc_sinonimo_df_inplace(df: pd.DataFrame) -> pd.DataFrame:
     """
     Recalcula DESCRICAO (se vazia) e SINONIMO para TODAS as linhas visíveis no DataFrame.
@@ -116,30 +70,36 @@ def _recalc_sinonimo_df_inplace(df: pd.DataFrame) -> pd.DataFrame:
     if "DESCRICAO" not in df.columns:
         df["DESCRICAO"] = ""
 
-    def _calc(row):
-        # monta um dict estilo "row_after" (igual 5_Atualizacao)
-        row_after = row.to_dict()
-        novo_desc = _build_desc(row_after)
-        row_after["DESCRICAO"] = novo_desc
-        return novo_desc, _build_sinonimo_like_update(row_after)
-
-    out = df.apply(lambda r: pd.Series(_calc(r), index=["__DESC_NEW__", "__SIN_NEW__"]), axis=1)
-    # aplica descrição nova apenas se a atual estiver vazia/nula (mesmo critério do helper)
+    # mesma assinatura da 5_Atualizacao, coluna a coluna (sem df.apply por linha)
+    col = lambda c: df[c] if c in df.columns else None
+    # aplica descrição nova apenas se a atual estiver vazia/nula
     mask_apply_desc = df["DESCRICAO"].astype(str).str.strip().eq("") | df["DESCRICAO"].isna()
-    df.loc[mask_apply_desc, "DESCRICAO"] = out["__DESC_NEW__"]
-    df["SINONIMO"] = out["__SIN_NEW__"]
+    novo_desc = df["DESCRICAO"].where(df["DESCRICAO"].notna(), "")
+    if "ESPECIFICACAO" in df.columns and mask_apply_desc.any():
+        novo_desc = novo_desc.where(~mask_apply_desc, extrair_valores_series(df.loc[mask_apply_desc, "ESPECIFICACAO"]))
+    novo_sin = gerar_sinonimo_series(
+        col("ITEM"), novo_desc, col("MARCA"), col("FABRICANTE"), col("QTD_MED"),
+        col("UN_MED"), col("EMB_PRODUTO"), col("QTD_EMB_COMERCIAL"), col("EMB_COMERCIAL"),
+    )
+    df.loc[mask_apply_desc, "DESCRICAO"] = novo_desc
+    df["SINONIMO"] = novo_sin
     return df
 
-def _persist_sinonimo_batch(session, table_fqn: str, df_ids: pd.DataFrame, id_col: str = "ID"):
+def _persist_sinonimo_batch(session, table_fqn: str, df_ids: pd.DataFrame, id_col: str = "ID", *, baseline: pd.DataFrame | None = None):
     """
     Atualiza no banco em lote:
       - Atualiza DESCRICAO (apenas quando calculada nova)
       - Atualiza SINONIMO (sempre com o valor recalculado)
     Usa CASE ... WHEN ... THEN ... para eficiência.
+    Com `baseline` (valores carregados, antes do recálculo), grava só as linhas que mudaram.
     """
     import pandas as pd
     if df_ids.empty or id_col not in df_ids or "SINONIMO" not in df_ids:
         return
+    if baseline is not None:
+        df_ids = changed_rows(df_ids, baseline, ["DESCRICAO", "SINONIMO"], id_col)
+        if df_ids.empty:
+            return
 
     # Garantir colunas
     work = df_ids[[id_col, "SINONIMO"]].copy()
@@ -175,28 +135,16 @@ def _persist_sinonimo_batch(session, table_fqn: str, df_ids: pd.DataFrame, id_co
         WHERE {id_col} IN ({ids_csv})
     """
     session.sql(sql).collect()
+    refresh_search_doc(session, table_fqn, f"{id_col} IN ({ids_csv})")
 
+    # reflete no snapshot local (UPDATE sem coluna de data não aparece no delta)
+    snap = {FQN_MAIN: get_main_snapshot, FQN_COR: get_cor_snapshot}.get(table_fqn)
+    if snap is not None:
+        snap().patch(pd.DataFrame([(i, s) for (i, s, _) in pairs], columns=["ID", "SINONIMO"]))
+        desc = [(i, d) for (i, _, d) in pairs if d is not None]
+        if desc:
+            snap().patch(pd.DataFrame(desc, columns=["ID", "DESCRICAO"]))
 
-def _series_and_opts(df_in: pd.DataFrame, col: str, *, drop_dot_zero: bool = False):
-    if col in df_in.columns:
-        s = norm_str_series(df_in[col], drop_dot_zero=drop_dot_zero)
-    else:
-        s = pd.Series(pd.NA, index=df_in.index, dtype="string")
-    return s, dropdown_options(s)
-
-def _apply_selected(df_in: pd.DataFrame, s_norm: pd.Series, selected: str) -> pd.DataFrame:
-    if selected == ALL_LABEL:
-        return df_in
-    if selected == NULL_LABEL:
-        return df_in[s_norm.isna()]
-    return df_in[s_norm == selected]
-
-def _selectbox_with_reset(label: str, options: list[str], key: str) -> str:
-    cur = st.session_state.get(key, ALL_LABEL)
-    if cur not in options:
-        st.session_state[key] = ALL_LABEL
-        cur = ALL_LABEL
-    return st.selectbox(label, options, index=options.index(cur), key=key)
 # ==============================
 # Ações de Banco
 # ==============================
@@ -207,196 +155,20 @@ def apply_decision(session, df_items, user, ids, decisao: str, obs: str | None):
     """
     if not ids:
         return
-
-    session.sql("ALTER SESSION SET TIMEZONE = 'America/Sao_Paulo'").collect()
-    ids_csv = ", ".join(str(i) for i in ids)
-
-
-    # 2) Colunas comuns (principal -> destino)
-    get_cols = lambda table_fqn: [c.name for c in session.table(table_fqn).schema]
-    cols_main = get_cols(FQN_MAIN)
-
-    # inicializa para evitar NameError
-    sql_move_insert = None
-    sql_move_meta   = None
-    toast_icon = "✅"
-    destino_legenda = "Aprovados"
-
     if decisao == "APROVADO":
-        target = FQN_APR
-        cols_target = [c for c in get_cols(target) if c in cols_main]
-        col_list = ", ".join(cols_target)
-
-        sql_move_insert = f"""
-            INSERT INTO {target} ({col_list})
-            SELECT {col_list}
-            FROM {FQN_MAIN}
-            WHERE ID IN ({ids_csv})
-        """
-
-        cols_apr_all = get_cols(target)
-        meta_sets = []
-        if "USUARIO_APROVACAO" in cols_apr_all:
-            meta_sets.append(f"USUARIO_APROVACAO = {sql_str(user['name'])}")
-        if "DATA_APROVACAO" in cols_apr_all:
-            meta_sets.append("DATA_APROVACAO = CURRENT_TIMESTAMP()")
-
-
-        if meta_sets:
-            sql_move_meta = f"""
-                UPDATE {target}
-                SET {', '.join(meta_sets)}
-                WHERE ID IN ({ids_csv})
-            """
-
-        toast_icon = "✅"
-        destino_legenda = "Aprovados"
-        for _id in ids:
-            try:
-                cod = None
-                row = df_items.loc[df_items["ID"] == _id]
-                if not row.empty and "CODIGO_PRODUTO" in row.columns:
-                    cod = None if pd.isna(row["CODIGO_PRODUTO"].iloc[0]) else str(row["CODIGO_PRODUTO"].iloc[0])
-                log_validacao(
-                    session,
-                    item_id=_id,
-                    codigo_produto=cod,
-                    origem=FQN_MAIN,          # ou FQN_COR se a aprovação estiver vindo de correções (depende do teu fluxo)
-                    destino=FQN_APR,
-                    obs=obs,
-                    user=user,
-                )
-            except Exception:
-                pass
-
+        tr, toast_icon, destino_legenda = APROVAR, "✅", "Aprovados"
     else:
-        target = FQN_COR
-        cols_target = [c for c in get_cols(target) if c in cols_main]
-        col_list = ", ".join(cols_target)
-
-        sql_move_insert = f"""
-            INSERT INTO {target} ({col_list})
-            SELECT {col_list}
-            FROM {FQN_MAIN}
-            WHERE ID IN ({ids_csv})
-        """
-        sql_move_meta = f"""
-            UPDATE {target}
-            SET USUARIO_REPROVACAO = {sql_str(user['name'])},
-                DATA_REPROVACAO    = CURRENT_TIMESTAMP(),
-                MOTIVO             = {sql_str(obs)}
-            WHERE ID IN ({ids_csv})
-        """
-        toast_icon = "❌"
-        destino_legenda = "Correção"
-        for _id in ids:
-            try:
-                cod = None
-                row = df_items.loc[df_items["ID"] == _id]
-                if not row.empty and "CODIGO_PRODUTO" in row.columns:
-                    cod = None if pd.isna(row["CODIGO_PRODUTO"].iloc[0]) else str(row["CODIGO_PRODUTO"].iloc[0])
-                log_reprovacao(
-                    session,
-                    item_id=_id,
-                    codigo_produto=cod,
-                    origem=FQN_MAIN,
-                    destino=FQN_COR,
-                    motivo=obs,
-                    user=user,
-                )
-            except Exception:
-                pass
-
-    # 3) Delete da principal
-    sql_delete_main = f"DELETE FROM {FQN_MAIN} WHERE ID IN ({ids_csv})"
-
-    # 4) Transação atômica
+        tr, toast_icon, destino_legenda = REPROVAR, "❌", "Correção"
     try:
-        session.sql("BEGIN").collect()
-        session.sql(sql_move_insert).collect()
-        if sql_move_meta:
-            session.sql(sql_move_meta).collect()
-        session.sql(sql_delete_main).collect()
-        session.sql("COMMIT").collect()
-        st.toast(f"{len(ids)} item(ns) movidos para {destino_legenda}.", icon=toast_icon)
-    except Exception as e:
-        session.sql("ROLLBACK").collect()
-        st.error(f"Falha ao mover itens: {e}")
-
-def approve_correcoes(session, edited_df: pd.DataFrame, ids: list[int], user: dict):
-    """
-    Atualiza os campos editados em FQN_COR, move para FQN_APR, audita e remove da FQN_COR.
-    """
-    if not ids:
-        return
-
-    session.sql("ALTER SESSION SET TIMEZONE = 'America/Sao_Paulo'").collect()
-
-    # mapa id -> linha editada (somente ids selecionados)
-    edited_map = {int(r["ID"]): r for _, r in edited_df.iterrows() if int(r["ID"]) in ids}
-
-    # Colunas comuns para mover
-    cols_cor   = [c.name for c in session.table(FQN_COR).schema]
-    cols_aprov = [c.name for c in session.table(FQN_APR).schema]
-    common_cols = [c for c in cols_cor if c in cols_aprov]
-    col_list = ", ".join(common_cols)
-
-    # Auditoria
-    values_audit = []
-    for _id in ids:
-        row = edited_map[_id]
-        cod = None if pd.isna(row.get("CODIGO_PRODUTO")) else str(row.get("CODIGO_PRODUTO"))
-        values_audit.append(
-            f"({_id}, {sql_str(cod)}, 'APROVADO', {sql_str('Aprovado após correção')}, {sql_str(user['username'])}, {sql_str(user['name'])})"
+        res = call_transition(
+            session, tr, ids, user=user, note=obs,
+            procedure=transition_procedure(), columns=table_columns,
         )
-
-    try:
-        session.sql("BEGIN").collect()
-
-        # 1) UPDATE no CORRECOES com os campos editáveis
-        for _id in ids:
-            row = edited_map[_id]
-            sets = []
-            for c in EDITABLE_COR_COLS:
-                if c in row:
-                    sets.append(f'{c} = {sql_str(row[c])}')
-            if sets:
-                sql_upd = f"UPDATE {FQN_COR} SET {', '.join(sets)}, DATA_ATUALIZACAO = CURRENT_TIMESTAMP() WHERE ID = {_id}"
-                session.sql(sql_upd).collect()
-
-        # 2) Move para APROVADOS
-        sql_insert = f"""
-            INSERT INTO {FQN_APR} ({col_list})
-            SELECT {col_list}
-            FROM {FQN_COR}
-            WHERE ID IN ({", ".join(str(i) for i in ids)})
-        """
-        session.sql(sql_insert).collect()
-
-        # 3) Metadados de aprovação (se existirem as colunas)
-        cols_apr_all = [c.name for c in session.table(FQN_APR).schema]
-        meta_sets = []
-        if "USUARIO_APROVACAO" in cols_apr_all:
-            meta_sets.append(f"USUARIO_APROVACAO = {sql_str(user['name'])}")
-        if "DATA_APROVACAO" in cols_apr_all:
-            meta_sets.append("DATA_APROVACAO = CURRENT_TIMESTAMP()")
-
-        if meta_sets:
-            session.sql(f"""
-                UPDATE {FQN_APR}
-                SET {', '.join(meta_sets)}
-                WHERE ID IN ({", ".join(str(i) for i in ids)})
-            """).collect()
-
-
-        # 5) Remove do CORRECOES
-        session.sql(f"DELETE FROM {FQN_COR} WHERE ID IN ({', '.join(str(i) for i in ids)})").collect()
-
-        session.sql("COMMIT").collect()
-        st.toast(f"{len(ids)} item(ns) aprovados e movidos para o Catálogo.", icon="✅")
+        get_main_snapshot().mark_stale()
+        (get_apr_snapshot() if decisao == "APROVADO" else get_cor_snapshot()).mark_stale()
+        st.toast(f"{res.moved} item(ns) movidos para {destino_legenda}.", icon=toast_icon)
     except Exception as e:
-        session.sql("ROLLBACK").collect()
-        st.error(f"Falha ao aprovar correções: {e}")
+        st.error(f"Falha ao mover itens: {e}")
 
 # ==============================
 # Página
@@ -409,53 +181,17 @@ st.title("✅ Validação de Itens")
 
 user = current_user()
 session = get_session()
-session.sql("ALTER SESSION SET TIMEZONE = 'America/Sao_Paulo'").collect()
 
 # ----------Filtros ----------
 
-ALL_LABEL = "Todos"
-NULL_LABEL = "(vazio)"
-def norm_str_series(s: pd.Series, *, drop_dot_zero: bool = False) -> pd.Series:
-    """
-    Normaliza valores para filtros:
-    - converte para string
-    - remove .0 no final (útil p/ EAN vindo como float)
-    - strip
-    - vazio -> NA
-    """
-    s = s.astype("string")
-    if drop_dot_zero:
-        s = s.str.replace(r"\.0$", "", regex=True)
-    s = s.str.strip()
-    s = s.replace(["", "nan", "NaN", "None"], pd.NA)
-    return s
-
-def dropdown_options(s_norm: pd.Series, *, all_label: str = ALL_LABEL, null_label: str = NULL_LABEL) -> list[str]:
-    opts = [all_label]
-    if s_norm.isna().any():
-        opts.append(null_label)
-
-    uniq = pd.Series(pd.unique(s_norm.dropna())).astype("string")
-    uniq = uniq[uniq.str.len() > 0].sort_values()
-    opts.extend(uniq.tolist())
-    return opts
-
-def apply_dropdown_to_mask(
-    mask: pd.Series,
-    s_norm: pd.Series,
-    selected: str,
-    *,
-    all_label: str = ALL_LABEL,
-    null_label: str = NULL_LABEL
-) -> pd.Series:
-    if selected == all_label:
-        return mask
-    if selected == null_label:
-        return mask & s_norm.isna()
-    return mask & (s_norm == selected)
-
-
-df_all = listar_itens_df(session)
+user_map = load_user_display_map(session)
+# snapshot local da tabela de pendentes (delta por ID); filtros aplicados em memória
+try:
+    df_main = get_main_snapshot().frame(session)
+except Exception as e:
+    st.error(f"Falha ao carregar itens: {e}")
+    st.stop()
+df_all = listar_itens_df(session, None, user_map, df_source=df_main)
 
 def user_has_role(u: dict, role: str) -> bool:
     role = role.upper()
@@ -472,132 +208,12 @@ is_admin = user_has_role(user, "ADMIN")
 if df_all.empty:
         st.info("Nenhum item cadastrado ainda.")
 else:
-        user_map = load_user_display_map(session)
-
-        
         ###
         st.subheader("Filtros")
 
-        # Séries normalizadas (df_all inteiro)
-        s_insumo = norm_str_series(df_all["INSUMO"]) if "INSUMO" in df_all.columns else pd.Series(pd.NA, index=df_all.index, dtype="string")
-        s_codigo = norm_str_series(df_all["CODIGO_PRODUTO"], drop_dot_zero=True) if "CODIGO_PRODUTO" in df_all.columns else pd.Series(pd.NA, index=df_all.index, dtype="string")
-
-        opt_insumo = dropdown_options(s_insumo)
-        opt_codigo = dropdown_options(s_codigo)
-
-        # =========================
-        # Linha 1 (4 colunas)
-        # ID | Usuário | Insumo | Código
-        # =========================
-        r1 = st.columns(4)
-        with r1[0]:
-            sel_id = st.text_input("ID", key="val_f_id")
-        with r1[1]:
-            sel_user = st.selectbox(
-                "Usuário (cadastro)",
-                build_user_options(df_all, user_map),
-                index=0,
-                key="val_sel_user"
-            )
-        with r1[2]:
-            sel_insumo = st.selectbox(
-                "Insumo",
-                opt_insumo,
-                index=0,
-                key="val_sel_insumo_dd"
-            )
-        with r1[3]:
-            sel_codigo = st.selectbox(
-                "Código do Produto (exato)",
-                opt_codigo,
-                index=0,
-                key="val_sel_codigo_dd"
-            )
-
-        # =========================
-        # Linha 2 (4 colunas)
-        # Palavra-chave | Grupo | Categoria | Segmento
-        # =========================
-        r2 = st.columns(4)
-        with r2[0]:
-            f_palavra = st.text_input("Palavra-chave (contém)", key="val_f_palavra")
-
-        # 1) mask base: usuário + palavra
-        mask = apply_common_filters(
-            df_all,
-            sel_user_name=sel_user,
-            f_insumo="",
-            f_codigo="",
-            f_palavra=f_palavra,
-            user_map=user_map,
-        )
-
-        # 2) aplica Insumo/Código exatos
-        mask = apply_dropdown_to_mask(mask, s_insumo, sel_insumo)
-        mask = apply_dropdown_to_mask(mask, s_codigo, sel_codigo)
-
-        # 3) aplica ID exato
-        sel_id_norm = (sel_id or "").strip()
-        if sel_id_norm:
-            if "ID" in df_all.columns and sel_id_norm.isdigit():
-                mask = mask & (df_all["ID"].astype("Int64") == int(sel_id_norm))
-            else:
-                st.warning("ID inválido. Use um número inteiro.")
-                mask = mask & False
-
-        # 4) escopo inicial para cascata
-        df_scope = df_all[mask].copy()
-
-        with r2[1]:
-            s_grupo_sc, opt_grupo_sc = _series_and_opts(df_scope, "GRUPO")
-            sel_grupo = _selectbox_with_reset("Grupo", opt_grupo_sc, key="val_sel_grupo_dd")
-            df_scope = _apply_selected(df_scope, s_grupo_sc, sel_grupo)
-
-        with r2[2]:
-            s_cat_sc, opt_cat_sc = _series_and_opts(df_scope, "CATEGORIA")
-            sel_categoria = _selectbox_with_reset("Categoria", opt_cat_sc, key="val_sel_categoria_dd")
-            df_scope = _apply_selected(df_scope, s_cat_sc, sel_categoria)
-
-        with r2[3]:
-            s_seg_sc, opt_seg_sc = _series_and_opts(df_scope, "SEGMENTO")
-            sel_segmento = _selectbox_with_reset("Segmento", opt_seg_sc, key="val_sel_segmento_dd")
-            df_scope = _apply_selected(df_scope, s_seg_sc, sel_segmento)
-
-        # =========================
-        # Linha 3 (4 colunas)
-        # Família | Subfamília | (vazio) | (vazio)
-        # =========================
-        r3 = st.columns(4)
-        with r3[0]:
-            s_fam_sc, opt_fam_sc = _series_and_opts(df_scope, "FAMILIA")
-            sel_familia = _selectbox_with_reset("Família", opt_fam_sc, key="val_sel_familia_dd")
-            df_scope = _apply_selected(df_scope, s_fam_sc, sel_familia)
-
-        with r3[1]:
-            s_sub_sc, opt_sub_sc = _series_and_opts(df_scope, "SUBFAMILIA")
-            sel_subfamilia = _selectbox_with_reset("Subfamília", opt_sub_sc, key="val_sel_subfamilia_dd")
-            df_scope = _apply_selected(df_scope, s_sub_sc, sel_subfamilia)
-
-        with r3[2]:
-            st.empty()
-        with r3[3]:
-            st.empty()
-
-        # Resultado final (já filtrado pela cascata)
-        df_view = df_scope
-
-        mask = apply_common_filters(
-            df_all,
-            sel_user_name=sel_user,
-            f_insumo="",  
-            f_codigo="",   
-            f_palavra=f_palavra,  # mantém
-            user_map=user_map,
-        )
-
-        # Aplica filtros dropdown (exatos)
-        mask = apply_dropdown_to_mask(mask, s_insumo, sel_insumo)
-        mask = apply_dropdown_to_mask(mask, s_codigo, sel_codigo)
+        # ID | Usuário | Insumo | Código / Palavra-chave | cascata: posições das linhas de df_all
+        rows = FilterPanel("val", get_main_snapshot(), df_all, user_map).render()
+        df_view = expand_frame(df_all.iloc[rows])
 
         if df_view.empty:
                 st.info("Nenhum item com os filtros aplicados.")
@@ -616,10 +232,12 @@ else:
                         if select_all_val:
                             df_view["Validar"] = True
 
+                base_deriv = df_view[[c for c in ("ID", "DESCRICAO", "SINONIMO") if c in df_view.columns]].copy()
                 df_view = _recalc_sinonimo_df_inplace(df_view)
 
                 try:
-                    _persist_sinonimo_batch(session, FQN_MAIN, df_view[["ID", "DESCRICAO", "SINONIMO"]])
+                    # só grava linhas cujo DESCRICAO/SINONIMO recalculado difere do carregado
+                    _persist_sinonimo_batch(session, FQN_MAIN, df_view[["ID", "DESCRICAO", "SINONIMO"]], baseline=base_deriv)
                 except Exception as e:
                     st.warning(f"Não foi possível atualizar SINONIMO/descrição (pendentes): {e}")
 
@@ -680,7 +298,7 @@ else:
                 try:
                     sel_df = df_all[df_all["ID"].isin(ids)].copy()
                     sel_df = _recalc_sinonimo_df_inplace(sel_df)
-                    _persist_sinonimo_batch(session, FQN_MAIN, sel_df[["ID","DESCRICAO","SINONIMO"]])
+                    _persist_sinonimo_batch(session, FQN_MAIN, sel_df[["ID","DESCRICAO","SINONIMO"]], baseline=df_all)
                 except Exception as e:
                     st.warning(f"Falha ao sincronizar SINONIMO antes da aprovação: {e}")
                 c1, c2 = st.columns(2)
@@ -698,7 +316,7 @@ else:
                 try:
                     sel_df = df_all[df_all["ID"].isin(ids)].copy()
                     sel_df = _recalc_sinonimo_df_inplace(sel_df)
-                    _persist_sinonimo_batch(session, FQN_MAIN, sel_df[["ID","DESCRICAO","SINONIMO"]])
+                    _persist_sinonimo_batch(session, FQN_MAIN, sel_df[["ID","DESCRICAO","SINONIMO"]], baseline=df_all)
                 except Exception as e:
                     st.warning(f"Falha ao sincronizar SINONIMO antes da rejeição: {e}")
                 c1, c2 = st.columns(2)
@@ -1,9 +1,20 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 from io import BytesIO
+from dataclasses import replace
 import hashlib
+import time
 from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
-from src.db_snowflake import apply_common_filters, build_user_options, get_session, load_user_display_map
+from src.db_snowflake import (
+    CASCADE_COLS, CatalogFilter, count_filtered, distinct_values, fetch_page_by_id, fetch_rows_by_ids,
+    get_session, load_user_display_map, load_user_options,
+)
+from src.snapshot import get_apr_projected_snapshot, get_apr_snapshot
+from src.compact import expand_frame
+from src.facets import ALL_LABEL, NULL_LABEL, dropdown_options, norm_str_series
+from src.filter_panel import FilterPanel, selectbox_with_reset
+from src.selection import selection_state
 from src.utils import order_catalogo
 from src.auth import require_roles, current_user
 from src.variables import FQN_APR
@@ -45,48 +56,6 @@ def build_datetime_column_config(df: pd.DataFrame, cols: list[str]) -> dict:
             cfg[c] = st.column_config.DatetimeColumn(format="DD/MM/YYYY HH:mm", disabled=True)
     return cfg
 
-ALL_LABEL = "Todos"
-NULL_LABEL = "(vazio)"
-
-def norm_str_series(s: pd.Series, *, drop_dot_zero: bool = False) -> pd.Series:
-    """
-    Normaliza valores para filtros:
-    - converte para string
-    - remove .0 no final (útil p/ EAN vindo como float)
-    - strip
-    - vazio -> NA
-    """
-    s = s.astype("string")
-    if drop_dot_zero:
-        s = s.str.replace(r"\.0$", "", regex=True)
-    s = s.str.strip()
-    s = s.replace(["", "nan", "NaN", "None"], pd.NA)
-    return s
-
-def dropdown_options(s_norm: pd.Series, *, all_label: str = ALL_LABEL, null_label: str = NULL_LABEL) -> list[str]:
-    opts = [all_label]
-    if s_norm.isna().any():
-        opts.append(null_label)
-
-    uniq = pd.Series(pd.unique(s_norm.dropna())).astype("string")
-    uniq = uniq[uniq.str.len() > 0].sort_values()
-    opts.extend(uniq.tolist())
-    return opts
-
-def apply_dropdown_to_mask(
-    mask: pd.Series,
-    s_norm: pd.Series,
-    selected: str,
-    *,
-    all_label: str = ALL_LABEL,
-    null_label: str = NULL_LABEL
-) -> pd.Series:
-    if selected == all_label:
-        return mask
-    if selected == null_label:
-        return mask & s_norm.isna()
-    return mask & (s_norm == selected)
-
 # ===== Auth & page =====
 require_roles("USER", "OPERACIONAL", "ADMIN")
 user = current_user()
@@ -114,6 +83,15 @@ USER_COLS_SPEC = [
     ("Embalagem",          "EMB_PRODUTO"),
 ]
 
+# Colunas que o perfil USER precisa: a visão + as usadas nos filtros locais (Insumo/Código/cascata)
+USER_LOAD_COLS = list(dict.fromkeys(
+    ["ID"] + [c for _, c in USER_COLS_SPEC] + ["INSUMO", "CODIGO_PRODUTO"] + CASCADE_COLS
+))
+LOAD_COLS = USER_LOAD_COLS if is_user_role else None
+# snapshot do perfil USER: só LOAD_COLS (+ usuário, para o filtro) saem do banco;
+# a palavra-chave é resolvida no banco (FilterPanel)
+SNAPSHOT_COLS = tuple(USER_LOAD_COLS + ["USUARIO_CADASTRO"]) if is_user_role else None
+
 def build_user_view(df: pd.DataFrame) -> pd.DataFrame:
     out = pd.DataFrame(index=df.index)
 
@@ -136,10 +114,22 @@ def build_user_view(df: pd.DataFrame) -> pd.DataFrame:
     return out
 
 
-KEY_SELECTED = "cat_selected_keys"
+KEY_SELECTED = "cat_selected_ids"          # IdSelection (bitmap por ID)
 KEY_EDITOR = "cat_table_editor"
 KEY_SELECT_ALL = "cat_select_all_visible"
-KEY_VISIBLE_KEYS = "cat_visible_row_keys"
+KEY_VISIBLE_KEYS = "cat_visible_ids"       # IDs da tabela atual (para o callback do toggle)
+
+# Modo paginado (keyset por ID)
+KEY_PAGED = "cat_paged"
+KEY_PG_SIZE = "cat_pg_size"
+KEY_PG_CURSORS = "cat_pg_cursors"   # pilha com o último ID de cada página anterior (None = início)
+KEY_PG_SIG = "cat_pg_sig"           # filtros + tamanho da página usados para montar a pilha
+KEY_PG_NONCE = "cat_pg_nonce"       # muda a key do editor quando a seleção é alterada por botão
+KEY_PG_SELECTED = "cat_pg_selected_ids"
+KEY_PG_DATA = "cat_pg_data"         # (sig, cursor) -> página já lida (rerun sem mudar de página não vai ao banco)
+KEY_PG_SEL_DATA = "cat_pg_sel_data" # IDs selecionados -> linhas já lidas (download)
+PAGE_SIZES = [50, 100, 200, 500]
+PG_CACHE_TTL_S = 60                 # opções da cascata e COUNT por (tabela, filtros)
 
 FILTER_KEYS = [
     "cat_f_id",
@@ -152,10 +142,16 @@ FILTER_KEYS = [
     "cat_sel_segmento_dd",
     "cat_sel_familia_dd",
     "cat_sel_subfamilia_dd",
+    "cat_pg_f_insumo",
+    "cat_pg_f_codigo",
 ]
 
 def reset_catalogo_page_state():
-    for k in FILTER_KEYS + [KEY_SELECTED, KEY_EDITOR, KEY_SELECT_ALL, KEY_VISIBLE_KEYS]:
+    pg_keys = [
+        KEY_PG_CURSORS, KEY_PG_SIG, KEY_PG_SELECTED, KEY_PG_DATA, KEY_PG_SEL_DATA,
+        "cat_load_cancel", "cat_load_cancel__parcial",
+    ]
+    for k in FILTER_KEYS + [KEY_SELECTED, KEY_EDITOR, KEY_SELECT_ALL, KEY_VISIBLE_KEYS] + pg_keys:
         st.session_state.pop(k, None)
     st.rerun()
 
@@ -172,10 +168,204 @@ def df_to_xlsx_bytes(df: pd.DataFrame, sheet_name: str = "catalogo") -> bytes:
         df_x.to_excel(writer, index=False, sheet_name=sheet_name)
     return bio.getvalue()
 
+@st.cache_data(show_spinner=False, ttl=PG_CACHE_TTL_S)
+def pg_distinct_values(_session, table_fqn: str, col: str, spec: CatalogFilter, user_map: dict) -> pd.Series:
+    # chave: tabela + coluna + filtros (CatalogFilter é imutável) + mapa de usuários
+    return distinct_values(_session, table_fqn, col, spec, user_map=user_map)
+
+@st.cache_data(show_spinner=False, ttl=PG_CACHE_TTL_S)
+def pg_count(_session, table_fqn: str, spec: CatalogFilter, user_map: dict) -> int:
+    return count_filtered(_session, table_fqn, spec, user_map=user_map)
+
+DT_COLS = ["DATA_CADASTRO", "DATA_APROVACAO", "DATA_VALIDACAO", "DATA_ATUALIZACAO"]
+
 # ===== Dados =====
 session = get_session()
+user_map = load_user_display_map(session)
+
+paged = st.toggle(
+    "Navegação paginada (por ID)",
+    key=KEY_PAGED,
+    help="Carrega uma página por vez direto do banco; indicado para catálogos grandes.",
+)
+
+# =========================
+# Modo paginado: só a página atual sai do Snowflake
+# =========================
+if paged:
+    st.subheader("Filtros")
+
+    if st.button("🧹 Limpar filtros", key="cat_btn_limpar_filtros"):
+        reset_catalogo_page_state()
+
+    r1 = st.columns(4)
+    with r1[0]:
+        sel_id = st.text_input("ID", key="cat_f_id")
+    with r1[1]:
+        st.selectbox(
+            "Usuário (cadastro)",
+            load_user_options(session, FQN_APR, user_map),
+            index=0,
+            key="cat_sel_user"
+        )
+    with r1[2]:
+        pg_insumo = st.text_input("Insumo (contém)", key="cat_pg_f_insumo")
+    with r1[3]:
+        pg_codigo = st.text_input("Código do Produto (contém)", key="cat_pg_f_codigo")
+
+    r2 = st.columns(4)
+    with r2[0]:
+        st.text_input("Palavra-chave (contém)", key="cat_f_palavra")
+
+    sel_id_norm = (sel_id or "").strip()
+    if sel_id_norm and not sel_id_norm.isdigit():
+        st.warning("ID inválido. Use um número inteiro.")
+
+    pg_spec = replace(
+        CatalogFilter.from_state("cat"),
+        insumo=(pg_insumo or "").strip() or None,
+        codigo=(pg_codigo or "").strip() or None,
+    )
+
+    # cascata: opções de cada nível via DISTINCT no banco, já restritas pelos níveis acima
+    r3 = st.columns(4)
+    cascata = [
+        ("GRUPO", "Grupo", r2[1]),
+        ("CATEGORIA", "Categoria", r2[2]),
+        ("SEGMENTO", "Segmento", r2[3]),
+        ("FAMILIA", "Família", r3[0]),
+        ("SUBFAMILIA", "Subfamília", r3[1]),
+    ]
+    for col, label, slot in cascata:
+        opts = dropdown_options(norm_str_series(pg_distinct_values(session, FQN_APR, col, pg_spec, user_map)))
+        with slot:
+            sel = selectbox_with_reset(label, opts, key=f"cat_sel_{col.lower()}_dd")
+        if sel != ALL_LABEL:
+            pg_spec = pg_spec.with_exact(col, None if sel == NULL_LABEL else sel)
+
+    page_size = st.selectbox("Itens por página", PAGE_SIZES, index=1, key=KEY_PG_SIZE)
+
+    # filtros ou tamanho mudaram -> volta para a primeira página
+    sig = (pg_spec, page_size)
+    if st.session_state.get(KEY_PG_SIG) != sig or KEY_PG_CURSORS not in st.session_state:
+        st.session_state[KEY_PG_SIG] = sig
+        st.session_state[KEY_PG_CURSORS] = [None]
+        st.session_state[KEY_PG_NONCE] = st.session_state.get(KEY_PG_NONCE, 0) + 1
+    cursors = st.session_state[KEY_PG_CURSORS]
+
+    try:
+        total = pg_count(session, FQN_APR, pg_spec, user_map)
+        # página só é relida quando filtros/tamanho (sig) ou o cursor mudam (ou após o TTL)
+        chave_pg = (sig, cursors[-1])
+        cache_pg = st.session_state.get(KEY_PG_DATA)
+        if cache_pg is None or cache_pg[0] != chave_pg or time.monotonic() - cache_pg[1] > PG_CACHE_TTL_S:
+            cache_pg = (chave_pg, time.monotonic(), fetch_page_by_id(
+                session, FQN_APR, pg_spec,
+                after_id=cursors[-1], limit=page_size, user_map=user_map, columns=LOAD_COLS,
+            ))
+            st.session_state[KEY_PG_DATA] = cache_pg
+        df_page = cache_pg[2]
+    except Exception as e:
+        st.error(f"Falha ao carregar aprovados: {e}")
+        st.stop()
+
+    page_no = len(cursors)
+    n_pages = max(1, -(-total // page_size))
+    st.caption(f"Itens no catalogo: **{total}** • Página **{page_no}** de **{n_pages}**")
+
+    df_page = reorder(order_catalogo(df_page), ORDER_CATALOGO)
+    df_page = coerce_datetimes(df_page, DT_COLS)
+    page_ids = df_page["ID"].astype("int64") if "ID" in df_page.columns else pd.Series([], dtype="int64")
+
+    if not isinstance(st.session_state.get(KEY_PG_SELECTED), set):
+        st.session_state[KEY_PG_SELECTED] = set(st.session_state.get(KEY_PG_SELECTED) or [])
+
+    def _pg_next(last_id: int):
+        st.session_state[KEY_PG_CURSORS].append(last_id)
+
+    def _pg_prev():
+        if len(st.session_state[KEY_PG_CURSORS]) > 1:
+            st.session_state[KEY_PG_CURSORS].pop()
+
+    def _pg_set_selection(ids: set[int]):
+        st.session_state[KEY_PG_SELECTED] = ids
+        st.session_state[KEY_PG_NONCE] = st.session_state.get(KEY_PG_NONCE, 0) + 1
+
+    n1, n2, n3, n4 = st.columns([1, 1, 1.6, 1.6])
+    with n1:
+        st.button("◀ Anterior", key="cat_pg_prev", on_click=_pg_prev, disabled=page_no <= 1)
+    with n2:
+        st.button(
+            "Próxima ▶",
+            key="cat_pg_next",
+            on_click=_pg_next,
+            args=(int(page_ids.iloc[-1]) if len(page_ids) else 0,),
+            disabled=page_no >= n_pages or page_ids.empty,
+        )
+    with n3:
+        st.button(
+            "Selecionar página",
+            key="cat_pg_select_page",
+            on_click=lambda: _pg_set_selection(st.session_state[KEY_PG_SELECTED] | set(page_ids.tolist())),
+        )
+    with n4:
+        st.button("Limpar seleção", key="cat_pg_clear_sel", on_click=lambda: _pg_set_selection(set()))
+
+    sel_ids: set[int] = st.session_state[KEY_PG_SELECTED]
+
+    if is_user_role:
+        df_view = build_user_view(df_page)
+        col_cfg = {}
+    else:
+        df_view = df_page.copy()
+        col_cfg = build_datetime_column_config(df_page, DT_COLS)
+    col_cfg["Selecionada"] = st.column_config.CheckboxColumn("Selecionada", help="Marque para incluir no download.")
+
+    df_view.insert(0, "Selecionada", page_ids.isin(list(sel_ids)).to_numpy())
+    df_edited = st.data_editor(
+        df_view,
+        use_container_width=True,
+        hide_index=True,
+        column_config=col_cfg,
+        disabled=[c for c in df_view.columns if c != "Selecionada"],
+        num_rows="fixed",
+        key=f"cat_pg_editor_{st.session_state[KEY_PG_NONCE]}_{page_no}",
+    )
+
+    # seleção por ID: mantém o que foi marcado em outras páginas
+    marcados = set(page_ids[df_edited["Selecionada"].to_numpy(dtype=bool)].tolist())
+    sel_ids = (sel_ids - set(page_ids.tolist())) | marcados
+    st.session_state[KEY_PG_SELECTED] = sel_ids
+
+    st.caption(f"Selecionados (todas as páginas): **{len(sel_ids)}**")
+
+    # linhas dos selecionados: só relidas quando a seleção muda
+    cache_sel = st.session_state.get(KEY_PG_SEL_DATA)
+    if cache_sel is None or cache_sel[0] != frozenset(sel_ids):
+        cache_sel = (
+            frozenset(sel_ids),
+            fetch_rows_by_ids(session, FQN_APR, sel_ids, columns=LOAD_COLS) if sel_ids else pd.DataFrame(),
+        )
+        st.session_state[KEY_PG_SEL_DATA] = cache_sel
+    df_sel = cache_sel[1]
+    if not df_sel.empty:
+        df_sel = coerce_datetimes(reorder(order_catalogo(df_sel), ORDER_CATALOGO), DT_COLS)
+    df_download = build_user_view(df_sel).reset_index(drop=True) if is_user_role else df_sel
+
+    st.download_button(
+        "Baixar itens selecionados",
+        data=df_to_xlsx_bytes(df_download, sheet_name="selecionados"),
+        file_name="catalogo_selecionados.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        disabled=df_sel.empty,
+        key="cat_btn_download_selected",
+    )
+    st.stop()
+
+# Snapshot local sincronizado por delta; os filtros (FilterPanel) rodam sobre ele
 try:
-    df = session.table(FQN_APR).to_pandas()
+    snap_apr = get_apr_projected_snapshot(SNAPSHOT_COLS) if SNAPSHOT_COLS else get_apr_snapshot()
+    df = snap_apr.frame(session, columns=LOAD_COLS, cancel_key="cat_load_cancel")
     df = order_catalogo(df)
 except Exception as e:
     st.error(f"Falha ao carregar aprovados: {e}")
@@ -187,190 +377,36 @@ if df.empty:
 
 # Ordenação exigida
 df = reorder(df, ORDER_CATALOGO)
-DT_COLS = ["DATA_CADASTRO", "DATA_APROVACAO", "DATA_VALIDACAO", "DATA_ATUALIZACAO"]
 df = coerce_datetimes(df, DT_COLS)
 dt_cfg = build_datetime_column_config(df, DT_COLS)
-user_map = load_user_display_map(session)
 
 st.subheader("Filtros")
 
 if st.button("🧹 Limpar filtros", key="cat_btn_limpar_filtros"):
     reset_catalogo_page_state()
 
-# Séries normalizadas (para opções e comparação)
-s_insumo = norm_str_series(df["INSUMO"]) if "INSUMO" in df.columns else pd.Series(pd.NA, index=df.index, dtype="string")
-s_codigo = norm_str_series(df["CODIGO_PRODUTO"], drop_dot_zero=True) if "CODIGO_PRODUTO" in df.columns else pd.Series(pd.NA, index=df.index, dtype="string")
-
-s_grupo = norm_str_series(df["GRUPO"]) if "GRUPO" in df.columns else pd.Series(pd.NA, index=df.index, dtype="string")
-s_categoria = norm_str_series(df["CATEGORIA"]) if "CATEGORIA" in df.columns else pd.Series(pd.NA, index=df.index, dtype="string")
-s_segmento = norm_str_series(df["SEGMENTO"]) if "SEGMENTO" in df.columns else pd.Series(pd.NA, index=df.index, dtype="string")
-s_familia = norm_str_series(df["FAMILIA"]) if "FAMILIA" in df.columns else pd.Series(pd.NA, index=df.index, dtype="string")
-s_subfamilia = norm_str_series(df["SUBFAMILIA"]) if "SUBFAMILIA" in df.columns else pd.Series(pd.NA, index=df.index, dtype="string")
-
-# Opções
-opt_insumo = dropdown_options(s_insumo)
-opt_codigo = dropdown_options(s_codigo)
-
-opt_grupo = dropdown_options(s_grupo)
-opt_categoria = dropdown_options(s_categoria)
-opt_segmento = dropdown_options(s_segmento)
-opt_familia = dropdown_options(s_familia)
-opt_subfamilia = dropdown_options(s_subfamilia)
-
-# =========================
-# Linha 1 (4 colunas)
-# ID | Usuário | Insumo | Código
-# =========================
-r1 = st.columns(4)
-with r1[0]:
-    sel_id = st.text_input("ID", key="cat_f_id")
-with r1[1]:
-    sel_user = st.selectbox(
-        "Usuário (cadastro)",
-        build_user_options(df, user_map),
-        index=0,
-        key="cat_sel_user"
-    )
-with r1[2]:
-    sel_insumo = st.selectbox(
-        "Insumo",
-        opt_insumo,
-        index=0,
-        key="cat_sel_insumo_dd"
-    )
-with r1[3]:
-    sel_codigo = st.selectbox(
-        "Código do Produto (exato)",
-        opt_codigo,
-        index=0,
-        key="cat_sel_codigo_dd"
-    )
-
-# =========================
-# Linha 2 (4 colunas)
-# Palavra-chave | Grupo | Categoria | Segmento
-# =========================
-r2 = st.columns(4)
-with r2[0]:
-    f_palavra = st.text_input("Palavra-chave (contém)", key="cat_f_palavra")
-
-# mask base (usuário + palavra)
-mask = apply_common_filters(
-    df,
-    sel_user_name=sel_user,
-    f_insumo="",
-    f_codigo="",
-    f_palavra=f_palavra,
-    user_map=user_map,
-)
-
-# aplica Insumo/Código (exatos) no mask base
-mask = apply_dropdown_to_mask(mask, s_insumo, sel_insumo)
-mask = apply_dropdown_to_mask(mask, s_codigo, sel_codigo)
-
-# aplica ID (exato) no mask base
-sel_id_norm = (sel_id or "").strip()
-if sel_id_norm:
-    if "ID" in df.columns and sel_id_norm.isdigit():
-        mask = mask & (df["ID"].astype("Int64") == int(sel_id_norm))
-    else:
-        st.warning("ID inválido. Use um número inteiro.")
-        mask = mask & False
-
-# escopo inicial para cascata
-df_scope = df[mask].copy()
-
-# helpers da cascata (mantém os seus)
-def _series_and_opts(df_in: pd.DataFrame, col: str, *, drop_dot_zero: bool = False):
-    if col in df_in.columns:
-        s = norm_str_series(df_in[col], drop_dot_zero=drop_dot_zero)
-    else:
-        s = pd.Series(pd.NA, index=df_in.index, dtype="string")
-    return s, dropdown_options(s)
-
-def _apply_selected(df_in: pd.DataFrame, s_norm: pd.Series, selected: str) -> pd.DataFrame:
-    if selected == ALL_LABEL:
-        return df_in
-    if selected == NULL_LABEL:
-        return df_in[s_norm.isna()]
-    return df_in[s_norm == selected]
-
-def _selectbox_with_reset(label: str, options: list[str], key: str) -> str:
-    cur = st.session_state.get(key, ALL_LABEL)
-    if cur not in options:
-        st.session_state[key] = ALL_LABEL
-        cur = ALL_LABEL
-    return st.selectbox(label, options, index=options.index(cur), key=key)
-
-with r2[1]:
-    s_grupo_sc, opt_grupo_sc = _series_and_opts(df_scope, "GRUPO")
-    sel_grupo = _selectbox_with_reset("Grupo", opt_grupo_sc, key="cat_sel_grupo_dd")
-    df_scope = _apply_selected(df_scope, s_grupo_sc, sel_grupo)
-
-with r2[2]:
-    s_cat_sc, opt_cat_sc = _series_and_opts(df_scope, "CATEGORIA")
-    sel_categoria = _selectbox_with_reset("Categoria", opt_cat_sc, key="cat_sel_categoria_dd")
-    df_scope = _apply_selected(df_scope, s_cat_sc, sel_categoria)
-
-with r2[3]:
-    s_seg_sc, opt_seg_sc = _series_and_opts(df_scope, "SEGMENTO")
-    sel_segmento = _selectbox_with_reset("Segmento", opt_seg_sc, key="cat_sel_segmento_dd")
-    df_scope = _apply_selected(df_scope, s_seg_sc, sel_segmento)
-
-# =========================
-# Linha 3 (4 colunas)
-# Família | Subfamília | (vazio) | (vazio)
-# =========================
-r3 = st.columns(4)
-with r3[0]:
-    s_fam_sc, opt_fam_sc = _series_and_opts(df_scope, "FAMILIA")
-    sel_familia = _selectbox_with_reset("Família", opt_fam_sc, key="cat_sel_familia_dd")
-    df_scope = _apply_selected(df_scope, s_fam_sc, sel_familia)
-
-with r3[1]:
-    s_sub_sc, opt_sub_sc = _series_and_opts(df_scope, "SUBFAMILIA")
-    sel_subfamilia = _selectbox_with_reset("Subfamília", opt_sub_sc, key="cat_sel_subfamilia_dd")
-    df_scope = _apply_selected(df_scope, s_sub_sc, sel_subfamilia)
-
-with r3[2]:
-    st.empty()
-with r3[3]:
-    st.empty()
+# ID | Usuário | Insumo | Código / Palavra-chave | cascata: posições das linhas de df
+rows = FilterPanel("cat", snap_apr, df, user_map, session=session).render()
 
 # ✅ Resultado final (já com cascata + filtros globais + ID)
-df_filtrado = df_scope
+# frame compacto (category/float32) volta aos tipos do banco só no recorte: tabela e xlsx
+df_filtrado = expand_frame(df.iloc[rows])
 # ===== Tabela =====
 st.caption(f"Itens no catalogo: **{len(df_filtrado)}**")
 
-# Inicializa seleção em memória
-if KEY_SELECTED not in st.session_state:
-    st.session_state[KEY_SELECTED] = set()
-elif not isinstance(st.session_state[KEY_SELECTED], set):
-    st.session_state[KEY_SELECTED] = set(st.session_state[KEY_SELECTED] or [])
-
-selected_set = set(st.session_state[KEY_SELECTED])
-
-# Chave única por linha
-if "ID" in df_filtrado.columns:
-    base_id = df_filtrado["ID"].astype("string").fillna("")
-else:
-    base_id = df_filtrado.index.astype("string")
-
-row_key = (base_id + "|" + df_filtrado.index.astype(str)).astype("string")
-current_keys = set(row_key.tolist())
+# Seleção por ID (bitmap em memória; mantém o que foi marcado fora do recorte atual)
+selection = selection_state(KEY_SELECTED)
+view_ids = df_filtrado["ID"].to_numpy(dtype=np.int64)
 
-# Guarda as chaves visíveis para o callback do toggle
-st.session_state[KEY_VISIBLE_KEYS] = row_key.tolist()
+# Guarda os IDs visíveis para o callback do toggle
+st.session_state[KEY_VISIBLE_KEYS] = view_ids
 
 def _toggle_all_visible():
-    keys = set(st.session_state.get(KEY_VISIBLE_KEYS, []))
-    sel = st.session_state.get(KEY_SELECTED, set())
-    if not isinstance(sel, set):
-        sel = set(sel or [])
+    ids = st.session_state.get(KEY_VISIBLE_KEYS, np.empty(0, dtype=np.int64))
     if st.session_state.get(KEY_SELECT_ALL, False):
-        st.session_state[KEY_SELECTED] = sel | keys
+        selection_state(KEY_SELECTED).add_many(ids)
     else:
-        st.session_state[KEY_SELECTED] = sel - keys
+        selection_state(KEY_SELECTED).discard_many(ids)
 
 # Barra acima da tabela (placeholder para o toggle)
 b1, b2, b3 = st.columns([1.3, 2.5, 6])
@@ -395,14 +431,10 @@ else:
 
 # Sempre cria a coluna Selecionada no índice 0
 df_editor = df_view.copy()
-df_editor.insert(
-    0,
-    "Selecionada",
-    row_key.isin(pd.Series(list(selected_set), dtype="string")).to_numpy()
-)
+df_editor.insert(0, "Selecionada", selection.contains(view_ids))
 
-# Index = row_key (para mapear seleção)
-df_editor.index = row_key
+# Index = ID (para mapear seleção)
+df_editor.index = view_ids
 
 # Deixa tudo read-only, exceto Selecionada
 disabled_cols = [c for c in df_editor.columns if c != "Selecionada"]
@@ -417,15 +449,12 @@ df_edited = st.data_editor(
     key=KEY_EDITOR,
 )
 
-# Atualiza seleção com base no que foi marcado manualmente na tabela
-selected_now = set(df_edited.index[df_edited["Selecionada"]].tolist())
-
-# Preserva seleções que não estão visíveis + aplica o estado atual visível
-st.session_state[KEY_SELECTED] = (selected_set - current_keys) | selected_now
-selected_set = set(st.session_state[KEY_SELECTED])
+# Atualiza seleção com base no que foi marcado manualmente na tabela (só os IDs visíveis)
+selection.assign(df_edited.index.to_numpy(dtype=np.int64), df_edited["Selecionada"].to_numpy(dtype=bool))
+in_view = selection.contains(view_ids)
 
 # Agora que a seleção foi atualizada, sincroniza o toggle (todos visíveis selecionados?)
-all_visible_selected = (len(current_keys) > 0) and current_keys.issubset(selected_set)
+all_visible_selected = bool(len(view_ids)) and bool(in_view.all())
 st.session_state[KEY_SELECT_ALL] = all_visible_selected
 
 # Renderiza o toggle no placeholder (fica acima da tabela)
@@ -437,9 +466,7 @@ with toggle_ph:
     )
 
 # Selecionados (apenas do recorte atual)
-selected_in_view = selected_set & current_keys
-mask_sel = row_key.isin(list(selected_in_view))
-df_selected_base = df_filtrado[mask_sel].copy()
+df_selected_base = df_filtrado.iloc[np.flatnonzero(in_view)]
 
 st.caption(f"Selecionados (nesta tabela): **{len(df_selected_base)}**")
 
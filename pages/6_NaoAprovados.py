@@ -1,9 +1,13 @@
 import streamlit as st
 import pandas as pd
-from src.db_snowflake import apply_common_filters, build_user_options, get_session, load_user_display_map
+from src.db_snowflake import changed_rows, get_session, load_user_display_map, refresh_search_doc, table_columns, transition_procedure
 from src.auth import current_user, require_roles
-from src.utils import extrair_valores, gerar_sinonimo, gerar_palavra_chave
+from src.utils import extrair_valores, gerar_sinonimo, gerar_palavra_chave, extrair_valores_series, gerar_sinonimo_series, gerar_palavra_chave_series
 from src.variables import FQN_MAIN, FQN_COR, FQN_APR
+from src.snapshot import get_cor_snapshot, get_main_snapshot
+from src.compact import expand_frame
+from src.filter_panel import FilterPanel
+from src.transitions import REENVIAR_VALIDACAO, call_transition
 
 st.title("Não Aprovados")
 
@@ -61,12 +65,6 @@ def build_datetime_column_config(df: pd.DataFrame, cols: list[str]) -> dict:
     return cfg
 
 
-def sql_str(v):
-    if v is None or (isinstance(v, float) and pd.isna(v)): 
-        return "NULL"
-    s = str(v).replace("'", "''")
-    return f"'{s}'"
-
 
 def _sql_escape(val):
     import pandas as pd
@@ -80,23 +78,6 @@ def _build_desc(row_after) -> str:
     """Recalcula DESCRICAO sempre a partir de ESPECIFICACAO."""
     return extrair_valores(row_after.get("ESPECIFICACAO", "") or "")
 
-def _build_sinonimo_like_update(row_after) -> str:
-    """
-    Recalcula SINONIMO com a MESMA assinatura usada na 5_Atualizacao.
-    """
-    desc = _build_desc(row_after)
-    return gerar_sinonimo(
-        row_after.get("ITEM"),
-        desc or row_after.get("DESCRICAO") or "",
-        row_after.get("MARCA"),
-        row_after.get("FABRICANTE"),
-        row_after.get("QTD_MED"),
-        row_after.get("UN_MED"),
-        row_after.get("EMB_PRODUTO"),
-        row_after.get("QTD_EMB_COMERCIAL"),
-        row_after.get("EMB_COMERCIAL"),
-    )
-
 def _recalc_sinonimo_df_inplace(df: pd.DataFrame) -> pd.DataFrame:
     """
     Recalcula DESCRICAO (se vazia) e SINONIMO para TODAS as linhas visíveis no DataFrame.
@@ -107,38 +88,42 @@ def _recalc_sinonimo_df_inplace(df: pd.DataFrame) -> pd.DataFrame:
     if "DESCRICAO" not in df.columns:
         df["DESCRICAO"] = ""
 
-    def _calc(row):
-        # monta um dict estilo "row_after" (igual 5_Atualizacao)
-        row_after = row.to_dict()
-        novo_desc = _build_desc(row_after)
-        row_after["DESCRICAO"] = novo_desc
-        return novo_desc, _build_sinonimo_like_update(row_after)
-
-    out = df.apply(lambda r: pd.Series(_calc(r), index=["__DESC_NEW__", "__SIN_NEW__"]), axis=1)
-    df["DESCRICAO"] = out["__DESC_NEW__"]
-    df["SINONIMO"] = out["__SIN_NEW__"]
+    # mesmas regras de _build_desc + assinatura da 5_Atualizacao, coluna a coluna (sem df.apply por linha)
+    col = lambda c: df[c] if c in df.columns else None
+    novo_desc = extrair_valores_series(df["ESPECIFICACAO"]) if "ESPECIFICACAO" in df.columns else ""
+    df["DESCRICAO"] = novo_desc
+    df["SINONIMO"] = gerar_sinonimo_series(
+        col("ITEM"), df["DESCRICAO"], col("MARCA"), col("FABRICANTE"), col("QTD_MED"),
+        col("UN_MED"), col("EMB_PRODUTO"), col("QTD_EMB_COMERCIAL"), col("EMB_COMERCIAL"),
+    )
     return df
 
 def _recalc_palavra_chave_df_inplace(df: pd.DataFrame) -> pd.DataFrame:
     if "PALAVRA_CHAVE" not in df.columns:
         df["PALAVRA_CHAVE"] = ""
-    df["PALAVRA_CHAVE"] = df.apply(lambda r: gerar_palavra_chave(
-        r.get("SUBFAMILIA"), r.get("ITEM"), r.get("MARCA"),
-        r.get("FABRICANTE"), r.get("EMB_PRODUTO"), r.get("QTD_MED"), r.get("UN_MED"),
-        r.get("FAMILIA"),
-    ), axis=1)
+    col = lambda c: df[c] if c in df.columns else None
+    df["PALAVRA_CHAVE"] = gerar_palavra_chave_series(
+        col("SUBFAMILIA"), col("ITEM"), col("MARCA"),
+        col("FABRICANTE"), col("EMB_PRODUTO"), col("QTD_MED"), col("UN_MED"),
+        col("FAMILIA"),
+    )
     return df
 
-def _persist_sinonimo_batch(session, table_fqn: str, df_ids: pd.DataFrame, id_col: str = "ID"):
+def _persist_sinonimo_batch(session, table_fqn: str, df_ids: pd.DataFrame, id_col: str = "ID", *, baseline: pd.DataFrame | None = None):
     """
     Atualiza no banco em lote:
       - Atualiza DESCRICAO (apenas quando calculada nova)
       - Atualiza SINONIMO (sempre com o valor recalculado)
       - Atualiza PALAVRA_CHAVE (quando presente no df_ids)
     Usa CASE ... WHEN ... THEN ... para eficiência.
+    Com `baseline` (valores carregados, antes do recálculo), grava só as linhas que mudaram.
     """
     if df_ids.empty or id_col not in df_ids or "SINONIMO" not in df_ids:
         return
+    if baseline is not None:
+        df_ids = changed_rows(df_ids, baseline, ["DESCRICAO", "SINONIMO", "PALAVRA_CHAVE"], id_col)
+        if df_ids.empty:
+            return
 
     work = df_ids[[id_col, "SINONIMO"]].copy()
     has_desc = "DESCRICAO" in df_ids.columns
@@ -178,6 +163,18 @@ def _persist_sinonimo_batch(session, table_fqn: str, df_ids: pd.DataFrame, id_co
         WHERE {id_col} IN ({ids_csv})
     """
     session.sql(sql).collect()
+    refresh_search_doc(session, table_fqn, f"{id_col} IN ({ids_csv})")
+
+    # reflete no snapshot local (UPDATE sem coluna de data não aparece no delta)
+    snap = {FQN_MAIN: get_main_snapshot, FQN_COR: get_cor_snapshot}.get(table_fqn)
+    if snap is not None:
+        snap().patch(pd.DataFrame([(i, s) for (i, s, _, __) in pairs], columns=["ID", "SINONIMO"]))
+        desc = [(i, d) for (i, _, d, __) in pairs if d is not None]
+        if desc:
+            snap().patch(pd.DataFrame(desc, columns=["ID", "DESCRICAO"]))
+        pcs = [(i, p) for (i, _, __, p) in pairs if p is not None]
+        if pcs:
+            snap().patch(pd.DataFrame(pcs, columns=["ID", "PALAVRA_CHAVE"]))
 
 KEY_SELECTED = "cor_selected_keys"
 KEY_EDITOR = "cor_table_editor"
@@ -202,285 +199,52 @@ def reset_catalogo_page_state():
         st.session_state.pop(k, None)
     st.rerun()
 
-##### Filtros
-ALL_LABEL = "Todos"
-NULL_LABEL = "(vazio)"
-def norm_str_series(s: pd.Series, *, drop_dot_zero: bool = False) -> pd.Series:
-    """
-    Normaliza valores para filtros:
-    - converte para string
-    - remove .0 no final (útil p/ EAN vindo como float)
-    - strip
-    - vazio -> NA
-    """
-    s = s.astype("string")
-    if drop_dot_zero:
-        s = s.str.replace(r"\.0$", "", regex=True)
-    s = s.str.strip()
-    s = s.replace(["", "nan", "NaN", "None"], pd.NA)
-    return s
-
-def dropdown_options(s_norm: pd.Series, *, all_label: str = ALL_LABEL, null_label: str = NULL_LABEL) -> list[str]:
-    opts = [all_label]
-    if s_norm.isna().any():
-        opts.append(null_label)
-
-    uniq = pd.Series(pd.unique(s_norm.dropna())).astype("string")
-    uniq = uniq[uniq.str.len() > 0].sort_values()
-    opts.extend(uniq.tolist())
-    return opts
-
-
-
-def apply_dropdown_to_mask(
-    mask: pd.Series,
-    s_norm: pd.Series,
-    selected: str,
-    *,
-    all_label: str = ALL_LABEL,
-    null_label: str = NULL_LABEL
-) -> pd.Series:
-    if selected == all_label:
-        return mask
-    if selected == null_label:
-        return mask & s_norm.isna()
-    return mask & (s_norm == selected)
-
-
-def _series_and_opts(df_in: pd.DataFrame, col: str, *, drop_dot_zero: bool = False):
-    if col in df_in.columns:
-        s = norm_str_series(df_in[col], drop_dot_zero=drop_dot_zero)
-    else:
-        s = pd.Series(pd.NA, index=df_in.index, dtype="string")
-    return s, dropdown_options(s)
-
-def _apply_selected(df_in: pd.DataFrame, s_norm: pd.Series, selected: str) -> pd.DataFrame:
-    if selected == ALL_LABEL:
-        return df_in
-    if selected == NULL_LABEL:
-        return df_in[s_norm.isna()]
-    return df_in[s_norm == selected]
-
-def _selectbox_with_reset(label: str, options: list[str], key: str) -> str:
-    cur = st.session_state.get(key, ALL_LABEL)
-    if cur not in options:
-        st.session_state[key] = ALL_LABEL
-        cur = ALL_LABEL
-    return st.selectbox(label, options, index=options.index(cur), key=key)
-
 def resend_to_validacao(session, edited_df: pd.DataFrame, ids: list[int], user: dict):
     """
     Atualiza campos editáveis em FQN_COR, move de FQN_COR -> FQN_MAIN (fila de validação),
-    zera campos de validação em MAIN, audita e remove de FQN_COR.
+    zera campos de validação em MAIN e remove de FQN_COR.
     """
     if not ids:
         return
-
-    session.sql("ALTER SESSION SET TIMEZONE = 'America/Sao_Paulo'").collect()
-
-    # mapa id -> linha editada (somente ids selecionados)
-    edited_map = {int(r["ID"]): r for _, r in edited_df.iterrows() if int(r["ID"]) in ids}
-
-    cols_cor   = [c.name for c in session.table(FQN_COR).schema]
-    cols_main  = [c.name for c in session.table(FQN_MAIN).schema]
-    common_cols = [c for c in cols_cor if c in cols_main]
-    col_list = ", ".join(common_cols)
-
-    # Auditoria: marcar ação de reenvio para validação
-    values_audit = []
-    for _id in ids:
-        row = edited_map[_id]
-        cod = None if pd.isna(row.get("CODIGO_PRODUTO")) else str(row.get("CODIGO_PRODUTO"))
-        values_audit.append(
-            f"({_id}, {sql_str(cod)}, 'REENVIADO_VALIDACAO', {sql_str('Reenviado para validação após correção')}, {sql_str(user['username'])}, {sql_str(user['name'])})"
-        )
-
-    ids_csv = ", ".join(str(i) for i in ids)
-
+    sel = edited_df[edited_df["ID"].astype(int).isin([int(i) for i in ids])]
     try:
-        session.sql("BEGIN").collect()
-
-        # 1) UPDATE nos campos editáveis em COR + carimbar DATA_ATUALIZACAO
-        for _id in ids:
-            row = edited_map[_id]
-            sets = []
-            for c in EDITABLE_COR_COLS:
-                if c in row:
-                    sets.append(f"{c} = {sql_str(row[c])}")
-            if sets:
-                sql_upd = f"""
-                    UPDATE {FQN_COR}
-                    SET {', '.join(sets)}, DATA_ATUALIZACAO = CURRENT_TIMESTAMP()
-                    WHERE ID = {_id}
-                """
-                session.sql(sql_upd).collect()
-
-        # 2) Inserir de COR -> MAIN (fila de validação)
-        sql_insert = f"""
-            INSERT INTO {FQN_MAIN} ({col_list})
-            SELECT {col_list}
-            FROM {FQN_COR}
-            WHERE ID IN ({ids_csv})
-        """
-        session.sql(sql_insert).collect()
-
-        # 3) Zerar campos de validação e atualizar metadados em MAIN
-        # (se as colunas existirem)
-        cols_main_all = set(cols_main)
-        meta_sets = []
-
-        if "DATA_ATUALIZACAO" in cols_main_all:
-            meta_sets.append("DATA_ATUALIZACAO = NULL")
-        if "USUARIO_ATUALIZACAO" in cols_main_all:
-            meta_sets.append("USUARIO_ATUALIZACAO = NULL")
-        
-        if meta_sets:
-            # usamos os mesmos IDs recém inseridos; como a PK é ID e foi copiada, funciona 1:1
-            session.sql(f"""
-                UPDATE {FQN_MAIN}
-                SET {', '.join(meta_sets)}
-                WHERE ID IN ({ids_csv})
-            """).collect()
-
-
-        # 5) Remover do COR
-        session.sql(f"DELETE FROM {FQN_COR} WHERE ID IN ({ids_csv})").collect()
-
-        session.sql("COMMIT").collect()
-        st.toast(f"{len(ids)} item(ns) reenviado(s) para Validação.", icon="📤")
+        res = call_transition(
+            session, REENVIAR_VALIDACAO, ids, user=user,
+            edits=sel.to_dict("records"), edit_cols=EDITABLE_COR_COLS,
+            procedure=transition_procedure(), columns=table_columns,
+        )
+        get_cor_snapshot().mark_stale()
+        get_main_snapshot().mark_stale()
+        st.toast(f"{res.moved} item(ns) reenviado(s) para Validação.", icon="📤")
     except Exception as e:
-        session.sql("ROLLBACK").collect()
         st.error(f"Falha ao reenviar para validação: {e}")
 
+user_map = load_user_display_map(session)
+
 try:        
-        df_cor = session.sql(f"""
-            SELECT * EXCLUDE (DATA_ATUALIZACAO, USUARIO_ATUALIZACAO)
-            FROM {FQN_COR}
-        """).to_pandas()
+        # snapshot local da tabela de correções (delta por ID); filtros aplicados em memória
+        snap_cor = get_cor_snapshot()
+        df_cor = snap_cor.frame(session)
+        df_cor = df_cor.drop(columns=[c for c in ("DATA_ATUALIZACAO", "USUARIO_ATUALIZACAO") if c in df_cor.columns])
 
         if "REPROVADO_EM" in df_cor.columns:
             df_cor = df_cor.sort_values("REPROVADO_EM", ascending=False)
 except Exception as e:
         st.error(f"Erro ao carregar correções: {e}")
+        snap_cor = None
         df_cor = pd.DataFrame()
 
 if df_cor.empty:
         st.info("Nenhum item reprovado.")
 else:
-        user_map = load_user_display_map(session)
-
         ####
         st.subheader("Filtros")
         if st.button("🧹 Limpar filtros", key="cor_btn_limpar_filtros"):
             reset_catalogo_page_state()
 
-        # Séries normalizadas (para opções e comparação) — df_cor inteiro
-        s_insumo = norm_str_series(df_cor["INSUMO"]) if "INSUMO" in df_cor.columns else pd.Series(pd.NA, index=df_cor.index, dtype="string")
-        s_codigo = norm_str_series(df_cor["CODIGO_PRODUTO"], drop_dot_zero=True) if "CODIGO_PRODUTO" in df_cor.columns else pd.Series(pd.NA, index=df_cor.index, dtype="string")
-
-        opt_insumo = dropdown_options(s_insumo)
-        opt_codigo = dropdown_options(s_codigo)
-
-        # =========================
-        # Linha 1 (4 colunas)
-        # ID | Usuário | Insumo | Código
-        # =========================
-        r1 = st.columns(4)
-        with r1[0]:
-            sel_id = st.text_input("ID", key="cor_f_id")
-        with r1[1]:
-            sel_user = st.selectbox(
-                "Usuário (cadastro)",
-                build_user_options(df_cor, user_map),
-                index=0,
-                key="cor_sel_user",
-            )
-        with r1[2]:
-            sel_insumo = st.selectbox(
-                "Insumo",
-                opt_insumo,
-                index=0,
-                key="cor_sel_insumo_dd",
-            )
-        with r1[3]:
-            sel_codigo = st.selectbox(
-                "Código do Produto (exato)",
-                opt_codigo,
-                index=0,
-                key="cor_sel_codigo_dd",
-            )
-
-        # =========================
-        # Linha 2 (4 colunas)
-        # Palavra-chave | Grupo | Categoria | Segmento
-        # =========================
-        r2 = st.columns(4)
-        with r2[0]:
-            f_palavra = st.text_input("Palavra-chave (contém)", key="cor_f_palavra")
-
-        # 1) mask base: usuário + palavra
-        mask = apply_common_filters(
-            df_cor,
-            sel_user_name=sel_user,
-            f_insumo="",
-            f_codigo="",
-            f_palavra=f_palavra,
-            user_map=user_map,
-        )
-
-        # 2) aplica Insumo/Código exatos no mask base
-        mask = apply_dropdown_to_mask(mask, s_insumo, sel_insumo)
-        mask = apply_dropdown_to_mask(mask, s_codigo, sel_codigo)
-
-        # 3) aplica ID (exato)
-        sel_id_norm = (sel_id or "").strip()
-        if sel_id_norm:
-            if "ID" in df_cor.columns and sel_id_norm.isdigit():
-                mask = mask & (df_cor["ID"].astype("Int64") == int(sel_id_norm))
-            else:
-                st.warning("ID inválido. Use um número inteiro.")
-                mask = mask & False
-
-        # 4) escopo inicial para cascata
-        df_scope = df_cor[mask].copy()
-
-        with r2[1]:
-            s_grupo_sc, opt_grupo_sc = _series_and_opts(df_scope, "GRUPO")
-            sel_grupo = _selectbox_with_reset("Grupo", opt_grupo_sc, key="cor_sel_grupo_dd")
-            df_scope = _apply_selected(df_scope, s_grupo_sc, sel_grupo)
-
-        with r2[2]:
-            s_cat_sc, opt_cat_sc = _series_and_opts(df_scope, "CATEGORIA")
-            sel_categoria = _selectbox_with_reset("Categoria", opt_cat_sc, key="cor_sel_categoria_dd")
-            df_scope = _apply_selected(df_scope, s_cat_sc, sel_categoria)
-
-        with r2[3]:
-            s_seg_sc, opt_seg_sc = _series_and_opts(df_scope, "SEGMENTO")
-            sel_segmento = _selectbox_with_reset("Segmento", opt_seg_sc, key="cor_sel_segmento_dd")
-            df_scope = _apply_selected(df_scope, s_seg_sc, sel_segmento)
-
-        # =========================
-        # Linha 3 (4 colunas)
-        # Família | Subfamília | (vazio) | (vazio)
-        # =========================
-        r3 = st.columns(4)
-        with r3[0]:
-            s_fam_sc, opt_fam_sc = _series_and_opts(df_scope, "FAMILIA")
-            sel_familia = _selectbox_with_reset("Família", opt_fam_sc, key="cor_sel_familia_dd")
-            df_scope = _apply_selected(df_scope, s_fam_sc, sel_familia)
-
-        with r3[1]:
-            s_sub_sc, opt_sub_sc = _series_and_opts(df_scope, "SUBFAMILIA")
-            sel_subfamilia = _selectbox_with_reset("Subfamília", opt_sub_sc, key="cor_sel_subfamilia_dd")
-            df_scope = _apply_selected(df_scope, s_sub_sc, sel_subfamilia)
-
-        with r3[2]:
-            st.empty()
-        with r3[3]:
-            st.empty()
-
-        # Resultado final já filtrado pela cascata
-        df_cor_view = df_scope
+        # ID | Usuário | Insumo | Código / Palavra-chave | cascata: posições das linhas de df_cor
+        rows = FilterPanel("cor", snap_cor, df_cor, user_map).render()
+        df_cor_view = expand_frame(df_cor.iloc[rows])
 
         ####
         if df_cor_view.empty:
@@ -501,10 +265,11 @@ else:
             if st.button("Recarregar tabela"):
                 st.rerun()
 
+            base_deriv = df_cor_view[[c for c in ("ID", "DESCRICAO", "SINONIMO") if c in df_cor_view.columns]].copy()
             df_cor_view = _recalc_sinonimo_df_inplace(df_cor_view)
-            # (Opcional) persistir já em COR para refletir na base
+            # (Opcional) persistir já em COR para refletir na base — só linhas que mudaram
             try:
-                _persist_sinonimo_batch(session, FQN_COR, df_cor_view[["ID","DESCRICAO","SINONIMO"]])
+                _persist_sinonimo_batch(session, FQN_COR, df_cor_view[["ID","DESCRICAO","SINONIMO"]], baseline=base_deriv)
             except Exception as e:
                 st.warning(f"Não foi possível atualizar SINONIMO/descrição (correções): {e}")
 
@@ -601,6 +366,7 @@ else:
                         _persist_sinonimo_batch(
                             session, FQN_COR,
                             sel_df[["ID","DESCRICAO","SINONIMO","PALAVRA_CHAVE"]],
+                            baseline=df_cor,
                         )
                     except Exception as e:
                         st.warning(f"Falha ao sincronizar SINONIMO/PALAVRA_CHAVE antes do reenvio: {e}")
@@ -2,11 +2,13 @@ import streamlit as st
 import pandas as pd
 from snowflake.snowpark import functions as F
 from snowflake.snowpark.window import Window
-from datetime import datetime, timezone
 
 from src.auth import require_roles, current_user
-from src.db_snowflake import get_session
+from src.db_snowflake import get_session, table_columns, transition_procedure
 from src.variables import FQN_APR, FQN_RMV, FQN_LOG_RMV
+from src.search_doc import INTERNAL_COLS
+from src.snapshot import get_apr_snapshot
+from src.transitions import REMOVER, call_transition
 
 require_roles("ADMIN")
 
@@ -17,13 +19,9 @@ session = get_session()
 FQN_CATALOGO = FQN_APR
 
 
-def _esc(s: str) -> str:
-    return (s or "").replace("'", "''")
-
-
 def load_df(f_insumo: str, f_id: str, f_ean: str) -> pd.DataFrame:
     t = session.table(FQN_CATALOGO)
-    cat_cols = {c.upper() for c in t.schema.names}
+    cat_cols = {c.upper() for c in table_columns(session, FQN_CATALOGO)}
 
     if f_insumo.strip() and "INSUMO" in cat_cols:
         t = t.filter(F.col("INSUMO").ilike(f"%{f_insumo.strip()}%"))
@@ -130,59 +128,24 @@ with tab1:
                 st.error("Nenhum ID válido selecionado para remoção.")
                 st.stop()
 
-            ids_in = ",".join(str(i) for i in ids)
-
             try:
                 u = current_user()
                 usuario = u.get("username", "admin")
-                now_ntz = datetime.now(timezone.utc).replace(tzinfo=None).strftime("%Y-%m-%d %H:%M:%S")
-
-                # Expressões seguras caso alguma coluna não exista no catálogo
-                cat_cols = {c.upper() for c in session.table(FQN_CATALOGO).schema.names}
-                codigo_expr = "CODIGO_PRODUTO" if "CODIGO_PRODUTO" in cat_cols else "CAST(NULL AS STRING)"
-                insumo_expr = "INSUMO" if "INSUMO" in cat_cols else "CAST(NULL AS STRING)"
-
-                session.sql("BEGIN TRANSACTION").collect()
-
-                # 1) Move o registro inteiro para removidos
-                session.sql(f"""
-                    INSERT INTO {FQN_RMV}
-                    SELECT *
-                    FROM {FQN_CATALOGO}
-                    WHERE ID IN ({ids_in})
-                """).collect()
-
-                # 2) Log (um único INSERT...SELECT)
-                session.sql(f"""
-                    INSERT INTO {FQN_LOG_RMV}
-                        (ID, CODIGO_PRODUTO, INSUMO, MOTIVO, DATA_REMOCAO, USUARIO_REMOCAO)
-                    SELECT
-                        ID,
-                        {codigo_expr},
-                        {insumo_expr},
-                        '{_esc(motivo)}',
-                        '{now_ntz}',
-                        '{_esc(usuario)}'
-                    FROM {FQN_CATALOGO}
-                    WHERE ID IN ({ids_in})
-                """).collect()
-
-                # 3) Remove do catálogo
-                session.sql(f"DELETE FROM {FQN_CATALOGO} WHERE ID IN ({ids_in})").collect()
-
-                session.sql("COMMIT").collect()
+
+                # move para removidos + log + delete, numa transação
+                res = call_transition(
+                    session, REMOVER, ids, user={"username": usuario}, note=motivo,
+                    procedure=transition_procedure(), columns=table_columns,
+                )
 
                 # limpa cache para recarregar da fonte
                 st.session_state.pop("rmv_df", None)
+                get_apr_snapshot().mark_stale()
 
-                st.success(f"Remoção concluída. Itens movidos: {len(ids)}")
+                st.success(f"Remoção concluída. Itens movidos: {res.moved}")
                 st.rerun()
 
             except Exception as e:
-                try:
-                    session.sql("ROLLBACK").collect()
-                except Exception:
-                    pass
                 st.error(f"Falha ao remover/mover: {e}")
                 st.stop()
 
@@ -196,8 +159,8 @@ with tab2:
         st.error(f"Falha ao carregar tabelas de removidos/log: {e}")
         st.stop()
 
-    rmv_cols = {c.upper() for c in rmv.schema.names}
-    log_cols = {c.upper() for c in log.schema.names}
+    rmv_cols = {c.upper() for c in table_columns(session, FQN_RMV)}
+    log_cols = {c.upper() for c in table_columns(session, FQN_LOG_RMV)}
 
     if "CODIGO_PRODUTO" not in rmv_cols or "CODIGO_PRODUTO" not in log_cols:
         st.error("Para o merge, ambas as tabelas precisam ter a coluna CODIGO_PRODUTO.")
@@ -224,8 +187,8 @@ with tab2:
         how="left",
     )
 
-    # Todas as colunas do removido + as 3 do log
-    rmv_select_cols = [rmv[c] for c in rmv.columns]
+    # Todas as colunas do removido (menos as internas) + as 3 do log
+    rmv_select_cols = [rmv[c] for c in rmv.columns if c not in INTERNAL_COLS]
 
     final_df = joined.select(
         *rmv_select_cols,
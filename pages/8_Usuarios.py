@@ -5,6 +5,7 @@ import uuid
 from src.auth import require_roles, current_user
 from src.db_snowflake import (
     get_session,
+    table_columns,
     users_create_or_update,
     users_list_usernames,
 )
@@ -28,7 +29,7 @@ def _esc(s: str) -> str:
 
 # Carrega usuários
 t = session.table(FQN_USERS)
-cols = [c.upper() for c in t.schema.names]
+cols = [c.upper() for c in table_columns(session, FQN_USERS)]
 
 base_cols = [c for c in ["USERNAME", "NAME", "ROLE"] if c in cols]
 if "USERNAME" not in base_cols or "ROLE" not in base_cols:
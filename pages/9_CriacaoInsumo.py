@@ -3,9 +3,10 @@ import pandas as pd
 from io import BytesIO
 from datetime import datetime
 
-from src.db_snowflake import get_session
+from src.db_snowflake import get_session, stream_to_pandas, table_columns
 from src.auth import require_roles, current_user
 from src.variables import FQN_APR
+from src.snapshot import get_apr_snapshot
 
 
 # ==============================
@@ -57,7 +58,7 @@ def _persist_insumo_batch(session, table_fqn: str, df_before: pd.DataFrame, df_a
     if changed.empty:
         return 0
 
-    cols_tbl = {c.name.upper() for c in session.sql(f"SELECT * FROM {table_fqn} LIMIT 0").schema}
+    cols_tbl = {c.upper() for c in table_columns(session, table_fqn)}
 
     ids = [int(x) for x in changed["ID"].tolist()]
     ids_csv = ", ".join(str(i) for i in ids)
@@ -80,6 +81,8 @@ def _persist_insumo_batch(session, table_fqn: str, df_before: pd.DataFrame, df_a
         WHERE ID IN ({ids_csv})
     """
     session.sql(sql).collect()
+    if table_fqn == FQN_APR:
+        get_apr_snapshot().mark_stale()
     return len(ids)
 
 
@@ -88,20 +91,19 @@ def load_df_from_fqn(session, table_fqn: str, wanted_cols: list[str] | None = No
     Carrega dados diretamente de um FQN (tabela/view) no Snowflake.
     Se wanted_cols for informado, seleciona apenas as colunas que existirem.
     """
-    # Descobre colunas existentes sem puxar dados
-    sp0 = session.sql(f"SELECT * FROM {table_fqn} LIMIT 0")
-    existing = [c.name for c in sp0.schema]  # nomes já vêm no case do Snowflake (geralmente UPPER)
+    # Descobre colunas existentes sem puxar dados (cache de schema)
+    existing = table_columns(session, table_fqn)  # nomes já vêm no case do Snowflake (geralmente UPPER)
 
     if wanted_cols:
         cols = [c for c in wanted_cols if c in existing]
         if not cols:
             # fallback: pega tudo
-            return session.sql(f"SELECT * FROM {table_fqn}").to_pandas()
+            return stream_to_pandas(session.sql(f"SELECT * FROM {table_fqn}"))
 
         select_list = ", ".join([f'"{c}"' for c in cols])  # quote seguro
-        return session.sql(f"SELECT {select_list} FROM {table_fqn}").to_pandas()
+        return stream_to_pandas(session.sql(f"SELECT {select_list} FROM {table_fqn}"))
 
-    return session.sql(f"SELECT * FROM {table_fqn}").to_pandas()
+    return stream_to_pandas(session.sql(f"SELECT * FROM {table_fqn}"))
 
 
 # ==============================
@@ -113,7 +115,6 @@ st.set_page_config(page_title="Catálogo • Criação de Insumo", layout="wide"
 st.title("📦 Criação de Insumo")
 
 session = get_session()
-session.sql("ALTER SESSION SET TIMEZONE = 'America/Sao_Paulo'").collect()
 
 BASE_COLS = [
     "ID", "CODIGO_PRODUTO", "INSUMO"
@@ -0,0 +1,82 @@
+from __future__ import annotations
+import math
+import threading
+from typing import Any, Iterable
+
+import pandas as pd
+import streamlit as st
+from snowflake.snowpark import Session
+
+from src.db_snowflake import ORIGEM_APR, ORIGEM_PEND, fetch_codigo_origens
+from src.snapshot import get_apr_snapshot, get_main_snapshot
+
+# =========================
+# Índice de CODIGO_PRODUTO (conjunto em memória)
+# =========================
+
+
+def _norm_codigo(c: Any) -> str:
+    if c is None or (isinstance(c, float) and math.isnan(c)):
+        return ""
+    return str(c).strip()
+
+
+class CodigoIndex:
+    """
+    Códigos existentes em TBL_CATALOGO_INSUMOS e TBL_CATALOGO_APROVADOS, em memória do processo.
+    Acompanha os snapshots dessas tabelas (delta incremental) e só é reconstruído quando a
+    versão de algum deles muda. Positivo é confirmado no banco; negativo é só uma prévia
+    (o snapshot pode estar atrasado): quem grava confere de novo no servidor (insert_item).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versoes: tuple[int, int] | None = None
+        self._codigos: frozenset[str] = frozenset()
+
+    def _refresh(self, session: Session) -> None:
+        main, apr = get_main_snapshot(), get_apr_snapshot()
+        df_main = main.frame(session, columns=["CODIGO_PRODUTO"], progress=False)
+        df_apr = apr.frame(session, columns=["CODIGO_PRODUTO"], progress=False)
+        versoes = (main.version, apr.version)
+        if versoes == self._versoes:
+            return
+        with self._lock:
+            if versoes == self._versoes:
+                return
+            series = [d["CODIGO_PRODUTO"] for d in (df_main, df_apr) if "CODIGO_PRODUTO" in d.columns]
+            cods = pd.concat(series, ignore_index=True).unique() if series else []
+            self._codigos = frozenset(c for c in (_norm_codigo(x) for x in cods) if c)
+            self._versoes = versoes
+
+    def origens(self, session: Session, codigos: Iterable[Any]) -> dict[str, set[str]]:
+        """Como fetch_codigo_origens, mas só vai ao banco com os códigos que o índice acusa."""
+        self._refresh(session)
+        candidatos = [c for c in {_norm_codigo(x) for x in codigos} if c and c in self._codigos]
+        if not candidatos:
+            return {}
+        return fetch_codigo_origens(session, candidatos)
+
+    def exists_any(self, session: Session, codigo: str | None) -> tuple[bool, str]:
+        """Mesmo contrato de codigo_produto_exists_any: (existe, "APROVADOS" | "PENDENTES" | "")."""
+        codigo = _norm_codigo(codigo)
+        if not codigo:
+            return (False, "")
+        origens = self.origens(session, [codigo]).get(codigo, set())
+        if ORIGEM_APR in origens:
+            return (True, ORIGEM_APR)
+        if ORIGEM_PEND in origens:
+            return (True, ORIGEM_PEND)
+        return (False, "")
+
+    def existing_dual(self, session: Session, codigos: list[str]) -> tuple[set[str], set[str]]:
+        """Mesmo contrato de fetch_existing_codigos_dual: (exist_pend, exist_aprv)."""
+        origens = self.origens(session, codigos)
+        exist_pend = {c for c, o in origens.items() if ORIGEM_PEND in o}
+        exist_aprv = {c for c, o in origens.items() if ORIGEM_APR in o}
+        return exist_pend, exist_aprv
+
+
+@st.cache_resource(show_spinner=False)
+def get_codigo_index() -> CodigoIndex:
+    return CodigoIndex()
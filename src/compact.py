@@ -0,0 +1,135 @@
+from __future__ import annotations
+from typing import Callable, Iterable, Mapping
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import CategoricalDtype, infer_dtype, is_bool_dtype, is_integer_dtype
+from snowflake.snowpark import Session
+
+from src.variables import (
+    FQN_TBL_CATEGORIA, FQN_TBL_EMB_COMERCIAL, FQN_TBL_EMB_PRODUTO, FQN_TBL_FABRICANTE, FQN_TBL_FAMILIA,
+    FQN_TBL_GRUPO, FQN_TBL_MARCA, FQN_TBL_SEGMENTO, FQN_TBL_SUBFAMILIA, FQN_TBL_TIPO_CODIGO, FQN_TBL_UN_MED,
+)
+
+# =========================
+# Frames compactos (categóricos + numéricos reduzidos)
+# =========================
+# Colunas de baixa cardinalidade viram category (códigos int8/int16 em vez de um ponteiro
+# por linha), com as categorias das tabelas de dimensão + o que aparecer no frame, em ordem
+# alfabética (sort_values continua igual ao de texto). Inteiros descem para o menor tipo;
+# float só vira float32 quando nenhum valor muda.
+# Telas que editam (data_editor, .loc com valor novo) usam expand_frame antes.
+
+DIM_TABLES = {
+    "GRUPO": FQN_TBL_GRUPO,
+    "CATEGORIA": FQN_TBL_CATEGORIA,
+    "SEGMENTO": FQN_TBL_SEGMENTO,
+    "FAMILIA": FQN_TBL_FAMILIA,
+    "SUBFAMILIA": FQN_TBL_SUBFAMILIA,
+    "TIPO_CODIGO": FQN_TBL_TIPO_CODIGO,
+    "MARCA": FQN_TBL_MARCA,
+    "FABRICANTE": FQN_TBL_FABRICANTE,
+    "EMB_PRODUTO": FQN_TBL_EMB_PRODUTO,
+    "UN_MED": FQN_TBL_UN_MED,
+    "EMB_COMERCIAL": FQN_TBL_EMB_COMERCIAL,
+}
+USER_PREFIX = "USUARIO_"   # USUARIO_CADASTRO, USUARIO_VALIDADOR, ...: categorias = valores do frame
+
+
+def is_category_col(col: str) -> bool:
+    return col in DIM_TABLES or col.startswith(USER_PREFIX)
+
+
+def load_dimension_categories(session: Session) -> dict[str, list[str]]:
+    """Valores de cada tabela de dimensão (coluna de rótulo = a que não é ID). Tabela que falhar fica de fora."""
+    out = {}
+    for col, fqn in DIM_TABLES.items():
+        try:
+            df = session.table(fqn).to_pandas()
+        except Exception:
+            continue
+        label_cols = [c for c in df.columns if c.upper() != "ID"]
+        if len(label_cols) == 1:
+            out[col] = [v for v in df[label_cols[0]].dropna().tolist() if isinstance(v, str)]
+    return out
+
+
+def _as_category(s: pd.Series, extra: Iterable[str] = ()) -> pd.Series | None:
+    """Categórico com categorias = extra + valores de `s` (ordenadas); None se `s` não é só texto."""
+    if isinstance(s.dtype, CategoricalDtype):
+        novas = [v for v in dict.fromkeys(extra) if v not in s.cat.categories]
+        if not novas:
+            return s
+        return s.cat.set_categories(sorted([*s.cat.categories, *novas]))
+    if s.dtype != object or infer_dtype(s, skipna=True) not in ("string", "empty"):
+        return None
+    cats = sorted(set(extra).union(pd.unique(s.dropna())))
+    return pd.Series(pd.Categorical(s, categories=cats), index=s.index, name=s.name)
+
+
+def _downcast(s: pd.Series) -> pd.Series:
+    if is_bool_dtype(s.dtype):
+        return s
+    if is_integer_dtype(s.dtype) and not isinstance(s.dtype, pd.api.extensions.ExtensionDtype):
+        return pd.to_numeric(s, downcast="integer")
+    if s.dtype == np.float64:
+        f32 = s.astype(np.float32)
+        if np.array_equal(f32.to_numpy(dtype=np.float64), s.to_numpy(), equal_nan=True):
+            return f32
+    return s
+
+
+def compact_frame(df: pd.DataFrame, categories: Mapping[str, Iterable[str]] | None = None) -> pd.DataFrame:
+    """Versão compacta de `df` (mesmos valores). `categories`: {coluna: valores da dimensão}."""
+    categories = categories or {}
+    novas = {}
+    for c in df.columns:
+        s = df[c]
+        if is_category_col(c):
+            cat = _as_category(s, categories.get(c, ()))
+            if cat is not None and cat is not s:
+                novas[c] = cat
+            continue
+        d = _downcast(s)
+        if d is not s:
+            novas[c] = d
+    if not novas:
+        return df
+    out = df.copy(deep=False)
+    for c, s in novas.items():
+        out[c] = s
+    return out
+
+
+def expand_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Cópia editável com os tipos da leitura do banco: category -> object (nulo = None),
+    float32 -> float64, inteiros -> int64.
+    """
+    novas = {}
+    for c in df.columns:
+        s = df[c]
+        if isinstance(s.dtype, CategoricalDtype):
+            novas[c] = pd.Series(np.asarray(s, dtype=object), index=s.index, name=c).where(s.notna(), None)
+        elif s.dtype == np.float32:
+            novas[c] = s.astype(np.float64)
+        elif is_integer_dtype(s.dtype) and not isinstance(s.dtype, pd.api.extensions.ExtensionDtype) and s.dtype != np.int64:
+            novas[c] = s.astype(np.int64)
+    out = df.copy()
+    for c, s in novas.items():
+        out[c] = s
+    return out
+
+
+def by_category(s: pd.Series, fn: Callable[[pd.Series], pd.Series]) -> pd.Series:
+    """
+    fn (Series -> Series, elemento a elemento) sobre a coluna. Em categórico roda só nas
+    categorias (+ um nulo, visto como None como na leitura do banco) e espalha pelos códigos.
+    """
+    if not isinstance(s.dtype, CategoricalDtype):
+        return fn(s)
+    vals = pd.Series([*s.cat.categories, None], dtype=object)
+    out = fn(vals)
+    res = out.to_numpy(dtype=bool) if is_bool_dtype(out.dtype) and not out.isna().any() else out.to_numpy()
+    # código -1 (nulo) cai no último elemento
+    return pd.Series(res[s.cat.codes.to_numpy()], index=s.index)
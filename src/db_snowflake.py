@@ -1,15 +1,30 @@
 from __future__ import annotations
-import re
+import atexit
+import threading
+import time
 import unicodedata
+import uuid
+import weakref
+from dataclasses import dataclass, replace
 import pandas as pd
-from typing import Any
+from typing import TYPE_CHECKING, Any, Iterable
 import streamlit as st
 from snowflake.snowpark import Session
 from snowflake.snowpark.context import get_active_session
+from snowflake.snowpark import types as T
 import os
-from typing import Optional, Dict, Any
+from typing import Optional, Dict
 import json
-from src.variables import FQN_USERS, FQN_APR, FQN_COR, FQN_MAIN, FQN_LOG_ATUAL, FQN_LOG_REPROV, FQN_LOG_VALID
+from src.variables import FQN_USERS, FQN_APR, FQN_COR, FQN_MAIN, FQN_LOG_ATUAL
+from src.search_doc import (
+    BUSCA_COL, BUSCA_TASK_SCHEDULE, INTERNAL_COLS, SEARCH_COLS,
+    busca_expr, fold_busca_series, palavras_busca, refresh_busca_sql, setup_busca,
+)
+from src.compact import by_category
+from src.derivados_udf import recompute_derivados, register_derivados_udfs
+
+if TYPE_CHECKING:
+    from src.search_index import TokenIndex
 # =========================
 # Conexão
 # =========================
@@ -139,15 +154,18 @@ def apply_common_filters(
 
     # ---------- Filtro por usuário (sempre display name) ----------
     if "USUARIO_CADASTRO" in df.columns and sel_user_name and sel_user_name != ALL:
-        col_user = (
-            df["USUARIO_CADASTRO"]
-            .astype(str)
-            .str.strip()
-            .replace({"None": "", "nan": ""})
-        )
-        # Normaliza a coluna para display name usando o mapa (corrige casos com username)
-        col_user_display = col_user.map(lambda v: _to_display(v, user_map)).fillna("")
-        mask &= col_user_display.str.casefold() == str(sel_user_name).casefold()
+        def _do_usuario(s: pd.Series) -> pd.Series:
+            col_user = (
+                s
+                .astype(str)
+                .str.strip()
+                .replace({"None": "", "nan": ""})
+            )
+            # Normaliza a coluna para display name usando o mapa (corrige casos com username)
+            col_user_display = col_user.map(lambda v: _to_display(v, user_map)).fillna("")
+            return col_user_display.str.casefold() == str(sel_user_name).casefold()
+
+        mask &= by_category(df["USUARIO_CADASTRO"], _do_usuario)
 
     # ---------- Filtro por Insumo ----------
     if f_insumo:
@@ -161,104 +179,1008 @@ def apply_common_filters(
             mask &= df["CODIGO_PRODUTO"].astype(str).str.contains(str(f_codigo), case=False, na=False)
 
     # ---------- Filtro por Palavra-chave (em várias colunas: PALAVRA_CHAVE, SINONIMO, DESCRICAO) ----------
-    if f_palavra:
-        needles = str(f_palavra)
-        cols_busca = [c for c in ["PALAVRA_CHAVE", "SINONIMO", "DESCRICAO", "ITEM", "ESPECIFICACAO", "GRUPO", "CATEGORIA", "SEGMENTO"] if c in df.columns]
-        if cols_busca:
+    # cada palavra (sem acento) precisa aparecer em alguma coluna: mesma regra da BUSCA no banco
+    palavras = palavras_busca(f_palavra) if f_palavra else []
+    cols_busca = [c for c in SEARCH_COLS if c in df.columns]
+    if palavras and cols_busca:
+        dobradas = {c: by_category(df[c], fold_busca_series) for c in cols_busca}
+        for p in palavras:
             any_col = pd.Series(False, index=df.index)
-            for c in cols_busca:
-                any_col |= df[c].astype(str).str.contains(needles, case=False, na=False)
+            for s in dobradas.values():
+                any_col |= s.str.contains(p, regex=False).to_numpy(dtype=bool)
             mask &= any_col
 
     return mask
 
+# =========================
+# Filtros compiláveis (pandas / Snowpark)
+# =========================
+
+CASCADE_COLS = ["GRUPO", "CATEGORIA", "SEGMENTO", "FAMILIA", "SUBFAMILIA"]
+_NULL_TOKENS = ["", "nan", "NaN", "None"]
+
+@dataclass(frozen=True)
+class CatalogFilter:
+    """
+    Especificação dos filtros das telas (mesma semântica de apply_common_filters
+    + dropdowns exatos + ID), avaliável em pandas (mask) ou compilável em
+    expressões Snowpark (apply), para buscar no banco só as linhas que casam.
+
+    exact: pares (coluna, valor) comparados após strip; valor None = vazio/nulo.
+    """
+    item_id: str | None = None
+    user_name: str | None = None
+    insumo: str | None = None
+    codigo: str | None = None
+    palavra: str | None = None
+    exact: tuple[tuple[str, str | None], ...] = ()
+
+    @classmethod
+    def from_state(cls, prefix: str) -> "CatalogFilter":
+        """Monta a especificação a partir dos widgets de busca da página (chaves '<prefix>_f_id' etc.)."""
+        ss = st.session_state
+        return cls(
+            item_id=(ss.get(f"{prefix}_f_id") or "").strip() or None,
+            user_name=ss.get(f"{prefix}_sel_user") or None,
+            palavra=(ss.get(f"{prefix}_f_palavra") or "").strip() or None,
+        )
+
+    @property
+    def id_is_valid(self) -> bool:
+        return self.item_id is None or self.item_id.isdigit()
+
+    def with_exact(self, col: str, value: str | None) -> "CatalogFilter":
+        """Cópia com mais um filtro exato (ex.: nível da cascata GRUPO→SUBFAMILIA)."""
+        return replace(self, exact=self.exact + ((col, value),))
+
+    def is_empty(self) -> bool:
+        return not (self.item_id or self.insumo or self.codigo or self.palavra or self.exact
+                    or (self.user_name and self.user_name != ALL))
+
+    # ---------- pandas ----------
+    def mask(self, df: pd.DataFrame, user_map: dict | None = None, *, search: "TokenIndex | None" = None) -> pd.Series:
+        """
+        Máscara em pandas. Com `search` (índice do snapshot de onde `df` saiu), a palavra-chave
+        é resolvida no índice invertido (sem acento, todas as palavras); senão, varre as colunas.
+        """
+        hits = search.matches(df, self.palavra) if (search is not None and self.palavra) else None
+        mask = apply_common_filters(
+            df,
+            sel_user_name=self.user_name,
+            f_insumo=self.insumo,
+            f_codigo=self.codigo,
+            f_palavra=self.palavra if hits is None else None,
+            user_map=user_map,
+        )
+        if hits is not None and not df.empty:
+            mask &= hits
+        if self.item_id and not df.empty:
+            if self.id_is_valid and "ID" in df.columns:
+                mask &= df["ID"].astype("Int64") == int(self.item_id)
+            else:
+                mask &= False
+        for col, value in self.exact:
+            if col not in df.columns:
+                continue
+
+            def _igual(s: pd.Series) -> pd.Series:
+                s = s.astype("string")
+                if col == "CODIGO_PRODUTO":
+                    s = s.str.replace(r"\.0$", "", regex=True)
+                s = s.str.strip().replace(_NULL_TOKENS, pd.NA)
+                return s.isna() if value is None else (s == value).fillna(False)
+
+            # categórico: normaliza só as categorias e compara códigos
+            mask &= by_category(df[col], _igual)
+        return mask
+
+    # ---------- Snowpark ----------
+    def predicate(self, columns, user_map: dict | None = None):
+        """Expressão Snowpark equivalente (None = sem filtro). `columns` = colunas disponíveis."""
+        from snowflake.snowpark import functions as F
+
+        cols = {c.upper() for c in columns}
+        preds = []
+
+        def txt(c: str):
+            return F.lower(F.to_varchar(F.col(c)))
+
+        if self.user_name and self.user_name != ALL and "USUARIO_CADASTRO" in cols:
+            sel = str(self.user_name)
+            raw = F.trim(F.to_varchar(F.col("USUARIO_CADASTRO")))
+            usernames = [k for k, v in (user_map or {}).items() if str(v).casefold() == sel.casefold()]
+            p = F.lower(raw) == F.lit(sel.lower())
+            if usernames:
+                p = p | raw.isin(usernames)
+            preds.append(p)
+
+        if self.insumo and "INSUMO" in cols:
+            preds.append(txt("INSUMO").contains(F.lit(str(self.insumo).lower())))
+
+        if self.codigo and "CODIGO_PRODUTO" in cols:
+            preds.append(txt("CODIGO_PRODUTO").contains(F.lit(str(self.codigo).lower())))
+
+        palavras = palavras_busca(self.palavra) if self.palavra else []
+        cols_busca = [c for c in SEARCH_COLS if c in cols]
+        if palavras and (cols_busca or BUSCA_COL in cols):
+            # documento de busca (sem acento); linha ainda sem BUSCA: mesma expressão calculada na hora
+            doc = F.sql_expr(busca_expr(cols_busca))
+            if BUSCA_COL in cols:
+                doc = F.coalesce(F.col(BUSCA_COL), doc)
+            # cada palavra precisa aparecer (em qualquer ordem/coluna), como no índice invertido
+            for p in palavras:
+                preds.append(doc.contains(F.lit(p)))
+
+        if self.item_id:
+            if self.id_is_valid and "ID" in cols:
+                preds.append(F.col("ID") == int(self.item_id))
+            else:
+                preds.append(F.lit(False))
+
+        for col, value in self.exact:
+            if col.upper() not in cols:
+                continue
+            s = F.trim(F.to_varchar(F.col(col)))
+            if col.upper() == "CODIGO_PRODUTO":
+                s = F.regexp_replace(s, r"\.0$", "")
+            if value is None:
+                preds.append(F.col(col).is_null() | s.isin(_NULL_TOKENS))
+            else:
+                preds.append(F.coalesce(s == F.lit(value), F.lit(False)))
+
+        if not preds:
+            return None
+        out = preds[0]
+        for p in preds[1:]:
+            out = out & p
+        return out
+
+    def apply(self, sp_df, user_map: dict | None = None, *, columns: Iterable[str] | None = None):
+        """
+        Aplica a especificação a um DataFrame Snowpark (filtro executado no warehouse).
+        `columns`: colunas já conhecidas (table_columns); senão descreve o DataFrame.
+        """
+        pred = self.predicate(sp_df.columns if columns is None else columns, user_map)
+        return sp_df if pred is None else sp_df.filter(pred)
+
+
+# =========================
+# Leitura em lotes (Arrow)
+# =========================
+
+def _batch_to_arrow(batch: pd.DataFrame):
+    import pyarrow as pa
+
+    try:
+        return pa.Table.from_pandas(batch, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError):
+        # tipos mistos que o Arrow não aceita: mantém o lote em pandas
+        return batch
+
+def _concat_batches(lotes: list, arrow_dtypes: bool = False) -> pd.DataFrame:
+    import pyarrow as pa
+
+    if not lotes:
+        return pd.DataFrame()
+    to_pd = {"types_mapper": pd.ArrowDtype} if arrow_dtypes else {}
+    if all(isinstance(b, pa.Table) for b in lotes):
+        try:
+            # lotes do Snowflake podem vir com larguras de inteiro diferentes
+            return pa.concat_tables(lotes, promote_options="permissive").to_pandas(**to_pd)
+        except (TypeError, pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+    frames = [b.to_pandas(**to_pd) if isinstance(b, pa.Table) else b for b in lotes]
+    return pd.concat(frames, ignore_index=True)
+
+def stream_to_pandas(
+    sp_df,
+    *,
+    label: str = "Carregando dados…",
+    progress: bool = True,
+    cancel_key: str | None = None,
+    max_rows: int | None = None,
+    arrow_dtypes: bool = False,
+) -> pd.DataFrame:
+    """
+    Lê um DataFrame Snowpark lote a lote (to_pandas_batches) em vez de um to_pandas() único.
+    Cada lote vira tabela Arrow (colunar, compacta) e a conversão para pandas acontece uma vez no fim.
+
+    - progress: mostra o contador de linhas recebidas (use False dentro de funções com st.cache_data)
+    - cancel_key: mostra o botão "Cancelar carregamento"; ao clicar, a leitura para e a página
+      segue com as linhas já recebidas até "Carregar tudo"
+    - max_rows: para de ler ao atingir o limite (lotes seguintes não são baixados)
+    - arrow_dtypes: devolve colunas pd.ArrowDtype em vez dos tipos numpy
+    """
+    parcial_key = f"{cancel_key}__parcial" if cancel_key else None
+
+    if cancel_key and st.session_state.get(cancel_key):
+        df_parcial = _concat_batches(st.session_state.get(parcial_key) or [], arrow_dtypes)
+
+        def _retomar():
+            st.session_state.pop(cancel_key, None)
+            st.session_state.pop(parcial_key, None)
+
+        c1, c2 = st.columns([4, 1])
+        with c1:
+            st.warning(f"Carregamento cancelado: exibindo {len(df_parcial)} linha(s) recebidas até o cancelamento.")
+        with c2:
+            st.button("Carregar tudo", key=f"{cancel_key}__retomar", on_click=_retomar)
+        return df_parcial
+
+    status = st.empty() if progress else None
+    cancel_ph = st.empty() if (progress and cancel_key) else None
+    if cancel_ph is not None:
+        def _cancelar():
+            st.session_state[cancel_key] = True
+        # o clique dispara um rerun, que interrompe este laço na próxima atualização de tela
+        cancel_ph.button("Cancelar carregamento", key=f"{cancel_key}__btn", on_click=_cancelar)
+
+    lotes: list = []
+    if parcial_key:
+        st.session_state[parcial_key] = lotes
+    n = 0
+    it = sp_df.to_pandas_batches()
+    try:
+        for batch in it:
+            if max_rows is not None and n + len(batch) > max_rows:
+                batch = batch.iloc[: max_rows - n]
+            lotes.append(_batch_to_arrow(batch))
+            n += len(batch)
+            if status is not None:
+                status.caption(f"{label} {n} linha(s) recebidas")
+            if max_rows is not None and n >= max_rows:
+                break
+    finally:
+        close = getattr(it, "close", None)
+        if close is not None:
+            close()
+
+    if status is not None:
+        status.empty()
+    if cancel_ph is not None:
+        cancel_ph.empty()
+    if parcial_key:
+        st.session_state.pop(parcial_key, None)
+    return _concat_batches(lotes, arrow_dtypes)
+
+def _project(t, columns: Iterable[str] | None, existentes: Iterable[str] | None = None):
+    """
+    SELECT só das colunas pedidas que existem na tabela (na ordem pedida). None = todas
+    (menos as internas, ex.: BUSCA).
+    `existentes`: colunas já conhecidas (registro de schema), evita descrever o DataFrame.
+    """
+    if columns is None:
+        existentes = list(existentes if existentes is not None else t.columns)
+        if not any(c in INTERNAL_COLS for c in existentes):
+            return t
+        return t.select([c for c in existentes if c not in INTERNAL_COLS])
+    existentes = set(existentes if existentes is not None else t.columns)
+    keep = [c for c in dict.fromkeys(c.upper() for c in columns) if c in existentes]
+    return t.select(keep) if keep else t
+
+def app_table(
+    session: Session,
+    table_fqn: str,
+    columns: Iterable[str] | None = None,
+    *,
+    existing: Iterable[str] | None = None,
+):
+    """
+    session.table sem as colunas internas (o que as telas e snapshots leem); `columns` projeta no banco.
+    `existing`: colunas da tabela já conhecidas (threads sem contexto do Streamlit).
+    """
+    existing = existing if existing is not None else table_columns(session, table_fqn)
+    return _project(session.table(table_fqn), columns, existing)
+
+def refresh_search_doc(session: Session, table_fqn: str, where: str) -> None:
+    """Recalcula BUSCA das linhas em `where` (SQL), se a tabela já tem a coluna."""
+    sql = refresh_busca_sql(table_fqn, table_columns(session, table_fqn), where)
+    if sql:
+        session.sql(sql).collect()
+
+SEARCH_DOC_TABLES = (FQN_MAIN, FQN_APR, FQN_COR)   # tabelas com filtro de palavra-chave nas telas
+
+def search_doc_task_config() -> dict[str, str] | None:
+    """
+    TASK de recálculo de BUSCA (st.secrets["busca"]: "warehouse", "schedule" opcional).
+    Sem warehouse configurado, não há task: BUSCA só é mantida pelas escritas do app.
+    """
+    try:
+        cfg = dict(st.secrets.get("busca", {}))
+    except Exception:
+        cfg = {}
+    if not cfg.get("warehouse"):
+        return None
+    return {"warehouse": str(cfg["warehouse"]), "schedule": str(cfg.get("schedule") or BUSCA_TASK_SCHEDULE)}
+
+def setup_search_docs(session: Session, tables: Iterable[str] = SEARCH_DOC_TABLES) -> dict[str, int]:
+    """Instala/recalcula BUSCA (e a task, se configurada) em `tables`. Retorna {tabela: linhas gravadas}."""
+    task = search_doc_task_config() or {}
+    out = {}
+    for fqn in tables:
+        out[fqn] = setup_busca(session, fqn, **task)
+        invalidate_schema(fqn)   # coluna nova: o cache de colunas precisa vê-la
+    return out
+
+def recompute_derivados_tables(
+    session: Session,
+    tables: Iterable[str] = SEARCH_DOC_TABLES,
+    *,
+    recalc_descricao: bool = False,
+) -> dict[str, dict[str, int | float]]:
+    """
+    Recalcula SINONIMO/PALAVRA_CHAVE (e DESCRICAO) de `tables` no warehouse, com UDFs
+    temporárias desta sessão. Retorna {tabela: {"linhas": n, "segundos": s}}.
+    """
+    udfs = register_derivados_udfs(session)
+    return {
+        fqn: recompute_derivados(session, fqn, udfs, recalc_descricao=recalc_descricao, columns=table_columns)
+        for fqn in tables
+    }
+
+def load_user_options(session: Session, table_fqn: str, user_map: dict | None) -> list[str]:
+    """
+    Opções do filtro de usuário a partir de um DISTINCT no banco
+    (independe das linhas já filtradas pela página).
+    """
+    try:
+        dfu = session.sql(f"SELECT DISTINCT USUARIO_CADASTRO FROM {table_fqn}").to_pandas()
+    except Exception:
+        return [ALL]
+    return build_user_options(dfu, user_map)
+
+# =========================
+# Paginação por chave (keyset)
+# =========================
+
+def _filtered_table(session: Session, table_fqn: str, spec: CatalogFilter | None, user_map: dict | None):
+    t = session.table(table_fqn)
+    return t if spec is None else spec.apply(t, user_map, columns=table_columns(session, table_fqn))
+
+def ids_matching(session: Session, table_fqn: str, spec: CatalogFilter, *, user_map: dict | None = None) -> list[int]:
+    """Só os IDs das linhas que casam (filtro avaliado no banco, sobre todas as colunas)."""
+    return [int(i) for i in _filtered_table(session, table_fqn, spec, user_map).select("ID").to_pandas()["ID"].dropna()]
+
+def count_filtered(session: Session, table_fqn: str, spec: CatalogFilter | None = None, *, user_map: dict | None = None) -> int:
+    """
+    Só o COUNT(*) das linhas que casam com a especificação (não traz linhas).
+    """
+    return int(_filtered_table(session, table_fqn, spec, user_map).count())
+
+def fetch_page_by_id(
+    session: Session,
+    table_fqn: str,
+    spec: CatalogFilter | None = None,
+    *,
+    after_id: int | None = None,
+    limit: int = 100,
+    user_map: dict | None = None,
+    columns: Iterable[str] | None = None,
+) -> pd.DataFrame:
+    """
+    Uma página por chave: WHERE <filtros> AND ID > :after_id ORDER BY ID LIMIT :limit.
+    Sem OFFSET, o custo não cresce com a posição da página nem com o tamanho da tabela.
+    """
+    from snowflake.snowpark import functions as F
+
+    t = _filtered_table(session, table_fqn, spec, user_map)
+    if after_id is not None:
+        t = t.filter(F.col("ID") > F.lit(int(after_id)))
+    return _project(t, columns, table_columns(session, table_fqn)).sort(F.col("ID")).limit(int(limit)).to_pandas()
+
+def fetch_rows_by_ids(
+    session: Session,
+    table_fqn: str,
+    ids: Iterable[int],
+    columns: Iterable[str] | None = None,
+    *,
+    existing: Iterable[str] | None = None,
+) -> pd.DataFrame:
+    """
+    Linhas de `table_fqn` pelos IDs informados (ordenadas por ID).
+    `existing`: colunas da tabela já conhecidas (threads sem contexto do Streamlit).
+    """
+    from snowflake.snowpark import functions as F
+
+    ids = sorted({int(i) for i in ids})
+    if not ids:
+        return pd.DataFrame()
+    t = session.table(table_fqn).filter(F.col("ID").isin(ids))
+    existing = existing if existing is not None else table_columns(session, table_fqn)
+    return _project(t, columns, existing).sort(F.col("ID")).to_pandas()
+
+def distinct_values(
+    session: Session,
+    table_fqn: str,
+    column: str,
+    spec: CatalogFilter | None = None,
+    *,
+    user_map: dict | None = None,
+) -> pd.Series:
+    """
+    SELECT DISTINCT <column> das linhas que casam (opções de dropdown sem carregar a tabela).
+    """
+    if column.upper() not in {c.upper() for c in table_columns(session, table_fqn)}:
+        return pd.Series([], dtype="object")
+    t = _filtered_table(session, table_fqn, spec, user_map)
+    return t.select(column).distinct().to_pandas()[column.upper()]
+
 def _build_local_session() -> Session:
     cfg = st.secrets["snowflake"]
     return Session.builder.configs(cfg).create()
 
+# =========================
+# Pool de sessões
+# =========================
+
+SESSION_TIMEZONE = "America/Sao_Paulo"
+SESSION_QUERY_TAG = "spdo-app-catalogo"
+
+POOL_MAX_SIZE = 8               # conexões vivas no processo
+POOL_IDLE_TTL_S = 15 * 60       # conexão livre (devolvida) ociosa há mais que isso é fechada
+POOL_WAIT_TIMEOUT_S = 30        # espera por uma conexão livre com o pool cheio
+POOL_HEALTH_INTERVAL_S = 60     # no máximo um "SELECT 1" por minuto por conexão
+POOL_STATEMENT_TIMEOUT_S = 600
+
+def _pool_config() -> dict[str, Any]:
+    """Lê overrides opcionais de st.secrets["session_pool"]."""
+    try:
+        cfg = dict(st.secrets.get("session_pool", {}))
+    except Exception:
+        cfg = {}
+    return {
+        "max_size": int(cfg.get("max_size", POOL_MAX_SIZE)),
+        "idle_ttl_s": float(cfg.get("idle_ttl_s", POOL_IDLE_TTL_S)),
+        "wait_timeout_s": float(cfg.get("wait_timeout_s", POOL_WAIT_TIMEOUT_S)),
+        "health_interval_s": float(cfg.get("health_interval_s", POOL_HEALTH_INTERVAL_S)),
+        "statement_timeout_s": int(cfg.get("statement_timeout_s", POOL_STATEMENT_TIMEOUT_S)),
+    }
+
+def _apply_session_settings(session: Session, statement_timeout_s: int | None = None) -> None:
+    """Configura a sessão uma única vez (na criação): timezone, query tag e timeout."""
+    if statement_timeout_s is None:
+        statement_timeout_s = _pool_config()["statement_timeout_s"]
+    stmts = [
+        f"ALTER SESSION SET TIMEZONE = '{SESSION_TIMEZONE}'",
+        f"ALTER SESSION SET QUERY_TAG = '{SESSION_QUERY_TAG}'",
+        f"ALTER SESSION SET STATEMENT_TIMEOUT_IN_SECONDS = {int(statement_timeout_s)}",
+    ]
+    for sql in stmts:
+        try:
+            session.sql(sql).collect()
+        except Exception:
+            # ex.: ambientes que não permitem ALTER SESSION; segue com o default
+            pass
+
+def _session_is_alive(session: Session) -> bool:
+    try:
+        session.sql("SELECT 1").collect()
+        return True
+    except Exception:
+        return False
+
+@dataclass
+class _PooledSession:
+    session: Session
+    last_used: float
+    last_check: float
+    owner: str | None = None
+
+class PoolExhausted(RuntimeError):
+    """Nenhuma conexão livre no pool dentro do tempo de espera."""
+
+
+class SessionPool:
+    """
+    Pool de sessões Snowpark compartilhado pelo processo (via st.cache_resource).
+
+    - Cada sessão do Streamlit (usuário/aba) recebe uma conexão exclusiva e fica com ela
+      entre reruns; uma conexão emprestada nunca é entregue a outro dono, então
+      transações (BEGIN/COMMIT) não se misturam entre usuários.
+    - A conexão só volta para o pool com release() (fim da sessão do Streamlit ou da
+      tarefa em segundo plano); antes de ser reaproveitada, recebe ROLLBACK.
+    - No máximo max_size conexões vivas; com o pool cheio, acquire() espera até
+      wait_timeout_s por uma devolução e então levanta PoolExhausted.
+    - Conexões livres ociosas há mais de idle_ttl_s são fechadas.
+    - Health-check (SELECT 1) no máximo a cada health_interval_s, com reconexão
+      transparente. Login, health-check e ROLLBACK rodam fora do lock do pool.
+    - Timezone, query tag e statement timeout são aplicados só na criação.
+    """
+
+    def __init__(
+        self,
+        factory,
+        *,
+        max_size: int = POOL_MAX_SIZE,
+        idle_ttl_s: float = POOL_IDLE_TTL_S,
+        wait_timeout_s: float = POOL_WAIT_TIMEOUT_S,
+        health_interval_s: float = POOL_HEALTH_INTERVAL_S,
+        statement_timeout_s: int = POOL_STATEMENT_TIMEOUT_S,
+    ):
+        self._factory = factory
+        self.max_size = max(1, int(max_size))
+        self.idle_ttl_s = idle_ttl_s
+        self.wait_timeout_s = wait_timeout_s
+        self.health_interval_s = health_interval_s
+        self.statement_timeout_s = statement_timeout_s
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._entries: list[_PooledSession] = []
+        self._creating = 0   # vagas reservadas para conexões sendo criadas (fora do lock)
+
+    def _new_session(self) -> Session:
+        session = self._factory()
+        _apply_session_settings(session, self.statement_timeout_s)
+        return session
+
+    def _expired(self, now: float) -> list[_PooledSession]:
+        """Tira do pool as conexões livres ociosas demais (chamar com o lock)."""
+        velhas = [e for e in self._entries if e.owner is None and now - e.last_used > self.idle_ttl_s]
+        if velhas:
+            self._entries = [e for e in self._entries if e not in velhas]
+        return velhas
+
+    def acquire(self, owner: str) -> Session:
+        deadline = time.monotonic() + self.wait_timeout_s
+        criar = False
+        fechar: list[_PooledSession] = []
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                entry = next((e for e in self._entries if e.owner == owner), None)
+                if entry is not None:
+                    break
+                fechar += self._expired(now)
+                entry = next((e for e in self._entries if e.owner is None), None)
+                if entry is not None:
+                    entry.owner = owner
+                    break
+                if len(self._entries) + self._creating < self.max_size:
+                    self._creating += 1
+                    criar = True
+                    break
+                restante = deadline - now
+                if restante <= 0:
+                    raise PoolExhausted(
+                        f"Todas as {self.max_size} conexões com o Snowflake estão em uso; tente novamente."
+                    )
+                self._cond.wait(restante)
+            checar = False
+            if entry is not None:
+                entry.last_used = now
+                checar = now - entry.last_check >= self.health_interval_s
+                if checar:
+                    entry.last_check = now
+
+        for e in fechar:
+            try:
+                e.session.close()
+            except Exception:
+                pass
+
+        if criar:
+            try:
+                session = self._new_session()
+            except Exception:
+                with self._cond:
+                    self._creating -= 1
+                    self._cond.notify()
+                raise
+            now = time.monotonic()
+            with self._cond:
+                self._creating -= 1
+                self._entries.append(_PooledSession(session=session, last_used=now, last_check=now, owner=owner))
+            return session
+
+        # a conexão é exclusiva deste dono: health-check e reconexão sem o lock
+        if checar and not _session_is_alive(entry.session):
+            try:
+                entry.session.close()
+            except Exception:
+                pass
+            try:
+                entry.session = self._new_session()
+            except Exception:
+                entry.last_check = 0.0   # tenta reconectar de novo no próximo acquire
+                raise
+        return entry.session
+
+    def release(self, owner: str) -> None:
+        """Devolve a conexão de `owner` ao pool (transação aberta é desfeita)."""
+        with self._cond:
+            entry = next((e for e in self._entries if e.owner == owner), None)
+        if entry is None:
+            return
+        try:
+            entry.session.sql("ROLLBACK").collect()
+            ok = True
+        except Exception:
+            ok = False
+        with self._cond:
+            if ok:
+                entry.owner = None
+                entry.last_used = time.monotonic()
+            else:
+                # conexão com problema: descarta em vez de reaproveitar
+                self._entries = [e for e in self._entries if e is not entry]
+            self._cond.notify()
+        if not ok:
+            try:
+                entry.session.close()
+            except Exception:
+                pass
+
+    def close_all(self) -> None:
+        with self._cond:
+            entries, self._entries = self._entries, []
+            self._cond.notify_all()
+        for e in entries:
+            try:
+                e.session.close()
+            except Exception:
+                pass
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            leased = sum(1 for e in self._entries if e.owner is not None)
+            return {"live": len(self._entries), "leased": leased, "max_size": self.max_size}
+
+
+@st.cache_resource(show_spinner=False)
+def _get_session_pool() -> SessionPool:
+    cfg = _pool_config()
+    pool = SessionPool(_build_local_session, **cfg)
+    atexit.register(pool.close_all)
+    return pool
+
+def _current_owner() -> str:
+    """Identifica a sessão do Streamlit (aba/usuário) que está executando o script."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        if ctx is not None:
+            return ctx.session_id
+    except Exception:
+        pass
+    return "__default__"
+
+_CONFIGURED_ACTIVE: "weakref.WeakSet[Session]" = weakref.WeakSet()
+_LEASE_KEY = "_session_pool_lease"
+
+class _Lease:
+    """
+    Guardado na session_state do dono: quando a sessão do Streamlit é descartada,
+    o finalizador devolve a conexão ao pool (em outra thread; o ROLLBACK vai ao banco).
+    """
+
+    def __init__(self, pool: SessionPool, owner: str):
+        self.owner = owner
+        weakref.finalize(self, _release_in_background, pool, owner)
+
+def _release_in_background(pool: SessionPool, owner: str) -> None:
+    threading.Thread(target=pool.release, args=(owner,), name="session-pool-release", daemon=True).start()
 
 def get_session() -> Session:
     try:
-        return get_active_session()
+        session = get_active_session()
     except Exception:
-        return _build_local_session()
+        pool = _get_session_pool()
+        owner = _current_owner()
+        session = pool.acquire(owner)
+        if owner != "__default__" and not isinstance(st.session_state.get(_LEASE_KEY), _Lease):
+            st.session_state[_LEASE_KEY] = _Lease(pool, owner)
+        return session
+    # Snowflake (SiS): a sessão ativa é única; configura apenas na primeira vez
+    if session not in _CONFIGURED_ACTIVE:
+        _apply_session_settings(session)
+        _CONFIGURED_ACTIVE.add(session)
+    return session
+
+def transition_procedure() -> str | None:
+    """
+    Stored procedure das transições (st.secrets["transitions"]["procedure"]).
+    Sem configuração, as transições rodam a partir do app (src.transitions.run_transition).
+    """
+    try:
+        cfg = dict(st.secrets.get("transitions", {}))
+    except Exception:
+        cfg = {}
+    return cfg.get("procedure") or None
+
+def get_worker_session(name: str):
+    """
+    Sessão para tarefas em segundo plano (threads sem contexto do Streamlit).
+    Chamar na thread do script. Retorna (sessão, liberar) com lease próprio no pool,
+    ou None no Snowflake (SiS), onde só existe a sessão ativa.
+    """
+    try:
+        get_active_session()
+        return None
+    except Exception:
+        pass
+    pool = _get_session_pool()
+    owner = f"__worker__:{name}"
+    return pool.acquire(owner), (lambda: pool.release(owner))
+
+# =========================
+# Metadados (colunas por tabela)
+# =========================
+
+SCHEMA_TTL_S = 600
+
+class SchemaRegistry:
+    """
+    Colunas e tipos por FQN, compartilhados pelo processo (via st.cache_resource).
+    Cada tabela é descrita no máximo uma vez a cada ttl_s; invalidate() força nova leitura
+    (ex.: depois de um ALTER TABLE ou quando o snapshot percebe mudança de colunas).
+    """
+
+    def __init__(self, ttl_s: float = SCHEMA_TTL_S):
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._cache: dict[str, tuple[float, dict[str, Any]]] = {}
+
+    def types(self, session: Session, table_fqn: str) -> dict[str, Any]:
+        """{coluna: DataType do Snowpark}, na ordem da tabela."""
+        key = table_fqn.upper()
+        now = time.monotonic()
+        hit = self._cache.get(key)
+        if hit is not None and now - hit[0] < self.ttl_s:
+            return hit[1]
+        fields = {f.name: f.datatype for f in session.table(table_fqn).schema.fields}
+        with self._lock:
+            self._cache[key] = (now, fields)
+        return fields
+
+    def columns(self, session: Session, table_fqn: str) -> list[str]:
+        return list(self.types(session, table_fqn))
+
+    def invalidate(self, table_fqn: str | None = None) -> None:
+        with self._lock:
+            if table_fqn is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(table_fqn.upper(), None)
+
+
+@st.cache_resource(show_spinner=False)
+def get_schema_registry() -> SchemaRegistry:
+    return SchemaRegistry()
+
+def table_columns(session: Session, table_fqn: str) -> list[str]:
+    """Colunas de `table_fqn` (cache com TTL; sem consulta de metadados a cada render)."""
+    return get_schema_registry().columns(session, table_fqn)
+
+def table_types(session: Session, table_fqn: str) -> dict[str, Any]:
+    return get_schema_registry().types(session, table_fqn)
+
+def invalidate_schema(table_fqn: str | None = None) -> None:
+    get_schema_registry().invalidate(table_fqn)
 
 # =========================
 # DDL/CRUD
 # =========================
 
+ORIGEM_APR = "APROVADOS"
+ORIGEM_PEND = "PENDENTES"
+
+def fetch_codigo_origens(session: Session, codigos: Iterable[Any]) -> dict[str, set[str]]:
+    """
+    Existência de CODIGO_PRODUTO nas tabelas “ativas” numa única ida ao banco:
+    - TB_CATALOGO_APROVADOS (origem "APROVADOS")
+    - TB_CATALOGO_INSUMOS  (origem "PENDENTES")
+    Os códigos vão como um único array JSON (FLATTEN), sem listas IN (?, ?, ...).
+    Retorna {codigo: {origens}} apenas para os códigos encontrados.
+    """
+    cods = sorted({str(c).strip() for c in codigos if c is not None} - {""})
+    if not cods:
+        return {}
+    q = f"""
+      WITH C AS (
+        SELECT DISTINCT VALUE::STRING AS COD
+        FROM TABLE(FLATTEN(INPUT => PARSE_JSON(?)))
+      )
+      SELECT DISTINCT a.CODIGO_PRODUTO AS COD, '{ORIGEM_APR}' AS ORIGEM
+      FROM {FQN_APR} a JOIN C ON a.CODIGO_PRODUTO = C.COD
+      UNION ALL
+      SELECT DISTINCT m.CODIGO_PRODUTO, '{ORIGEM_PEND}'
+      FROM {FQN_MAIN} m JOIN C ON m.CODIGO_PRODUTO = C.COD
+    """
+    out: dict[str, set[str]] = {}
+    for r in session.sql(q, params=[json.dumps(cods, ensure_ascii=False)]).collect():
+        out.setdefault(str(r["COD"]).strip(), set()).add(r["ORIGEM"])
+    return out
+
 def codigo_produto_exists_any(session: Session, codigo: str | None) -> tuple[bool, str]:
     """
-    Verifica se o CODIGO_PRODUTO existe em alguma tabela “ativa”:
-    - TB_CATALOGO_APROVADOS (aprovados)
-    - TB_CATALOGO_INSUMOS  (cadastros pendentes/histórico)
+    Verifica se o CODIGO_PRODUTO existe em alguma tabela “ativa” (ver fetch_codigo_origens).
     Retorna (existe, origem) onde origem ∈ {"APROVADOS", "PENDENTES", ""}.
     """
     if not codigo:
         return (False, "")
     codigo = str(codigo).strip()
-    # 1) Aprovados primeiro (tem prioridade de bloqueio)
-    q1 = f"""
-      SELECT 1
-      FROM {FQN_APR}
-      WHERE CODIGO_PRODUTO = ?
-      LIMIT 1
-    """
-    if not session.sql(q1, params=[codigo]).to_pandas().empty:
-        return (True, "APROVADOS")
-
-    # 2) Pendentes (insumos_h)
-    q2 = f"""
-      SELECT 1
-      FROM {FQN_MAIN}
-      WHERE CODIGO_PRODUTO = ?
-      LIMIT 1
-    """
-    if not session.sql(q2, params=[codigo]).to_pandas().empty:
-        return (True, "PENDENTES")
-
+    origens = fetch_codigo_origens(session, [codigo]).get(codigo, set())
+    # Aprovados têm prioridade de bloqueio
+    if ORIGEM_APR in origens:
+        return (True, ORIGEM_APR)
+    if ORIGEM_PEND in origens:
+        return (True, ORIGEM_PEND)
     return (False, "")
 
+INSERT_ITEM_COLS = [
+    "REFERENCIA",
+    "GRUPO","CATEGORIA","SEGMENTO","FAMILIA","SUBFAMILIA",
+    "TIPO_CODIGO","CODIGO_PRODUTO",
+    "INSUMO","ITEM","DESCRICAO","ESPECIFICACAO",
+    "MARCA","FABRICANTE","QTD_EMB_PRODUTO", "EMB_PRODUTO","UN_MED","QTD_MED","EMB_COMERCIAL","QTD_EMB_COMERCIAL",
+    "SINONIMO","PALAVRA_CHAVE",
+    "USUARIO_CADASTRO","USUARIO_ATUALIZACAO",
+]
+
+def _insert_error_msg(e: Exception) -> str:
+    msg = str(e)
+    if "unique" in msg.lower():
+        return "CODIGO_PRODUTO ou INSUMO já cadastrado."
+    return f"Erro ao salvar item: {e}"
+
 def insert_item(session: Session, item: dict[str, Any]) -> tuple[bool, str]:
+    """
+    Insere um item em FQN_MAIN. A existência do CODIGO_PRODUTO é verificada no próprio INSERT
+    (INSERT ... SELECT ... WHERE NOT EXISTS, como em bulk_insert_items): uma ida ao banco
+    quando o código é novo; a origem só é consultada quando o INSERT não grava nada.
+    """
     codigo = (item.get("CODIGO_PRODUTO") or "").strip()
     if not codigo:
         return False, "CODIGO_PRODUTO é obrigatório."
-    exists, origem = codigo_produto_exists_any(session, codigo)
-    if exists:
-        return False, f"CODIGO_PRODUTO '{codigo}' já existe na base. Origem: '{origem}'"
-    cols = [
-        "REFERENCIA",
-        "GRUPO","CATEGORIA","SEGMENTO","FAMILIA","SUBFAMILIA",
-        "TIPO_CODIGO","CODIGO_PRODUTO",
-        "INSUMO","ITEM","DESCRICAO","ESPECIFICACAO",
-        "MARCA","FABRICANTE","QTD_EMB_PRODUTO", "EMB_PRODUTO","UN_MED","QTD_MED","EMB_COMERCIAL","QTD_EMB_COMERCIAL",
-        "SINONIMO","PALAVRA_CHAVE",
-        "USUARIO_CADASTRO","USUARIO_ATUALIZACAO",
-    ]
+    cols = INSERT_ITEM_COLS
 
     placeholders = ", ".join([f":{i+1}" for i in range(len(cols))])
+    p_codigo = f":{cols.index('CODIGO_PRODUTO') + 1}"
     sql = f"""
         INSERT INTO {FQN_MAIN}
         ({", ".join(cols)}, DATA_CADASTRO)
-        VALUES ({placeholders}, CURRENT_TIMESTAMP())
+        SELECT {placeholders}, CURRENT_TIMESTAMP()
+         WHERE NOT EXISTS (SELECT 1 FROM {FQN_APR} a WHERE a.CODIGO_PRODUTO = {p_codigo})
+           AND NOT EXISTS (SELECT 1 FROM {FQN_MAIN} m WHERE m.CODIGO_PRODUTO = {p_codigo})
     """
     try:
         params = [item.get(c) for c in cols]
-        session.sql(sql, params).collect()
-        return True, "Item salvo com sucesso."
+        inseridas = session.sql(sql, params).collect()[0][0]
+    except Exception as e:
+        return False, _insert_error_msg(e)
+    if not inseridas:
+        _, origem = codigo_produto_exists_any(session, codigo)
+        return False, f"CODIGO_PRODUTO '{codigo}' já existe na base. Origem: '{origem or ORIGEM_PEND}'"
+    try:
+        refresh_search_doc(session, FQN_MAIN, f"{BUSCA_COL} IS NULL")
+    except Exception:
+        pass  # sem BUSCA a busca no banco cai na varredura das colunas
+    return True, "Item salvo com sucesso."
+
+def bulk_insert_items(session: Session, items: pd.DataFrame) -> pd.DataFrame:
+    """
+    Insere vários itens em FQN_MAIN com um número fixo de comandos (independe do nº de linhas):
+      1) grava o lote numa tabela temporária (write_pandas; valores como texto, convertidos
+         para o tipo de cada coluna no INSERT, como em update_rows_batch)
+      2) um SELECT marca os CODIGO_PRODUTO que já existem (aprovados/pendentes)
+      3) um único INSERT ... SELECT, com DATA_CADASTRO = CURRENT_TIMESTAMP() no banco
+    Retorna DataFrame com o índice de `items` e colunas OK (bool) / MSG, com as mesmas
+    mensagens de insert_item. Código repetido na própria planilha: vale a primeira linha.
+    """
+    out = pd.DataFrame({"OK": False, "MSG": ""}, index=items.index)
+    if items.empty:
+        return out
+
+    # tudo como string: sem inferência de tipo do Arrow (coluna mista str/int, coluna toda vazia)
+    stage = pd.DataFrame(
+        {
+            c: pd.Series([_stage_str(v) for v in items[c]] if c in items.columns else [None] * len(items), dtype="string")
+            for c in INSERT_ITEM_COLS
+        },
+        index=range(len(items)),
+    )
+    codigo = items["CODIGO_PRODUTO"].astype("string").str.strip().fillna("").to_numpy() \
+        if "CODIGO_PRODUTO" in items.columns else [""] * len(items)
+    stage["CODIGO_PRODUTO"] = pd.Series(codigo, dtype="string")
+    stage["__ROW__"] = range(len(items))
+
+    msgs = [""] * len(items)
+    vazio = stage["CODIGO_PRODUTO"] == ""
+    repetido = stage["CODIGO_PRODUTO"].duplicated(keep="first") & ~vazio
+    for i in stage.index[vazio]:
+        msgs[i] = "CODIGO_PRODUTO é obrigatório."
+    for i in stage.index[repetido]:
+        # a primeira ocorrência entra; as seguintes já a encontram nos pendentes
+        msgs[i] = f"CODIGO_PRODUTO '{codigo[i]}' já existe na base. Origem: 'PENDENTES'"
+    stage["__SKIP__"] = (vazio | repetido).to_numpy()
+
+    db, schema, _ = FQN_MAIN.split(".")
+    tmp = f"{db}.{schema}.TMP_CADASTRO_{uuid.uuid4().hex.upper()}"
+    cols_sql = ", ".join(INSERT_ITEM_COLS)
+    try:
+        tipos = table_types(session, FQN_MAIN)
+        vals_sql = ", ".join(_cast_sql(f"s.{c}", tipos.get(c)) for c in INSERT_ITEM_COLS)
+        # DDL faz commit implícito: a tabela temporária é criada antes do BEGIN
+        session.write_pandas(
+            stage,
+            tmp.split(".")[-1],
+            database=db,
+            schema=schema,
+            auto_create_table=True,
+            overwrite=True,
+            table_type="temp",
+        )
+        session.sql("BEGIN").collect()
+
+        existentes = session.sql(f"""
+            SELECT s.__ROW__ AS R, '{ORIGEM_APR}' AS ORIGEM
+              FROM {tmp} s
+             WHERE NOT s.__SKIP__
+               AND EXISTS (SELECT 1 FROM {FQN_APR} a WHERE a.CODIGO_PRODUTO = s.CODIGO_PRODUTO)
+            UNION ALL
+            SELECT s.__ROW__, '{ORIGEM_PEND}'
+              FROM {tmp} s
+             WHERE NOT s.__SKIP__
+               AND EXISTS (SELECT 1 FROM {FQN_MAIN} m WHERE m.CODIGO_PRODUTO = s.CODIGO_PRODUTO)
+        """).collect()
+        for r in sorted(existentes, key=lambda r: r["ORIGEM"] != ORIGEM_APR):
+            i = int(r["R"])
+            if not msgs[i]:
+                msgs[i] = f"CODIGO_PRODUTO '{codigo[i]}' já existe na base. Origem: '{r['ORIGEM']}'"
+
+        session.sql(f"""
+            INSERT INTO {FQN_MAIN} ({cols_sql}, DATA_CADASTRO)
+            SELECT {vals_sql}, CURRENT_TIMESTAMP()
+              FROM {tmp} s
+             WHERE NOT s.__SKIP__
+               AND NOT EXISTS (SELECT 1 FROM {FQN_APR} a WHERE a.CODIGO_PRODUTO = s.CODIGO_PRODUTO)
+               AND NOT EXISTS (SELECT 1 FROM {FQN_MAIN} m WHERE m.CODIGO_PRODUTO = s.CODIGO_PRODUTO)
+        """).collect()
+        refresh_search_doc(session, FQN_MAIN, f"{BUSCA_COL} IS NULL")
+        session.sql("COMMIT").collect()
     except Exception as e:
-        msg = str(e)
-        if "unique" in msg.lower():
-            return False, "CODIGO_PRODUTO ou INSUMO já cadastrado."
-        return False, f"Erro ao salvar item: {e}"
+        try:
+            session.sql("ROLLBACK").collect()
+        except Exception:
+            pass
+        erro = _insert_error_msg(e)
+        msgs = [m or erro for m in msgs]
+    finally:
+        try:
+            session.sql(f"DROP TABLE IF EXISTS {tmp}").collect()
+        except Exception:
+            pass
 
+    out["MSG"] = [m or "Item salvo com sucesso." for m in msgs]
+    out["OK"] = [not m for m in msgs]
+    return out
 
-def listar_itens_df(session: Session) -> pd.DataFrame:
+
+def listar_itens_df(
+    session: Session,
+    spec: CatalogFilter | None = None,
+    user_map: dict | None = None,
+    progress: bool = True,
+    df_source: pd.DataFrame | None = None,
+) -> pd.DataFrame:
+    """
+    Itens pendentes de validação (FQN_MAIN), mais recentes primeiro.
+    Com `df_source` (snapshot local da tabela), filtra em memória em vez de consultar o banco.
+    """
+    excluir = {"DATA_VALIDACAO", "USUARIO_VALIDADOR", "DATA_ATUALIZACAO", "USUARIO_ATUALIZACAO"}
+    if df_source is not None:
+        df = df_source if spec is None else df_source[spec.mask(df_source, user_map)]
+        df = df.drop(columns=[c for c in df.columns if c in excluir])
+        if "DATA_CADASTRO" in df.columns:
+            df = df.sort_values("DATA_CADASTRO", ascending=False)
+        return df.copy()
     try:
         t = session.table(FQN_MAIN)
-        excluir = {"DATA_VALIDACAO", "USUARIO_VALIDADOR", "DATA_ATUALIZACAO", "USUARIO_ATUALIZACAO"}
-        cols = [f.name for f in t.schema.fields if f.name not in excluir]
-        return t.select(cols).sort("DATA_CADASTRO", ascending=False).to_pandas()
+        todas = table_columns(session, FQN_MAIN)
+        if spec is not None:
+            t = spec.apply(t, user_map, columns=todas)
+        t = t.select([c for c in todas if c not in excluir and c not in INTERNAL_COLS])
+        return stream_to_pandas(t.sort("DATA_CADASTRO", ascending=False), progress=progress)
     except Exception:
         return pd.DataFrame()
     
@@ -327,61 +1249,137 @@ def users_check_password(session: Session, username: str, password: str) -> bool
     return _hash_password(password, u["salt"]) == u["password_hash"]
 
 
-def _sql_json(value) -> str:
-    if value is None:
-        return "NULL"
-    return "PARSE_JSON('" + json.dumps(value).replace("'", "''") + "')"
-
-def _sql_array(iterable) -> str:
-    if not iterable:
-        return "NULL"
-    items = ", ".join("'" + str(x).replace("'", "''") + "'" for x in iterable)
-    return f"ARRAY_CONSTRUCT({items})"
+def changed_rows(after: pd.DataFrame, before: pd.DataFrame, cols: Iterable[str], id_col: str = "ID") -> pd.DataFrame:
+    """
+    Linhas de `after` com valor diferente de `before` (casadas por `id_col`) em alguma de `cols`.
+    NULL e "" contam como diferentes (o banco distingue). ID ausente em `before` = mudou.
+    """
+    cols = [c for c in cols if c in after.columns]
+    if after.empty or not cols or id_col not in after.columns:
+        return after.iloc[0:0]
+    if before is None or before.empty or id_col not in before.columns:
+        return after
+    base = before.drop_duplicates(id_col).set_index(id_col).reindex(after[id_col].to_numpy())
+    dirty = pd.Series(False, index=after.index)
+    for c in cols:
+        a = after[c].astype("string").reset_index(drop=True)
+        b = (base[c] if c in base.columns else pd.Series(pd.NA, index=base.index)).astype("string").reset_index(drop=True)
+        na_a, na_b = a.isna(), b.isna()
+        diff = (na_a != na_b) | (~na_a & ~na_b & (a.fillna("") != b.fillna("")))
+        dirty |= diff.to_numpy()
+    return after[dirty.to_numpy()]
 
-def fetch_row_snapshot(session, table_fqn: str, item_id: int):
-    try:
-        df = session.sql(f"SELECT OBJECT_CONSTRUCT(*) AS O FROM {table_fqn} WHERE ID = ?", params=[item_id]).to_pandas()
-        if df.empty:
-            return None
-        return df.iloc[0]["O"]
-    except Exception:
+def _stage_str(v) -> str | None:
+    if v is None or (isinstance(v, float) and pd.isna(v)) or v is pd.NA or v is pd.NaT:
         return None
+    return str(v)
 
-def log_validacao(session, *, item_id, codigo_produto, origem, destino, obs, user):
-    sql = f"""
-      INSERT INTO {FQN_LOG_VALID}
-      (ITEM_ID, CODIGO_PRODUTO, ORIGEM_TABELA, DESTINO_TABELA, OBSERVACAO, APROVADO_POR_USER, APROVADO_POR_NOME)
-      SELECT ?, ?, ?, ?, ?, ?, ?
-    """
-    params = [
-        item_id, codigo_produto, origem, destino, obs,
-        (user or {}).get("username"), (user or {}).get("name"),
-    ]
-    session.sql(sql, params=params).collect()
+_TS_CAST = {
+    T.TimestampTimeZone.NTZ: "TO_TIMESTAMP_NTZ",
+    T.TimestampTimeZone.LTZ: "TO_TIMESTAMP_LTZ",
+    T.TimestampTimeZone.TZ: "TO_TIMESTAMP_TZ",
+}
 
-def log_reprovacao(session, *, item_id, codigo_produto, origem, destino, motivo, user):
-    sql = f"""
-      INSERT INTO {FQN_LOG_REPROV}
-      (ITEM_ID, CODIGO_PRODUTO, ORIGEM_TABELA, DESTINO_TABELA, MOTIVO, REPROVADO_POR_USER, REPROVADO_POR_NOME)
-      SELECT ?, ?, ?, ?, ?, ?, ?
+def _cast_sql(expr: str, datatype: Any) -> str:
     """
-    params = [
-        item_id, codigo_produto, origem, destino, motivo,
-        (user or {}).get("username"), (user or {}).get("name"),
-    ]
-    session.sql(sql, params=params).collect()
+    `expr` (texto da tabela de staging) convertido para o tipo da coluna de destino.
+    Conversões estritas (TO_*): valor inválido falha o comando (e a transação) em vez de virar NULL.
+    """
+    if isinstance(datatype, T.DecimalType):
+        return f"TO_NUMBER({expr}, {datatype.precision}, {datatype.scale})"
+    if isinstance(datatype, (T.LongType, T.IntegerType, T.ShortType, T.ByteType)):
+        return f"TO_NUMBER({expr}, 38, 0)"
+    if isinstance(datatype, (T.DoubleType, T.FloatType)):
+        return f"TO_DOUBLE({expr})"
+    if isinstance(datatype, T.BooleanType):
+        return f"TO_BOOLEAN({expr})"
+    if isinstance(datatype, T.TimestampType):
+        return f"{_TS_CAST.get(getattr(datatype, 'tz', None), 'TO_TIMESTAMP')}({expr})"
+    if isinstance(datatype, T.DateType):
+        return f"TO_DATE({expr})"
+    if isinstance(datatype, T.TimeType):
+        return f"TO_TIME({expr})"
+    if isinstance(datatype, (T.VariantType, T.ArrayType, T.MapType, T.StructType)):
+        return f"PARSE_JSON({expr})"
+    return expr
 
-def log_atualizacao(session, *, item_id, codigo_produto, colunas_alteradas, before_obj, after_obj, user):
-    sql = f"""
-      INSERT INTO {FQN_LOG_ATUAL}
-      (ITEM_ID, CODIGO_PRODUTO, COLUNAS_ALTERADAS, BEFORE_SNAPSHOT, AFTER_SNAPSHOT, ATUALIZADO_POR_USER, ATUALIZADO_POR_NOME)
-      SELECT ?, ?, {_sql_array(colunas_alteradas)}, {_sql_json(before_obj)}, {_sql_json(after_obj)}, ?, ?
+def update_rows_batch(
+    session: Session,
+    table_fqn: str,
+    key_col: str,
+    updates: list[tuple[Any, dict[str, Any], list[str]]],
+    *,
+    user: dict | None,
+    stamp_data: bool = True,
+    usuario: str | None = None,
+) -> int:
     """
-    params = [
-        item_id, codigo_produto,
-        (user or {}).get("username"), (user or {}).get("name"),
+    Aplica várias atualizações de uma vez: updates = [(chave, {coluna: valor}, colunas_alteradas)].
+      1) as linhas vão para uma tabela temporária (valores como texto; no SET cada coluna é
+         convertida explicitamente para o tipo do destino, ver _cast_sql/table_types)
+      2) numa transação: guarda OBJECT_CONSTRUCT(*) de antes, um único MERGE e um único
+         INSERT ... SELECT em TBL_LOG_ATUALIZACAO com antes/depois
+    Cada linha só altera as suas colunas (as demais ficam como estão). Retorna nº de linhas atualizadas.
+    Em erro faz ROLLBACK e propaga a exceção.
+    """
+    if not updates:
+        return 0
+    set_cols = list(dict.fromkeys(c for _, vals, _ in updates for c in vals))
+    stage = pd.DataFrame({
+        key_col: [k for k, _, _ in updates],
+        **{f"V_{c}": pd.Series([_stage_str(vals.get(c)) for _, vals, _ in updates], dtype="string") for c in set_cols},
+        "SET_COLS": [",".join(vals) for _, vals, _ in updates],
+        "COLUNAS_ALTERADAS": [",".join(cols) for _, _, cols in updates],
+    })
+
+    db, schema, _ = table_fqn.split(".")
+    tmp = f"{db}.{schema}.TMP_ATUALIZACAO_{uuid.uuid4().hex.upper()}"
+    tipos = table_types(session, table_fqn)
+    sets = [
+        f"{c} = IFF(ARRAY_CONTAINS('{c}'::VARIANT, SPLIT(s.SET_COLS, ',')), {_cast_sql(f's.V_{c}', tipos.get(c))}, t.{c})"
+        for c in set_cols
     ]
-    session.sql(sql, params=params).collect()
+    params = []
+    if stamp_data:
+        sets.append("DATA_ATUALIZACAO = CURRENT_TIMESTAMP()")
+    if usuario:
+        sets.append("USUARIO_ATUALIZACAO = ?")
+        params.append(usuario)
+    try:
+        # DDL faz commit implícito: tabela temporária e coluna do "antes" criadas antes do BEGIN
+        session.write_pandas(
+            stage, tmp.split(".")[-1], database=db, schema=schema,
+            auto_create_table=True, overwrite=True, table_type="temp",
+        )
+        session.sql(f"ALTER TABLE {tmp} ADD COLUMN BEFORE_O VARIANT").collect()
+        session.sql("BEGIN").collect()
+        try:
+            session.sql(f"""
+                UPDATE {tmp} s SET BEFORE_O = OBJECT_CONSTRUCT(t.*)
+                FROM {table_fqn} t WHERE t.{key_col} = s.{key_col}
+            """).collect()
+            res = session.sql(f"""
+                MERGE INTO {table_fqn} t
+                USING {tmp} s ON t.{key_col} = s.{key_col}
+                WHEN MATCHED THEN UPDATE SET {', '.join(sets)}
+            """, params=params or None).collect()
+            refresh_search_doc(session, table_fqn, f"{key_col} IN (SELECT {key_col} FROM {tmp})")
+            session.sql(f"""
+                INSERT INTO {FQN_LOG_ATUAL}
+                (ITEM_ID, CODIGO_PRODUTO, COLUNAS_ALTERADAS, BEFORE_SNAPSHOT, AFTER_SNAPSHOT, ATUALIZADO_POR_USER, ATUALIZADO_POR_NOME)
+                SELECT t.ID, t.CODIGO_PRODUTO, SPLIT(s.COLUNAS_ALTERADAS, ','), s.BEFORE_O, OBJECT_CONSTRUCT(t.*), ?, ?
+                FROM {tmp} s JOIN {table_fqn} t ON t.{key_col} = s.{key_col}
+            """, params=[(user or {}).get("username"), (user or {}).get("name")]).collect()
+            session.sql("COMMIT").collect()
+        except Exception:
+            session.sql("ROLLBACK").collect()
+            raise
+    finally:
+        try:
+            session.sql(f"DROP TABLE IF EXISTS {tmp}").collect()
+        except Exception:
+            pass
+    return int(res[0][0]) if res else 0
 
 
 # --- add acima (próximo das outras funções) ---
@@ -394,32 +1392,7 @@ def fetch_existing_codigos_dual(session: Session, codigos: list[str]) -> tuple[s
     if not codigos:
         return set(), set()
 
-    codigos = [c for c in {str(x).strip() for x in codigos} if c]
-    CHUNK = 1000
-
-    exist_pend: set[str] = set()
-    exist_aprv: set[str] = set()
-
-    for i in range(0, len(codigos), CHUNK):
-        chunk = codigos[i:i+CHUNK]
-        placeholders = ", ".join(["?"] * len(chunk))
-
-        q_pend = f"""
-          SELECT DISTINCT CODIGO_PRODUTO
-          FROM {FQN_MAIN}
-          WHERE CODIGO_PRODUTO IN ({placeholders})
-        """
-        df1 = session.sql(q_pend, params=chunk).to_pandas()
-        if not df1.empty:
-            exist_pend |= {str(x).strip() for x in df1["CODIGO_PRODUTO"].astype(str).tolist()}
-
-        q_aprv = f"""
-          SELECT DISTINCT CODIGO_PRODUTO
-          FROM {FQN_APR}
-          WHERE CODIGO_PRODUTO IN ({placeholders})
-        """
-        df2 = session.sql(q_aprv, params=chunk).to_pandas()
-        if not df2.empty:
-            exist_aprv |= {str(x).strip() for x in df2["CODIGO_PRODUTO"].astype(str).tolist()}
-
+    origens = fetch_codigo_origens(session, codigos)
+    exist_pend = {c for c, o in origens.items() if ORIGEM_PEND in o}
+    exist_aprv = {c for c, o in origens.items() if ORIGEM_APR in o}
     return exist_pend, exist_aprv
@@ -0,0 +1,185 @@
+from __future__ import annotations
+import os
+import time
+from typing import Callable, Mapping
+
+import pandas as pd
+from snowflake.snowpark import Session
+from snowflake.snowpark.types import FloatType, PandasSeriesType, StringType
+
+from src.search_doc import refresh_busca_sql
+from src.utils import extrair_valores_series, gerar_palavra_chave_series, gerar_sinonimo_series
+
+# =========================
+# Derivados (DESCRICAO / SINONIMO / PALAVRA_CHAVE) como UDFs vetorizadas
+# =========================
+# As UDFs rodam o mesmo código de src.utils (versões *_series), recebendo lotes do
+# warehouse como pandas.Series. Assim o recálculo da tabela inteira é um único
+# UPDATE ... SET SINONIMO = UDF(...), sem trazer linhas para o app.
+# Uso: página Tabelas (ADMIN) -> db_snowflake.recompute_derivados_tables, ou à mão:
+#   udfs = register_derivados_udfs(session); recompute_derivados(session, fqn, udfs)
+
+UDF_MAX_BATCH = 10_000
+
+ColumnResolver = Callable[[Session, str], list[str]]
+
+
+def _texto(s: pd.Series) -> pd.Series:
+    """VARCHAR do lote: NULL -> None (como chega do app)."""
+    return s.astype(object).where(s.notna(), None)
+
+
+def _numero(s: pd.Series) -> pd.Series:
+    """FLOAT do lote: NaN -> None."""
+    return pd.Series([None if pd.isna(v) else float(v) for v in s], index=s.index, dtype=object)
+
+
+def udf_descricao(especificacao: pd.Series) -> pd.Series:
+    return extrair_valores_series(_texto(especificacao))
+
+
+def udf_sinonimo(item, descricao, marca, fabricante, qtd_med, un_med, emb_produto, qtd_emb_comercial, emb_comercial) -> pd.Series:
+    return gerar_sinonimo_series(
+        _texto(item), _texto(descricao), _texto(marca), _texto(fabricante),
+        _numero(qtd_med), _texto(un_med),
+        _texto(emb_produto), _numero(qtd_emb_comercial), _texto(emb_comercial),
+    )
+
+
+def udf_palavra_chave(subfamilia, item, marca, fabricante, emb_produto, qtd_med, un_med, familia) -> pd.Series:
+    return gerar_palavra_chave_series(
+        _texto(subfamilia), _texto(item), _texto(marca), _texto(fabricante), _texto(emb_produto),
+        _numero(qtd_med), _texto(un_med), _texto(familia),
+    )
+
+
+_S, _F = StringType(), FloatType()
+
+# nome lógico -> (corpo, [(coluna de entrada, tipo)])
+UDFS: dict[str, tuple[Callable[..., pd.Series], list[tuple[str, object]]]] = {
+    "DESCRICAO": (udf_descricao, [("ESPECIFICACAO", _S)]),
+    "SINONIMO": (udf_sinonimo, [
+        ("ITEM", _S), ("DESCRICAO", _S), ("MARCA", _S), ("FABRICANTE", _S), ("QTD_MED", _F),
+        ("UN_MED", _S), ("EMB_PRODUTO", _S), ("QTD_EMB_COMERCIAL", _F), ("EMB_COMERCIAL", _S),
+    ]),
+    "PALAVRA_CHAVE": (udf_palavra_chave, [
+        ("SUBFAMILIA", _S), ("ITEM", _S), ("MARCA", _S), ("FABRICANTE", _S),
+        ("EMB_PRODUTO", _S), ("QTD_MED", _F), ("UN_MED", _S), ("FAMILIA", _S),
+    ]),
+}
+
+
+def register_derivados_udfs(
+    session: Session,
+    *,
+    prefix: str = "UDF_CATALOGO_",
+    stage_location: str | None = None,
+) -> dict[str, str]:
+    """
+    Registra as UDFs vetorizadas (DESCRICAO, SINONIMO, PALAVRA_CHAVE) e devolve {nome lógico: nome SQL}.
+    `prefix` pode ser qualificado (ex.: "DB.SCHEMA.UDF_CATALOGO_"). Com `stage_location` ficam
+    permanentes; sem, valem só para a sessão.
+    """
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    nomes = {}
+    for chave, (corpo, entradas) in UDFS.items():
+        nome = f"{prefix}{chave}"
+        session.udf.register(
+            corpo,
+            return_type=PandasSeriesType(StringType()),
+            input_types=[PandasSeriesType(t) for _, t in entradas],
+            name=nome,
+            is_permanent=stage_location is not None,
+            stage_location=stage_location,
+            replace=True,
+            max_batch_size=UDF_MAX_BATCH,
+            packages=["snowflake-snowpark-python", "pandas", "numpy"],
+            imports=[
+                (os.path.join(src_dir, "utils.py"), "src.utils"),
+                (os.path.join(src_dir, "search_doc.py"), "src.search_doc"),
+                (os.path.join(src_dir, "derivados_udf.py"), "src.derivados_udf"),
+            ],
+        )
+        nomes[chave] = nome
+    return nomes
+
+
+def recompute_derivados(
+    session: Session,
+    table_fqn: str,
+    udfs: Mapping[str, str],
+    *,
+    recalc_descricao: bool = False,
+    columns: ColumnResolver | None = None,
+) -> dict[str, int | float]:
+    """
+    Recalcula SINONIMO e PALAVRA_CHAVE (e DESCRICAO, com `recalc_descricao`) da tabela inteira
+    num único UPDATE, dentro do warehouse. Só grava linhas cujo valor muda.
+    Colunas de entrada ausentes na tabela entram como NULL. Retorna {"linhas": n, "segundos": s}.
+    Linhas gravadas ganham DATA_ATUALIZACAO (se a tabela tem a coluna), para o delta dos snapshots.
+    """
+    existentes = {c.upper() for c in (columns(session, table_fqn) if columns else session.table(table_fqn).columns)}
+
+    def chamada(chave: str, desc_sql: str | None = None) -> str:
+        args = []
+        for col, _ in UDFS[chave][1]:
+            if col == "DESCRICAO" and desc_sql:
+                args.append(desc_sql)
+            else:
+                args.append(f"s.{col}" if col in existentes else "NULL")
+        return f"{udfs[chave]}({', '.join(args)})"
+
+    novos: dict[str, str] = {}
+    desc_sql = None
+    if recalc_descricao and "DESCRICAO" in existentes:
+        desc_sql = chamada("DESCRICAO")
+        novos["DESCRICAO"] = desc_sql
+    for chave in ("SINONIMO", "PALAVRA_CHAVE"):
+        if chave in existentes:
+            novos[chave] = chamada(chave, desc_sql)
+    if not novos:
+        return {"linhas": 0, "segundos": 0.0}
+
+    # subconsulta calcula cada UDF uma vez por linha; o WHERE descarta quem não mudou
+    sel = ", ".join(f"{expr} AS N_{col}" for col, expr in novos.items())
+    sets = ", ".join([f"{col} = n.N_{col}" for col in novos]
+                     + (["DATA_ATUALIZACAO = CURRENT_TIMESTAMP()"] if "DATA_ATUALIZACAO" in existentes else []))
+    mudou = " OR ".join(f"t.{col} IS DISTINCT FROM n.N_{col}" for col in novos)
+    t0 = time.perf_counter()
+    res = session.sql(f"""
+        UPDATE {table_fqn} t
+        SET {sets}
+        FROM (SELECT s.ID, {sel} FROM {table_fqn} s) n
+        WHERE t.ID = n.ID AND ({mudou})
+    """).collect()
+    linhas = int(res[0][0]) if res else 0
+    sql_busca = refresh_busca_sql(table_fqn, existentes, "TRUE")
+    if linhas and sql_busca:
+        session.sql(sql_busca).collect()
+    return {"linhas": linhas, "segundos": time.perf_counter() - t0}
+
+
+def executar_local(df: pd.DataFrame, chave: str, *, batch_size: int = UDF_MAX_BATCH) -> pd.Series:
+    """
+    Caminho de teste local: roda o corpo da UDF `chave` sobre `df` em lotes pandas,
+    com os tipos que o warehouse entrega (VARCHAR -> str/None, FLOAT -> float64 com NaN).
+    """
+    corpo, entradas = UDFS[chave]
+    lotes = []
+    for ini in range(0, len(df), batch_size):
+        parte = df.iloc[ini:ini + batch_size]
+        args = []
+        for col, tipo in entradas:
+            s = parte[col] if col in parte.columns else pd.Series([None] * len(parte), index=parte.index)
+            if isinstance(tipo, FloatType):
+                s = pd.to_numeric(s, errors="coerce").astype("float64")
+            else:
+                s = s.astype(object).where(s.notna(), None)
+            # o warehouse entrega cada lote com índice 0..n-1
+            args.append(s.reset_index(drop=True))
+        out = corpo(*args)
+        out.index = parte.index
+        lotes.append(out)
+    if not lotes:
+        return pd.Series([], index=df.index, dtype=object)
+    return pd.concat(lotes)
@@ -0,0 +1,296 @@
+from __future__ import annotations
+import threading
+from typing import Any, Callable, Hashable, Iterable
+
+import numpy as np
+import pandas as pd
+
+from src.compact import by_category
+from src.db_snowflake import CASCADE_COLS
+from src.snapshot import TableSnapshot
+
+# =========================
+# Filtros em dropdown + cascata GRUPO → CATEGORIA → SEGMENTO → FAMILIA → SUBFAMILIA
+# =========================
+# FacetIndex é montado uma vez por versão do snapshot: por nível, código inteiro de cada
+# linha (0 = vazio; 1.. na ordem das opções), posições das linhas de cada valor (CSR) e,
+# para cada prefixo da hierarquia (ex.: GRUPO=X, CATEGORIA=Y), os filhos com contagem.
+# A cada rerun, as opções saem de consulta ao prefixo (ou bincount no escopo) e o escopo
+# é AND de máscaras por posição; nada de normalizar strings de novo.
+# Colunas de filtro fora da cascata (INSUMO, CODIGO_PRODUTO) ficam no mesmo índice
+# (FacetIndex.column): normalizadas uma vez por versão, compartilhadas entre as sessões.
+
+ALL_LABEL = "Todos"
+NULL_LABEL = "(vazio)"
+TODOS = -1   # nível em "Todos" dentro de um prefixo da cascata
+_CACHE_MASCARAS = 128   # máscaras guardadas por índice (FacetIndex.memo)
+
+
+def norm_str_series(s: pd.Series, *, drop_dot_zero: bool = False) -> pd.Series:
+    """
+    Normaliza valores para filtros:
+    - converte para string
+    - remove .0 no final (útil p/ EAN vindo como float)
+    - strip
+    - vazio -> NA
+    """
+    s = s.astype("string")
+    if drop_dot_zero:
+        s = s.str.replace(r"\.0$", "", regex=True)
+    s = s.str.strip()
+    s = s.replace(["", "nan", "NaN", "None"], pd.NA)
+    return s
+
+
+def _valores(s_norm: pd.Series) -> list[str]:
+    """Valores distintos não vazios, na ordem das opções."""
+    uniq = pd.Series(pd.unique(s_norm.dropna())).astype("string")
+    return uniq[uniq.str.len() > 0].sort_values().tolist()
+
+
+def dropdown_options(s_norm: pd.Series, *, all_label: str = ALL_LABEL, null_label: str = NULL_LABEL) -> list[str]:
+    opts = [all_label]
+    if s_norm.isna().any():
+        opts.append(null_label)
+    opts.extend(_valores(s_norm))
+    return opts
+
+
+class NormColumn:
+    """
+    norm_str_series de uma coluna como códigos: codes[linha] = 0 (vazio) ou 1.. na ordem
+    de `labels` (a mesma de dropdown_options).
+    """
+
+    def __init__(self, s: pd.Series | None, n: int, *, drop_dot_zero: bool = False):
+        if s is None:
+            s = pd.Series(pd.NA, index=pd.RangeIndex(n), dtype="string")
+        else:
+            s = by_category(s, lambda x: norm_str_series(x, drop_dot_zero=drop_dot_zero))
+        self.labels = _valores(s)
+        vals = s.astype(object).where(s.notna(), None)
+        self.codes = (pd.Index(self.labels, dtype=object).get_indexer(vals) + 1).astype(np.int32)
+        self._codigo = {v: i + 1 for i, v in enumerate(self.labels)}
+        self._todas = self._opcoes(np.flatnonzero(np.bincount(self.codes, minlength=len(self.labels) + 1)))
+
+    def _opcoes(self, presentes: np.ndarray) -> list[str]:
+        opts = [ALL_LABEL]
+        if len(presentes) and presentes[0] == 0:
+            opts.append(NULL_LABEL)
+        opts.extend(self.labels[c - 1] for c in presentes if c)
+        return opts
+
+    def code_of(self, selected: str) -> int | None:
+        """Código da opção escolhida (0 = vazio); None se não existe."""
+        return 0 if selected == NULL_LABEL else self._codigo.get(selected)
+
+    def options(self, rows: np.ndarray | None = None) -> list[str]:
+        """dropdown_options das linhas `rows` (None = todas; lista pronta, sem recalcular)."""
+        if rows is None or len(rows) == len(self.codes):
+            return list(self._todas)
+        k = self.codes[rows]
+        return self._opcoes(np.flatnonzero(np.bincount(k, minlength=len(self.labels) + 1)))
+
+    def mask(self, selected: str) -> np.ndarray | None:
+        """Máscara (todas as linhas) da opção escolhida; None = "Todos" (sem filtro)."""
+        if selected == ALL_LABEL:
+            return None
+        codigo = self.code_of(selected)
+        if codigo is None:
+            return np.zeros(len(self.codes), dtype=bool)
+        return self.codes == codigo
+
+
+class FacetIndex:
+    """Cascata pré-computada sobre um frame (linhas identificadas pela posição)."""
+
+    def __init__(self, df: pd.DataFrame, levels: Iterable[str] = CASCADE_COLS):
+        n = len(df)
+        self.n = n
+        self.levels = list(levels)
+        self.ids = df["ID"].to_numpy() if "ID" in df.columns else None
+        self._ordem_ids = np.argsort(self.ids, kind="stable") if self.ids is not None else None
+        self._df = df
+        self._colunas: dict[tuple[str, bool], NormColumn] = {}
+        self._colunas_lock = threading.Lock()
+        self._memo: dict[Hashable, Any] = {}
+        self._memo_lock = threading.Lock()
+
+        self._niveis: list[NormColumn] = []
+        self.labels: list[list[str]] = []     # por nível: valores na ordem das opções
+        self._k: list[np.ndarray] = []        # por nível: código de cada linha (0 = vazio)
+        self._linhas: list[np.ndarray] = []   # por nível: posições agrupadas por código
+        self._inicio: list[np.ndarray] = []
+        for col in self.levels:
+            nc = NormColumn(df[col] if col in df.columns else None, n)
+            k = nc.codes
+            ordem = np.argsort(k, kind="stable").astype(np.int32)
+            self._niveis.append(nc)
+            self.labels.append(nc.labels)
+            self._k.append(k)
+            self._linhas.append(ordem)
+            self._inicio.append(np.searchsorted(k[ordem], np.arange(len(nc.labels) + 2)))
+
+        # prefixo (código de cada nível acima; TODOS = "Todos") -> fatia [ini, fim) de
+        # _filho_cod / _filho_cont (códigos dos filhos e contagens)
+        self._filhos: list[dict[tuple[int, ...], tuple[int, int]]] = []
+        self._filho_cod: list[np.ndarray] = []
+        self._filho_cont: list[np.ndarray] = []
+        # por combinação de níveis fixos/"Todos": (níveis fixos, id denso do prefixo
+        # de cada linha, uma linha representante por prefixo)
+        estados = [((), np.zeros(n, dtype=np.int64), np.zeros(1, dtype=np.int64))]
+        for i, k in enumerate(self._k):
+            base = len(self.labels[i]) + 1
+            filhos: dict[tuple[int, ...], tuple[int, int]] = {}
+            cods, conts, desloc = [], [], 0
+            proximos = []
+            for fixos, chave, rep in estados:
+                comb, primeira, inv, cont = np.unique(
+                    chave * base + k, return_index=True, return_inverse=True, return_counts=True
+                )
+                pref, filho = comb // base, comb % base
+                cortes = np.flatnonzero(np.diff(pref)) + 1
+                if len(comb):
+                    r = rep[pref[np.concatenate(([0], cortes))]]
+                    chaves = np.column_stack(
+                        [self._k[j][r] if j in fixos else np.full(len(r), TODOS) for j in range(i)]
+                    ) if i else np.empty((len(r), 0), dtype=np.int64)
+                    inis = np.concatenate(([0], cortes)) + desloc
+                    fims = np.concatenate((cortes, [len(comb)])) + desloc
+                    filhos.update(zip(map(tuple, chaves.tolist()), zip(inis.tolist(), fims.tolist())))
+                cods.append(filho)
+                conts.append(cont)
+                desloc += len(comb)
+                proximos.append((fixos + (i,), inv.ravel(), primeira))
+                proximos.append((fixos, chave, rep))
+            self._filhos.append(filhos)
+            self._filho_cod.append(np.concatenate(cods))
+            self._filho_cont.append(np.concatenate(conts))
+            estados = proximos
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "FacetIndex":
+        return cls(df)
+
+    def column(self, col: str, *, drop_dot_zero: bool = False) -> NormColumn:
+        """Coluna de filtro normalizada (calculada na primeira vez; vive enquanto o índice viver)."""
+        chave = (col, drop_dot_zero)
+        hit = self._colunas.get(chave)
+        if hit is not None:
+            return hit
+        with self._colunas_lock:
+            hit = self._colunas.get(chave)
+            if hit is None:
+                s = self._df[col] if col in self._df.columns else None
+                hit = self._colunas[chave] = NormColumn(s, self.n, drop_dot_zero=drop_dot_zero)
+        return hit
+
+    def memo(self, chave: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Valor calculado sobre as linhas do índice (ex.: máscara de um filtro), guardado por
+        `chave`. O índice é um por versão do snapshot: a chave não precisa da versão.
+        """
+        hit = self._memo.get(chave)
+        if hit is not None:
+            return hit
+        value = fn()
+        with self._memo_lock:
+            if len(self._memo) >= _CACHE_MASCARAS:
+                self._memo.clear()
+            self._memo[chave] = value
+        return value
+
+    def rows_of(self, df: pd.DataFrame) -> np.ndarray | None:
+        """Posições das linhas de `df` no índice (pelo ID); None se alguma não estiver nele."""
+        if self.ids is None or "ID" not in df.columns:
+            return None
+        alvo = df["ID"].to_numpy()
+        if not len(alvo):
+            return np.empty(0, dtype=np.int64)
+        if not self.n:
+            return None
+        ids_ord = self.ids[self._ordem_ids]
+        try:
+            j = np.minimum(np.searchsorted(ids_ord, alvo), self.n - 1)
+        except TypeError:
+            return None
+        if not np.array_equal(ids_ord[j], alvo):
+            return None
+        return self._ordem_ids[j]
+
+    def bitmap(self, nivel: int, codigo: int) -> np.ndarray:
+        def build() -> np.ndarray:
+            m = np.zeros(self.n, dtype=bool)
+            m[self._linhas[nivel][self._inicio[nivel][codigo]:self._inicio[nivel][codigo + 1]]] = True
+            return m
+        return self.memo(("nivel", nivel, codigo), build)
+
+    def cascade(self, rows: np.ndarray | None = None, *, mask: np.ndarray | None = None) -> "FacetCascade":
+        """Cascata a partir das posições `rows` ou da máscara `mask` (nenhum = todas as linhas)."""
+        if mask is not None:
+            return FacetCascade(self, None if mask.all() else mask)
+        if rows is None or len(rows) == self.n:
+            return FacetCascade(self, None)
+        m = np.zeros(self.n, dtype=bool)
+        m[rows] = True
+        return FacetCascade(self, m)
+
+
+class FacetCascade:
+    """
+    Percorre os níveis em ordem: options() do nível atual, select() da escolha e
+    segue para o próximo. `mask` = escopo atual sobre as linhas do índice (None = todas).
+    """
+
+    def __init__(self, index: FacetIndex, mask: np.ndarray | None):
+        self.index = index
+        self.mask = mask
+        self.nivel = 0
+        # sem escopo inicial, as opções saem dos prefixos pré-computados
+        self._prefixo: tuple[int, ...] | None = () if mask is None else None
+
+    def options(self) -> list[str]:
+        ix, i = self.index, self.nivel
+        if self._prefixo is not None:
+            ini, fim = ix._filhos[i].get(self._prefixo, (0, 0))
+            presentes = ix._filho_cod[i][ini:fim]
+        else:
+            k = ix._k[i] if self.mask is None else ix._k[i][self.mask]
+            presentes = np.flatnonzero(np.bincount(k, minlength=len(ix.labels[i]) + 1))
+        return ix._niveis[i]._opcoes(presentes)
+
+    def select(self, selected: str) -> None:
+        ix, i = self.index, self.nivel
+        self.nivel += 1
+        if selected == ALL_LABEL:
+            if self._prefixo is not None:
+                self._prefixo = self._prefixo + (TODOS,)
+            return
+        codigo = ix._niveis[i].code_of(selected)
+        if codigo is None:
+            self.mask = np.zeros(ix.n, dtype=bool)
+            self._prefixo = None
+            return
+        b = ix.bitmap(i, codigo)
+        self.mask = b if self.mask is None else self.mask & b
+        if self._prefixo is not None:
+            self._prefixo = self._prefixo + (codigo,)
+
+    def rows_mask(self, rows: np.ndarray) -> np.ndarray:
+        """Máscara booleana para um frame cujas linhas estão nas posições `rows` do índice."""
+        if self.mask is None:
+            return np.ones(len(rows), dtype=bool)
+        return self.mask[rows]
+
+
+def facet_index(snapshot: TableSnapshot | None, df: pd.DataFrame) -> tuple[FacetIndex, np.ndarray]:
+    """
+    Índice da cascata para as linhas de `df` e as posições delas nele. Usa o índice do
+    snapshot (um por versão) quando `df` saiu dele; senão indexa o próprio `df`.
+    """
+    if snapshot is not None and snapshot.df is not None:
+        ix = snapshot.derived("facets", FacetIndex.from_frame)
+        rows = ix.rows_of(df)
+        if rows is not None:
+            return ix, rows
+    return FacetIndex(df), np.arange(len(df))
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from snowflake.snowpark import Session
+
+from src.db_snowflake import ALL, SEARCH_COLS, CatalogFilter, build_user_options, ids_matching
+from src.facets import ALL_LABEL, FacetIndex, facet_index
+from src.search_index import search_index
+from src.snapshot import TableSnapshot
+
+# =========================
+# Bloco de filtros das telas (Validação, Catálogo, Atualização, Não Aprovados)
+# =========================
+#   ID | Usuário | Insumo | Código
+#   Palavra-chave | Grupo | Categoria | Segmento
+#   Família | Subfamília
+# Chaves dos widgets: "<prefix>_f_id", "<prefix>_sel_user", "<prefix>_sel_insumo_dd",
+# "<prefix>_sel_codigo_dd", "<prefix>_f_palavra", "<prefix>_sel_<nível>_dd".
+# Cada filtro vira uma máscara sobre as linhas do FacetIndex, guardada nele com a chave
+# (filtro, valor); como o índice é um por versão do snapshot, mudar um filtro recalcula
+# só a máscara dele. O resultado são posições de linha do frame da página (sem cópia).
+# Snapshot projetado (sem as colunas da busca): a palavra-chave é resolvida no banco
+# (só os IDs), também guardada por valor.
+
+CASCADE_LABELS = {
+    "GRUPO": "Grupo",
+    "CATEGORIA": "Categoria",
+    "SEGMENTO": "Segmento",
+    "FAMILIA": "Família",
+    "SUBFAMILIA": "Subfamília",
+}
+
+
+def selectbox_with_reset(label: str, options: list[str], key: str) -> str:
+    """Selectbox que volta para "Todos" quando a escolha atual saiu das opções."""
+    cur = st.session_state.get(key, ALL_LABEL)
+    if cur not in options:
+        st.session_state[key] = ALL_LABEL
+        cur = ALL_LABEL
+    return st.selectbox(label, options, index=options.index(cur), key=key)
+
+
+def _and(a: np.ndarray | None, b: np.ndarray | None) -> np.ndarray | None:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a & b
+
+
+class FilterPanel:
+    """
+    Filtros de uma página sobre `df` (frame do `snapshot`, em qualquer ordem/colunas).
+    render() desenha os widgets e devolve as posições (em `df`) das linhas que passam.
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        snapshot: TableSnapshot | None,
+        df: pd.DataFrame,
+        user_map: dict | None = None,
+        *,
+        session: Session | None = None,
+    ):
+        self.prefix = prefix
+        self.snapshot = snapshot
+        self.df = df
+        self.user_map = user_map or {}
+        self.session = session
+        self.index, self.index_rows = facet_index(snapshot, df)
+
+    def key(self, nome: str) -> str:
+        return f"{self.prefix}_{nome}"
+
+    # ---------- máscaras (linhas do índice; None = sem filtro) ----------
+    def _spec_mask(self, chave: tuple, spec: CatalogFilter) -> np.ndarray:
+        ix: FacetIndex = self.index
+
+        def build() -> np.ndarray:
+            search = search_index(self.snapshot) if (self.snapshot is not None and spec.palavra) else None
+            return spec.mask(ix._df, self.user_map, search=search).to_numpy(dtype=bool)
+
+        return ix.memo(chave, build)
+
+    def _mask_user(self, sel: str | None) -> np.ndarray | None:
+        if not sel or sel == ALL:
+            return None
+        # o display de cada linha depende do mapa de usuários: entra na chave
+        mapa = tuple(sorted((str(k), str(v)) for k, v in self.user_map.items()))
+        return self._spec_mask(("usuario", sel, mapa), CatalogFilter(user_name=sel))
+
+    def _mask_palavra(self, palavra: str | None) -> np.ndarray | None:
+        if not palavra:
+            return None
+        ix, spec = self.index, CatalogFilter(palavra=palavra)
+        sem_busca = not all(c in ix._df.columns for c in SEARCH_COLS)
+        if sem_busca and self.session is not None and self.snapshot is not None and ix.ids is not None:
+            def build() -> np.ndarray:
+                return np.isin(ix.ids, ids_matching(self.session, self.snapshot.table_fqn, spec))
+            return ix.memo(("palavra_banco", palavra), build)
+        return self._spec_mask(("palavra", palavra), spec)
+
+    def _mask_id(self, item_id: str | None) -> np.ndarray | None:
+        if not item_id:
+            return None
+        return self._spec_mask(("id", item_id), CatalogFilter(item_id=item_id))
+
+    def _mask_coluna(self, col: str, selected: str, *, drop_dot_zero: bool = False) -> np.ndarray | None:
+        if selected == ALL_LABEL:
+            return None
+        c = self.index.column(col, drop_dot_zero=drop_dot_zero)
+        return self.index.memo((col, drop_dot_zero, selected), lambda: c.mask(selected))
+
+    def _no_frame(self) -> np.ndarray | None:
+        """Linhas do índice que estão em `df` (None = todas)."""
+        ix = self.index
+        if len(self.index_rows) == ix.n:
+            return None
+        m = np.zeros(ix.n, dtype=bool)
+        m[self.index_rows] = True
+        return m
+
+    # ---------- widgets ----------
+    def render(self) -> np.ndarray:
+        ix, k = self.index, self.key
+        # usuário / palavra-chave / ID: valores da rodada (widgets ainda não desenhados)
+        spec = CatalogFilter.from_state(self.prefix)
+        escopo = _and(
+            self._no_frame(),
+            _and(self._mask_user(spec.user_name), _and(self._mask_palavra(spec.palavra), self._mask_id(spec.item_id))),
+        )
+        linhas = np.arange(ix.n) if escopo is None else np.flatnonzero(escopo)
+
+        c_insumo = ix.column("INSUMO")
+        c_codigo = ix.column("CODIGO_PRODUTO", drop_dot_zero=True)
+        opcoes_usuario = ix.memo(
+            ("opcoes_usuario", tuple(sorted((str(a), str(b)) for a, b in self.user_map.items()))),
+            lambda: build_user_options(ix._df, self.user_map),
+        )
+
+        r1 = st.columns(4)
+        with r1[0]:
+            sel_id = st.text_input("ID", key=k("f_id"))
+        with r1[1]:
+            st.selectbox("Usuário (cadastro)", opcoes_usuario, index=0, key=k("sel_user"))
+        with r1[2]:
+            # opções dependem da busca (usuário/palavra/ID): reseta seleção que sumiu
+            sel_insumo = selectbox_with_reset("Insumo", c_insumo.options(linhas), key=k("sel_insumo_dd"))
+        with r1[3]:
+            sel_codigo = selectbox_with_reset("Código do Produto (exato)", c_codigo.options(linhas), key=k("sel_codigo_dd"))
+
+        r2 = st.columns(4)
+        with r2[0]:
+            st.text_input("Palavra-chave (contém)", key=k("f_palavra"))
+
+        sel_id_norm = (sel_id or "").strip()
+        if sel_id_norm and not sel_id_norm.isdigit():
+            st.warning("ID inválido. Use um número inteiro.")
+
+        escopo = _and(
+            escopo,
+            _and(self._mask_coluna("INSUMO", sel_insumo), self._mask_coluna("CODIGO_PRODUTO", sel_codigo, drop_dot_zero=True)),
+        )
+        cascata = ix.cascade(mask=escopo)
+
+        r3 = st.columns(4)
+        slots = [r2[1], r2[2], r2[3], r3[0], r3[1]]
+        for col, slot in zip(ix.levels, slots):
+            with slot:
+                sel = selectbox_with_reset(CASCADE_LABELS.get(col, col), cascata.options(), key=k(f"sel_{col.lower()}_dd"))
+            cascata.select(sel)
+        with r3[2]:
+            st.empty()
+        with r3[3]:
+            st.empty()
+
+        return np.flatnonzero(cascata.rows_mask(self.index_rows))
@@ -0,0 +1,119 @@
+from __future__ import annotations
+import re
+from typing import Iterable
+
+import pandas as pd
+
+from snowflake.snowpark import Session
+
+# =========================
+# Documento de busca (coluna BUSCA nas tabelas do catálogo)
+# =========================
+# BUSCA = SEARCH_COLS concatenadas (uma por linha), em minúsculas e sem acento, calculada
+# pelo próprio Snowflake com a expressão abaixo. A palavra-chave é quebrada em palavras
+# (palavras_busca, dobradas como em fold_busca) e cada uma vira um BUSCA LIKE '%palavra%'
+# (todas obrigatórias, em qualquer ordem/coluna): mesma regra do índice invertido
+# (src.search_index) e da varredura em pandas. "acucar" acha "AÇÚCAR".
+# Sem dependência de streamlit: também é usado pela procedure das transições.
+#
+# Instalação (uma vez por tabela): setup_busca(session, fqn) cria a coluna e preenche; na
+# página Tabelas (ADMIN) via db_snowflake.setup_search_docs. Depois, as escritas do app
+# recalculam BUSCA das linhas que tocam (refresh_busca_sql).
+# Limitação: linha alterada fora do app (SQL direto, cargas) fica com BUSCA antiga e a
+# palavra-chave passa a buscar no texto anterior. Com `warehouse`, setup_busca cria também
+# uma TASK que recalcula a tabela inteira a cada `schedule` (só grava as linhas que mudaram);
+# sem a task, a defasagem dura até a próxima escrita do app naquela linha.
+
+BUSCA_COL = "BUSCA"
+INTERNAL_COLS = (BUSCA_COL,)   # não saem nas leituras do app (frames / telas)
+
+BUSCA_TASK_SCHEDULE = "60 MINUTE"
+
+SEARCH_COLS = ["PALAVRA_CHAVE", "SINONIMO", "DESCRICAO", "ITEM", "ESPECIFICACAO", "GRUPO", "CATEGORIA", "SEGMENTO"]
+
+_FOLD_DE = "áàâãäåéèêëíìîïóòôõöúùûüýÿçñ"
+_FOLD_PARA = "aaaaaaeeeeiiiiooooouuuuyycn"
+_FOLD_TABLE = str.maketrans(_FOLD_DE, _FOLD_PARA)
+_PALAVRA_RE = re.compile(r"\w+")
+
+
+def fold_busca(texto: str) -> str:
+    """Mesma dobra da expressão SQL (LOWER + TRANSLATE), para o termo buscado."""
+    return str(texto).lower().translate(_FOLD_TABLE)
+
+
+def fold_busca_series(s: pd.Series) -> pd.Series:
+    """fold_busca numa coluna inteira (texto; nulo vira "")."""
+    return s.astype("string").fillna("").str.lower().str.translate(_FOLD_TABLE)
+
+
+def palavras_busca(texto: str) -> list[str]:
+    """Palavras da consulta (dobradas, sem repetição): todas precisam aparecer na linha."""
+    return list(dict.fromkeys(_PALAVRA_RE.findall(fold_busca(texto or ""))))
+
+
+def busca_expr(columns: Iterable[str], alias: str | None = None) -> str:
+    """Expressão SQL do documento de busca a partir das SEARCH_COLS presentes em `columns`."""
+    cols = {c.upper() for c in columns}
+    pre = f"{alias}." if alias else ""
+    partes = ", ".join(f"TO_VARCHAR({pre}{c})" for c in SEARCH_COLS if c in cols)
+    if not partes:
+        return "''"
+    return (
+        f"TRANSLATE(LOWER(ARRAY_TO_STRING(ARRAY_CONSTRUCT_COMPACT({partes}), CHR(10))), "
+        f"'{_FOLD_DE}', '{_FOLD_PARA}')"
+    )
+
+
+def refresh_busca_sql(table_fqn: str, columns: Iterable[str], where: str) -> str | None:
+    """
+    UPDATE que recalcula BUSCA das linhas em `where` (só as que mudam).
+    None se a tabela ainda não tem a coluna.
+    """
+    cols = [c.upper() for c in columns]
+    if BUSCA_COL not in cols:
+        return None
+    expr = busca_expr(cols)
+    return f"""
+        UPDATE {table_fqn}
+        SET {BUSCA_COL} = {expr}
+        WHERE ({where}) AND {BUSCA_COL} IS DISTINCT FROM {expr}
+    """
+
+
+def busca_task_name(table_fqn: str) -> str:
+    db, schema, table = table_fqn.split(".")
+    return f"{db}.{schema}.TASK_{BUSCA_COL}_{table}"
+
+
+def busca_task_sql(table_fqn: str, columns: Iterable[str], *, warehouse: str, schedule: str = BUSCA_TASK_SCHEDULE) -> str | None:
+    """CREATE TASK que recalcula BUSCA da tabela inteira (pega edições feitas fora do app)."""
+    sql = refresh_busca_sql(table_fqn, columns, "TRUE")
+    if sql is None:
+        return None
+    return f"""
+        CREATE OR REPLACE TASK {busca_task_name(table_fqn)}
+        WAREHOUSE = {warehouse}
+        SCHEDULE = '{schedule}'
+        AS {sql.strip()}
+    """
+
+
+def setup_busca(
+    session: Session,
+    table_fqn: str,
+    *,
+    warehouse: str | None = None,
+    schedule: str = BUSCA_TASK_SCHEDULE,
+) -> int:
+    """
+    Cria a coluna BUSCA (se faltar) e preenche a tabela inteira. Retorna nº de linhas gravadas.
+    Com `warehouse`, (re)cria e liga a TASK de recálculo periódico (a expressão depende das colunas).
+    """
+    session.sql(f"ALTER TABLE {table_fqn} ADD COLUMN IF NOT EXISTS {BUSCA_COL} VARCHAR").collect()
+    cols = [c.name for c in session.table(table_fqn).schema]
+    res = session.sql(refresh_busca_sql(table_fqn, cols, "TRUE")).collect()
+    if warehouse:
+        session.sql(busca_task_sql(table_fqn, cols, warehouse=warehouse, schedule=schedule)).collect()
+        session.sql(f"ALTER TASK {busca_task_name(table_fqn)} RESUME").collect()
+    return int(res[0][0]) if res else 0
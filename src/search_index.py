@@ -0,0 +1,128 @@
+from __future__ import annotations
+import re
+import threading
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+from src.db_snowflake import SEARCH_COLS
+from src.search_doc import palavras_busca
+from src.snapshot import TableSnapshot
+
+# =========================
+# Índice invertido da busca por palavra-chave
+# =========================
+# Tokens (sem acento, casefold) -> posições (ordenadas) das linhas do snapshot que os contêm
+# em alguma das SEARCH_COLS. Construído uma vez por versão do snapshot.
+# Consulta com várias palavras = interseção das listas; cada palavra casa por "contém"
+# contra o vocabulário (acu -> açúcar, açucareiro), nunca contra as linhas.
+
+_CACHE_CONSULTAS = 256
+
+
+def tokens(texto: str) -> list[str]:
+    # mesma dobra/quebra da busca no banco (BUSCA): os dois modos casam as mesmas linhas
+    return palavras_busca(texto)
+
+
+class TokenIndex:
+    """Postings em formato CSR: linhas[inicio[t]:inicio[t + 1]] = posições com o token t."""
+
+    def __init__(self, df: pd.DataFrame, cols: Iterable[str] = SEARCH_COLS):
+        n = len(df)
+        self.n = n
+        self.ids = df["ID"].to_numpy() if "ID" in df.columns else None
+        vocab: dict[str, int] = {}
+        pares: list[np.ndarray] = []
+
+        for c in [c for c in cols if c in df.columns]:
+            codes, uniques = pd.factorize(df[c], use_na_sentinel=True)
+            por_valor = [[vocab.setdefault(t, len(vocab)) for t in set(tokens(str(u)))] for u in uniques]
+            if not por_valor:
+                continue
+            lens = np.fromiter((len(t) for t in por_valor), dtype=np.int64, count=len(por_valor))
+            plano = np.fromiter((t for ts in por_valor for t in ts), dtype=np.int64, count=int(lens.sum()))
+            off = np.concatenate(([0], np.cumsum(lens)[:-1]))
+
+            linhas = np.flatnonzero(codes >= 0)
+            cc = codes[linhas]
+            ln = lens[cc]
+            total = int(ln.sum())
+            if not total:
+                continue
+            # posição de cada (linha, token) dentro de `plano`
+            idx = np.arange(total) - np.repeat(np.cumsum(ln) - ln, ln) + np.repeat(off[cc], ln)
+            pares.append(plano[idx] * max(n, 1) + np.repeat(linhas, ln))
+
+        chaves = np.unique(np.concatenate(pares)) if pares else np.empty(0, dtype=np.int64)
+        tok = chaves // max(n, 1)
+        self.linhas = (chaves % max(n, 1)).astype(np.int32)
+        self.inicio = np.searchsorted(tok, np.arange(len(vocab) + 1))
+
+        # vocabulário numa string só: "contém" vira busca em C, não laço por token
+        self.vocab = list(vocab)
+        self._blob = "\n".join(self.vocab)
+        self._pos_vocab = np.concatenate(([0], np.cumsum([len(t) + 1 for t in self.vocab])[:-1])) if self.vocab else np.empty(0, dtype=np.int64)
+        self._consultas: dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "TokenIndex":
+        return cls(df)
+
+    def _postings(self, t: int) -> np.ndarray:
+        return self.linhas[self.inicio[t]:self.inicio[t + 1]]
+
+    def _token_positions(self, termo: str) -> np.ndarray:
+        """Posições das linhas com algum token que contém `termo`."""
+        hit = self._consultas.get(termo)
+        if hit is not None:
+            return hit
+        ocorr = [m.start() for m in re.finditer(re.escape(termo), self._blob)]
+        if not ocorr:
+            out = np.empty(0, dtype=np.int32)
+        else:
+            ids = np.unique(np.searchsorted(self._pos_vocab, ocorr, side="right") - 1)
+            out = self._postings(int(ids[0])) if len(ids) == 1 else np.unique(np.concatenate([self._postings(int(t)) for t in ids]))
+        with self._lock:
+            if len(self._consultas) >= _CACHE_CONSULTAS:
+                self._consultas.clear()
+            self._consultas[termo] = out
+        return out
+
+    def positions(self, consulta: str) -> np.ndarray | None:
+        """Posições (ordenadas) que casam com todas as palavras; None se a consulta não tem palavras."""
+        termos = sorted(set(tokens(consulta)), key=len, reverse=True)
+        if not termos:
+            return None
+        listas = sorted((self._token_positions(t) for t in termos), key=len)
+        out = listas[0]
+        for p in listas[1:]:
+            if not len(out):
+                break
+            out = np.intersect1d(out, p, assume_unique=True)
+        return out
+
+    def matches(self, df: pd.DataFrame, consulta: str) -> pd.Series | None:
+        """
+        Máscara booleana para `df` (o frame de onde o índice saiu, mesma ordem de linhas).
+        None quando não dá para usar o índice (frame diferente ou consulta sem palavras).
+        """
+        if len(df) != self.n or self.ids is None or "ID" not in df.columns:
+            return None
+        if not np.array_equal(df["ID"].to_numpy(), self.ids):
+            return None
+        pos = self.positions(consulta)
+        if pos is None:
+            return None
+        m = np.zeros(self.n, dtype=bool)
+        m[pos] = True
+        return pd.Series(m, index=df.index)
+
+
+def search_index(snapshot: TableSnapshot) -> TokenIndex | None:
+    """Índice de busca do snapshot, reconstruído só quando a versão dele muda (None antes da carga)."""
+    if snapshot.df is None:
+        return None
+    return snapshot.derived("search_index", TokenIndex.from_frame)
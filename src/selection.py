@@ -0,0 +1,113 @@
+from __future__ import annotations
+from typing import Iterable
+
+import numpy as np
+import streamlit as st
+
+# =========================
+# Seleção de linhas por ID (bitmap)
+# =========================
+# Um bit por ID (bit i & 7 do byte i >> 3), em np.uint8: 100 mil IDs ocupam ~12 KB
+# na session_state. Marcar/desmarcar um ID é O(1); "selecionar todos (visíveis)" é um OR
+# só nos bytes dos IDs visíveis (np.bitwise_or.at), O(nº de IDs) e não O(maior ID);
+# consultar a tela inteira é indexação direta.
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _as_ids(ids: Iterable[int] | np.ndarray) -> np.ndarray:
+    arr = np.asarray(ids if isinstance(ids, np.ndarray) else list(ids), dtype=np.int64).ravel()
+    if len(arr) and arr.min() < 0:
+        raise ValueError("IDs da seleção devem ser inteiros não negativos.")
+    return arr
+
+
+class IdSelection:
+    """Conjunto de IDs inteiros (>= 0) num bitmap empacotado."""
+
+    def __init__(self, ids: Iterable[int] | np.ndarray = ()):
+        self._bits = np.zeros(0, dtype=np.uint8)
+        self.add_many(ids)
+
+    def _grow(self, max_id: int) -> None:
+        n = (int(max_id) >> 3) + 1
+        if n > len(self._bits):
+            # folga para não realocar a cada ID novo
+            self._bits = np.concatenate((self._bits, np.zeros(max(n, 2 * len(self._bits)) - len(self._bits), dtype=np.uint8)))
+
+    # ---------- um ID ----------
+    def __contains__(self, item_id: int) -> bool:
+        i = int(item_id)
+        return 0 <= i and (i >> 3) < len(self._bits) and bool(self._bits[i >> 3] & (1 << (i & 7)))
+
+    def add(self, item_id: int) -> None:
+        i = int(_as_ids([item_id])[0])
+        self._grow(i)
+        self._bits[i >> 3] |= np.uint8(1 << (i & 7))
+
+    def discard(self, item_id: int) -> None:
+        i = int(item_id)
+        if 0 <= i and (i >> 3) < len(self._bits):
+            self._bits[i >> 3] &= np.uint8(~(1 << (i & 7)) & 0xFF)
+
+    def toggle(self, item_id: int) -> None:
+        i = int(_as_ids([item_id])[0])
+        self._grow(i)
+        self._bits[i >> 3] ^= np.uint8(1 << (i & 7))
+
+    # ---------- vários IDs ----------
+    @staticmethod
+    def _bit(ids: np.ndarray) -> np.ndarray:
+        return (1 << (ids & 7)).astype(np.uint8)
+
+    def contains(self, ids: Iterable[int] | np.ndarray) -> np.ndarray:
+        """Máscara booleana (alinhada a `ids`) dos IDs selecionados."""
+        ids = np.asarray(ids if isinstance(ids, np.ndarray) else list(ids), dtype=np.int64).ravel()
+        ok = (ids >= 0) & ((ids >> 3) < len(self._bits))
+        out = np.zeros(len(ids), dtype=bool)
+        v = ids[ok]
+        out[ok] = ((self._bits[v >> 3] >> (v & 7).astype(np.uint8)) & 1).astype(bool)
+        return out
+
+    def add_many(self, ids: Iterable[int] | np.ndarray) -> None:
+        ids = _as_ids(ids)
+        if not len(ids):
+            return
+        self._grow(ids.max())
+        # .at: IDs no mesmo byte acumulam (indexação com |= ficaria só com o último)
+        np.bitwise_or.at(self._bits, ids >> 3, self._bit(ids))
+
+    def discard_many(self, ids: Iterable[int] | np.ndarray) -> None:
+        ids = np.asarray(ids if isinstance(ids, np.ndarray) else list(ids), dtype=np.int64).ravel()
+        ids = ids[(ids >= 0) & ((ids >> 3) < len(self._bits))]
+        if len(ids):
+            np.bitwise_and.at(self._bits, ids >> 3, ~self._bit(ids))
+
+    def assign(self, ids: Iterable[int] | np.ndarray, selected: np.ndarray) -> None:
+        """Estado de cada ID de `ids` passa a ser `selected` (ex.: coluna de checkbox do editor)."""
+        ids = _as_ids(ids)
+        selected = np.asarray(selected, dtype=bool)
+        self.discard_many(ids[~selected])
+        self.add_many(ids[selected])
+
+    def clear(self) -> None:
+        self._bits = np.zeros(0, dtype=np.uint8)
+
+    # ---------- leitura ----------
+    def __len__(self) -> int:
+        return int(_POPCOUNT[self._bits].sum(dtype=np.int64))
+
+    def __bool__(self) -> bool:
+        return bool(self._bits.any())
+
+    def ids(self) -> np.ndarray:
+        """IDs selecionados, em ordem crescente."""
+        return np.flatnonzero(np.unpackbits(self._bits, bitorder="little"))
+
+
+def selection_state(key: str) -> IdSelection:
+    """Seleção guardada em st.session_state[key] (cria vazia se não houver ou for de outro formato)."""
+    sel = st.session_state.get(key)
+    if not isinstance(sel, IdSelection):
+        sel = st.session_state[key] = IdSelection()
+    return sel
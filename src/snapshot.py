@@ -0,0 +1,547 @@
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterable
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+from snowflake.snowpark import Session
+
+from src.compact import compact_frame, load_dimension_categories
+from src.db_snowflake import (
+    SESSION_TIMEZONE, app_table, fetch_rows_by_ids, get_worker_session, invalidate_schema, stream_to_pandas, table_columns,
+)
+from src.variables import FQN_APR, FQN_COR, FQN_LOG_RMV, FQN_MAIN
+
+# =========================
+# Snapshot local com sincronização incremental
+# =========================
+
+SNAPSHOT_MIN_INTERVAL_S = 15     # intervalo mínimo entre duas consultas de delta
+SNAPSHOT_OVERLAP_S = 300         # janela de sobreposição do watermark (transações longas / relógio)
+SNAPSHOT_FULL_EVERY_S = 3600     # recarga completa periódica (reconciliação)
+SNAPSHOT_FORMAT = 1              # muda quando o layout do arquivo em disco muda
+_META_KEY = b"spdo_snapshot"
+
+log = logging.getLogger(__name__)
+
+
+def _snapshot_dir() -> str | None:
+    """
+    Pasta dos arquivos Parquet; override em st.secrets["snapshot"]["dir"] ("" desliga).
+    Padrão: cache do próprio usuário do processo (XDG_CACHE_HOME ou ~/.cache), não o /tmp
+    compartilhado. Só é usada se for privada (ver _dir_privado).
+    """
+    try:
+        cfg = dict(st.secrets.get("snapshot", {}))
+    except Exception:
+        cfg = {}
+    if "dir" in cfg:
+        return cfg["dir"] or None
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "spdo-app-catalogo", "snapshots")
+
+def _dir_privado(path: str) -> bool:
+    """
+    Cria `path` (0o700) e confere que é do usuário do processo e sem acesso de grupo/outros:
+    o arquivo tem o catálogo inteiro e é carregado sem outra validação no warm start.
+    """
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        if not hasattr(os, "getuid"):
+            return True   # Windows: sem dono/permissões POSIX para conferir
+        st_ = os.stat(path)
+        if st_.st_uid == os.getuid() and not (st_.st_mode & 0o077):
+            return True
+    except OSError:
+        pass
+    log.warning("Snapshot em disco desligado: %s não é uma pasta privada do usuário do processo.", path)
+    return False
+
+def _ts_literal(value) -> str:
+    """Literal SQL para comparar com a coluna de data (NTZ ou com fuso)."""
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        return f"'{ts.isoformat()}'::TIMESTAMP_TZ"
+    return f"'{ts.strftime('%Y-%m-%d %H:%M:%S.%f')}'::TIMESTAMP_NTZ"
+
+def _minus_overlap(value, seconds: int):
+    if value is None or isinstance(value, str):
+        return value
+    return pd.Timestamp(value) - pd.Timedelta(seconds=seconds)
+
+def _max_ts(df: pd.DataFrame, cols: Iterable[str]):
+    """Maior data entre as colunas (None se não houver nenhuma)."""
+    best = None
+    for c in cols:
+        if c not in df.columns or df[c].isna().all():
+            continue
+        s = pd.to_datetime(df[c], errors="coerce")
+        if getattr(s.dt, "tz", None) is not None:
+            s = s.dt.tz_convert(SESSION_TIMEZONE)
+        m = s.max()
+        if pd.isna(m):
+            continue
+        best = m if best is None else max(best, m)
+    return best
+
+def _wm_dump(value) -> dict | None:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return {"t": "str", "v": value}
+    return {"t": "ts", "v": pd.Timestamp(value).isoformat()}
+
+def _wm_load(d: dict | None):
+    if not d:
+        return None
+    return d["v"] if d.get("t") == "str" else pd.Timestamp(d["v"])
+
+def _same_rows(a: pd.DataFrame, b: pd.DataFrame) -> bool:
+    """Mesmo conteúdo (por ID), ignorando diferenças de dtype entre lotes."""
+    if len(a) != len(b):
+        return False
+    if a.empty:
+        return True
+    a = a.sort_values("ID").reset_index(drop=True).astype("string").fillna("")
+    b = b[list(a.columns)].sort_values("ID").reset_index(drop=True).astype("string").fillna("")
+    return a.equals(b)
+
+
+class TableSnapshot:
+    """
+    Cópia local de uma tabela, compartilhada entre as sessões (st.cache_resource).
+
+    Na primeira leitura usa o Parquet salvo em disco (se existir e for da mesma tabela/formato)
+    e reconcilia com o banco em segundo plano; sem arquivo, carrega a tabela inteira.
+    Depois, a cada `frame()`, busca só:
+      - linhas com alguma coluna de `ts_cols` >= último watermark (menos a sobreposição)
+      - IDs que apareceram no log de remoção (`removal_log`) desde a última sincronização
+      - com `id_diff`: IDs que entraram/saíram da tabela (SELECT ID), para tabelas de passagem
+        (insumos / correções) cujas linhas são movidas sem data de alteração
+    e mescla no frame local por ID. Um COUNT(*) confere o resultado; se divergir, recarrega tudo.
+    O frame guardado é compacto (src.compact): categóricos nas colunas de dimensão/usuário.
+    Com `columns`, só essas colunas (+ ID e `ts_cols`) saem do banco, na carga e nos deltas.
+
+    `version` muda sempre que o conteúdo muda (chave para caches derivados).
+    Leitores nunca esperam um delta em andamento: recebem o frame atual.
+    """
+
+    def __init__(
+        self,
+        table_fqn: str,
+        *,
+        ts_cols: Iterable[str] = (),
+        removal_log: str | None = None,
+        id_diff: bool = False,
+        min_interval_s: int = SNAPSHOT_MIN_INTERVAL_S,
+        overlap_s: int = SNAPSHOT_OVERLAP_S,
+        full_every_s: int = SNAPSHOT_FULL_EVERY_S,
+        disk_dir: str | None = None,
+        columns: Iterable[str] | None = None,
+    ):
+        self.table_fqn = table_fqn
+        self.ts_cols = [c.upper() for c in ts_cols]
+        self.columns = (
+            list(dict.fromkeys(["ID", *(c.upper() for c in columns), *self.ts_cols])) if columns is not None else None
+        )
+        self.removal_log = removal_log
+        self.id_diff = id_diff
+        self.min_interval_s = min_interval_s
+        self.overlap_s = overlap_s
+        self.full_every_s = full_every_s
+        nome = table_fqn.split(".")[-1].lower()
+        if self.columns is not None:
+            # snapshot projetado: arquivo próprio (não carrega o da tabela inteira)
+            nome += "_" + hashlib.sha1(",".join(self.columns).encode("utf-8")).hexdigest()[:8]
+        self.disk_path = os.path.join(disk_dir, nome + ".parquet") if disk_dir else None
+
+        self.df: pd.DataFrame | None = None
+        self.version = 0
+        self._watermark = None
+        self._rmv_watermark = None
+        self._last_sync = 0.0
+        self._last_full = 0.0
+        self._stale = False
+        # reentrante: _install/patch pegam o lock também quando chamados de dentro da sincronização
+        self._sync_lock = threading.RLock()
+        self._reload_pending = False   # recarga completa pedida pela thread de segundo plano
+        self._derived: dict[str, tuple[int, Any]] = {}
+        self._derived_lock = threading.Lock()
+        self._categorias: dict[str, list[str]] = {}   # valores das tabelas de dimensão (compact_frame)
+
+    # ---------- leitura ----------
+    def frame(
+        self,
+        session: Session,
+        *,
+        columns: Iterable[str] | None = None,
+        progress: bool = True,
+        cancel_key: str | None = None,
+    ) -> pd.DataFrame:
+        """
+        Cópia do snapshot (sincronizado se preciso). `columns` restringe as colunas devolvidas.
+        Com `cancel_key`, a carga inicial pode ser cancelada: devolve o parcial sem guardá-lo.
+        """
+        if self.df is None:
+            with self._sync_lock:
+                if self.df is None:
+                    if cancel_key and st.session_state.get(cancel_key):
+                        # carga cancelada: devolve o parcial recebido, sem guardar como snapshot
+                        return stream_to_pandas(self._table(session), cancel_key=cancel_key)
+                    if self._load_disk():
+                        self._reconcile_in_background(session)
+                    else:
+                        self._full_load(session, progress=progress, cancel_key=cancel_key)
+        elif self._sync_lock.acquire(blocking=False):
+            try:
+                self._maybe_sync(session)
+            finally:
+                self._sync_lock.release()
+        df = self.df
+
+        if columns is not None:
+            keep = [c for c in dict.fromkeys(c.upper() for c in columns) if c in df.columns]
+            df = df[keep] if keep else df
+        return df.copy()
+
+    def _table(self, session: Session, existentes: list[str] | None = None):
+        return app_table(session, self.table_fqn, self.columns, existing=existentes)
+
+    def derived(self, name: str, builder: Callable[[pd.DataFrame], Any]) -> Any:
+        """
+        Valor calculado a partir do frame atual (ex.: índice de busca), guardado até a
+        próxima mudança de `version`. Chamar depois de `frame()`.
+        """
+        df, version = self.df, self.version
+        hit = self._derived.get(name)
+        if hit is not None and hit[0] == version:
+            return hit[1]
+        with self._derived_lock:
+            hit = self._derived.get(name)
+            if hit is not None and hit[0] == version:
+                return hit[1]
+            value = builder(df)
+            self._derived[name] = (version, value)
+        return value
+
+    def mark_stale(self) -> None:
+        """Força o delta na próxima leitura (chamar após gravar na tabela)."""
+        self._stale = True
+
+    def patch(self, rows: pd.DataFrame) -> None:
+        """
+        Aplica no snapshot valores gravados pelo próprio app (por ID), para escritas que não
+        mexem nas colunas de data e por isso não apareceriam no delta.
+        """
+        # sob o lock da sincronização: um delta em andamento não sobrescreve o patch
+        with self._sync_lock:
+            df = self.df
+            if df is None or rows.empty or "ID" not in rows.columns or "ID" not in df.columns:
+                return
+            cols = [c for c in rows.columns if c != "ID" and c in df.columns]
+            if not cols:
+                return
+            novos = rows.drop_duplicates("ID", keep="last").set_index("ID")[cols]
+            pos = df["ID"].map(pd.Series(range(len(novos)), index=novos.index))
+            hit = pos.notna().to_numpy()
+            if not hit.any():
+                return
+            src = novos.iloc[pos[hit].astype(int).to_numpy()]
+            antes = df.loc[hit, cols].reset_index(drop=True).astype("string").fillna("")
+            if antes.equals(src.reset_index(drop=True).astype("string").fillna("")):
+                return
+            out = df.copy()
+            for c in cols:
+                if isinstance(out[c].dtype, pd.CategoricalDtype):
+                    # valor novo pode não estar nas categorias: _install recompacta
+                    out[c] = out[c].astype(object).where(out[c].notna(), None)
+                out.loc[hit, c] = src[c].to_numpy()
+            self._install(out)
+
+    def refresh(self, session: Session, *, full: bool = False) -> None:
+        with self._sync_lock:
+            if full or self.df is None:
+                self._full_load(session, progress=False)
+            else:
+                self._sync(session)
+
+    # ---------- disco (warm start) ----------
+    def _stamp(self) -> dict[str, Any]:
+        return {
+            "format": SNAPSHOT_FORMAT,
+            "table": self.table_fqn,
+            "columns": self.columns,
+            "version": self.version,
+            "watermark": _wm_dump(self._watermark),
+            "rmv_watermark": _wm_dump(self._rmv_watermark),
+            "saved_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    def _save_disk(self) -> None:
+        if not self.disk_path or self.df is None:
+            return
+        tmp = f"{self.disk_path}.{os.getpid()}.tmp"
+        try:
+            table = pa.Table.from_pandas(self.df, preserve_index=False)
+            meta = dict(table.schema.metadata or {})
+            meta[_META_KEY] = json.dumps(self._stamp()).encode("utf-8")
+            table = table.replace_schema_metadata(meta)
+
+            if not _dir_privado(os.path.dirname(self.disk_path)):
+                return
+            pq.write_table(table, tmp, compression="zstd")
+            os.chmod(tmp, 0o600)
+            os.replace(tmp, self.disk_path)  # troca atômica: leitores nunca veem arquivo pela metade
+        except Exception:
+            # disco é só aceleração: falha ao salvar não afeta o snapshot em memória
+            log.warning("Snapshot %s: falha ao salvar em %s.", self.table_fqn, self.disk_path, exc_info=True)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def _load_disk(self) -> bool:
+        if not self.disk_path or not os.path.exists(self.disk_path):
+            return False
+        if not _dir_privado(os.path.dirname(self.disk_path)):
+            return False
+        try:
+            table = pq.read_table(self.disk_path, memory_map=True)
+            stamp = json.loads((table.schema.metadata or {}).get(_META_KEY, b"{}"))
+            if (
+                stamp.get("format") != SNAPSHOT_FORMAT
+                or stamp.get("table") != self.table_fqn
+                or stamp.get("columns") != self.columns
+            ):
+                return False
+            df = table.to_pandas()
+        except Exception:
+            # arquivo ilegível: segue com a carga do banco
+            log.warning("Snapshot %s: falha ao ler %s; carregando do banco.", self.table_fqn, self.disk_path, exc_info=True)
+            return False
+
+        self._watermark = _wm_load(stamp.get("watermark"))
+        self._rmv_watermark = _wm_load(stamp.get("rmv_watermark"))
+        self._install(df, persist=False)
+        self._last_full = time.monotonic()
+        self._last_sync = 0.0
+        self._stale = True
+        return True
+
+    def _reconcile_in_background(self, session: Session) -> None:
+        """Delta do snapshot lido do disco contra o banco, sem segurar a página."""
+        worker = get_worker_session(f"snapshot:{self.table_fqn}")
+        if worker is None or worker[0] is session:
+            # sem sessão própria (ex.: SiS): reconcilia aqui mesmo; ainda é só um delta
+            try:
+                self._sync(session)
+            except Exception:
+                pass
+            return
+        bg, liberar = worker
+        # a thread não tem contexto do Streamlit (caches st.*): colunas resolvidas aqui
+        existentes = table_columns(session, self.table_fqn)
+
+        def run():
+            with self._sync_lock:
+                try:
+                    self._sync(bg, existentes=existentes)
+                except Exception:
+                    self._stale = True
+                finally:
+                    liberar()
+
+        threading.Thread(target=run, name=f"snapshot-{self.table_fqn}", daemon=True).start()
+
+    # ---------- sincronização ----------
+    def _maybe_sync(self, session: Session) -> None:
+        now = time.monotonic()
+        if self._reload_pending:
+            self._reload_pending = False
+            invalidate_schema(self.table_fqn)
+            self._full_load(session, progress=False)
+            return
+        if now - self._last_full >= self.full_every_s:
+            self._full_load(session, progress=False)
+            return
+        if self._stale or now - self._last_sync >= self.min_interval_s:
+            try:
+                self._sync(session)
+            except Exception:
+                # delta falhou: mantém o snapshot atual e tenta de novo na próxima leitura
+                self._last_sync = now
+
+    def _removal_watermark(self, session: Session):
+        if not self.removal_log:
+            return None
+        try:
+            row = session.sql(f"SELECT MAX(DATA_REMOCAO) AS M FROM {self.removal_log}").collect()
+            return row[0]["M"] if row else None
+        except Exception:
+            return None
+
+    def _full_load(self, session: Session, *, progress: bool = True, cancel_key: str | None = None) -> None:
+        # watermark do log antes da carga: remoções durante a carga entram no próximo delta
+        rmv_wm = self._removal_watermark(session)
+        self._categorias = load_dimension_categories(session)
+        df = stream_to_pandas(
+            self._table(session),
+            label="Carregando catálogo…",
+            progress=progress,
+            cancel_key=cancel_key,
+        )
+        if "ID" in df.columns:
+            df = df.sort_values("ID", kind="stable").reset_index(drop=True)
+        self._watermark = _max_ts(df, self.ts_cols)
+        self._rmv_watermark = rmv_wm
+        self._install(df)
+        self._last_full = self._last_sync = time.monotonic()
+        self._stale = False
+
+    def _install(self, df: pd.DataFrame, *, persist: bool = True) -> None:
+        with self._sync_lock:
+            self.df = compact_frame(df, self._categorias)
+            self.version += 1
+            if persist:
+                self._save_disk()
+
+    def _reload(self, session: Session, background: bool) -> None:
+        """Recarga completa; na thread de segundo plano fica para a próxima leitura da página."""
+        if background:
+            self._reload_pending = True
+            self._stale = True
+            return
+        self._full_load(session, progress=False)
+
+    def _sync(self, session: Session, *, existentes: list[str] | None = None) -> None:
+        """`existentes`: colunas da tabela já resolvidas (thread de segundo plano)."""
+        background = existentes is not None
+        df = self.df
+        cols_ts = [c for c in self.ts_cols if c in df.columns]
+        if "ID" not in df.columns or not (cols_ts or self.id_diff):
+            self._reload(session, background)
+            return
+
+        # 1) linhas novas/alteradas desde o watermark
+        upserts = pd.DataFrame(columns=df.columns)
+        if cols_ts:
+            if self._watermark is None:
+                upserts = stream_to_pandas(self._table(session, existentes), progress=False)
+            else:
+                lit = _ts_literal(_minus_overlap(self._watermark, self.overlap_s))
+                where = " OR ".join(f"{c} >= {lit}" for c in cols_ts)
+                upserts = stream_to_pandas(
+                    self._table(session, existentes).filter(where),
+                    progress=False,
+                )
+
+        # 2) IDs removidos desde a última sincronização
+        removed: set[int] = set()
+        new_rmv_wm = self._rmv_watermark
+        if self.removal_log:
+            if self._rmv_watermark is None:
+                q = f"SELECT ID, DATA_REMOCAO FROM {self.removal_log}"
+            else:
+                lit = _ts_literal(_minus_overlap(self._rmv_watermark, self.overlap_s))
+                q = f"SELECT ID, DATA_REMOCAO FROM {self.removal_log} WHERE DATA_REMOCAO >= {lit}"
+            rmv = session.sql(q).to_pandas()
+            if not rmv.empty:
+                removed = {int(x) for x in rmv["ID"].dropna().tolist()}
+                m = rmv["DATA_REMOCAO"].dropna()
+                if not m.empty:
+                    new_rmv_wm = m.max()
+
+        # 2b) tabelas de passagem: diferença de conjuntos de ID
+        if self.id_diff:
+            ids_srv = {int(x) for x in session.sql(f"SELECT ID FROM {self.table_fqn}").to_pandas()["ID"].dropna()}
+            ids_loc = {int(x) for x in df["ID"].dropna()}
+            removed |= ids_loc - ids_srv
+            faltando = ids_srv - ids_loc - {int(x) for x in upserts["ID"].dropna()}
+            if faltando:
+                novos = fetch_rows_by_ids(session, self.table_fqn, faltando, columns=self.columns, existing=existentes)
+                upserts = novos if upserts.empty else pd.concat([upserts, novos], ignore_index=True)
+
+        if not upserts.empty and list(upserts.columns) != list(df.columns):
+            # esquema mudou: recarrega tudo (e descarta as colunas em cache)
+            if not background:
+                invalidate_schema(self.table_fqn)
+            self._reload(session, background)
+            return
+
+        up_ids = {int(x) for x in upserts["ID"].tolist()} if not upserts.empty else set()
+        # linha que voltou à tabela depois de removida vale a versão atual
+        removed -= up_ids
+        atuais = df[df["ID"].isin(list(up_ids))]
+        changed = bool(df["ID"].isin(list(removed)).any()) or not _same_rows(atuais, upserts)
+        if changed:
+            keep = ~df["ID"].isin(list(up_ids | removed))
+            df = pd.concat([df[keep], upserts], ignore_index=True) if not upserts.empty else df[keep]
+            df = df.sort_values("ID", kind="stable").reset_index(drop=True)
+
+        # 3) conferência barata: contagem no banco x local (o id_diff já confere os IDs)
+        if not self.id_diff:
+            total = session.sql(f"SELECT COUNT(*) AS N FROM {self.table_fqn}").collect()[0]["N"]
+            if int(total) != len(df):
+                self._reload(session, background)
+                return
+
+        wm = _max_ts(upserts, cols_ts) if not upserts.empty else None
+        if wm is not None and (self._watermark is None or wm > self._watermark):
+            self._watermark = wm
+        self._rmv_watermark = new_rmv_wm
+        if changed:
+            self._install(df)
+        self._last_sync = time.monotonic()
+        self._stale = False
+
+
+@st.cache_resource(show_spinner=False)
+def get_apr_snapshot() -> TableSnapshot:
+    """Snapshot de TBL_CATALOGO_APROVADOS (delta por DATA_ATUALIZACAO/DATA_APROVACAO + log de removidos)."""
+    return TableSnapshot(
+        FQN_APR,
+        ts_cols=("DATA_ATUALIZACAO", "DATA_APROVACAO"),
+        removal_log=FQN_LOG_RMV,
+        disk_dir=_snapshot_dir(),
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_apr_projected_snapshot(columns: tuple[str, ...]) -> TableSnapshot:
+    """Como get_apr_snapshot, mas trazendo do banco só `columns` (ex.: visão do perfil USER)."""
+    return TableSnapshot(
+        FQN_APR,
+        ts_cols=("DATA_ATUALIZACAO", "DATA_APROVACAO"),
+        removal_log=FQN_LOG_RMV,
+        disk_dir=_snapshot_dir(),
+        columns=columns,
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_main_snapshot() -> TableSnapshot:
+    """Snapshot de TBL_CATALOGO_INSUMOS (pendentes de validação): IDs entram no cadastro e saem na validação."""
+    return TableSnapshot(
+        FQN_MAIN,
+        ts_cols=("DATA_CADASTRO",),
+        id_diff=True,
+        disk_dir=_snapshot_dir(),
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_cor_snapshot() -> TableSnapshot:
+    """Snapshot de TBL_CATALOGO_CORRECOES (reprovados): IDs entram na reprovação e saem no reenvio."""
+    return TableSnapshot(
+        FQN_COR,
+        ts_cols=("DATA_REPROVACAO", "DATA_ATUALIZACAO"),
+        id_diff=True,
+        disk_dir=_snapshot_dir(),
+    )
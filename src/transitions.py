@@ -0,0 +1,385 @@
+from __future__ import annotations
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterable, Mapping
+
+import pandas as pd
+from snowflake.snowpark import Session
+
+from src.search_doc import BUSCA_COL, refresh_busca_sql
+from src.variables import (
+    FQN_APR, FQN_COR, FQN_LOG_REPROV, FQN_LOG_RMV, FQN_LOG_VALID, FQN_MAIN, FQN_RMV,
+)
+
+# =========================
+# Transições do fluxo (mover linhas entre tabelas por ID)
+# =========================
+# Expressões usadas em target_meta / audit_cols:
+#   "COLUNA"  -> coluna da tabela de origem (NULL se não existir)
+#   "@chave"  -> parâmetro do contexto (user_login, user_name, note, now_utc, source, target)
+#   "=SQL"    -> SQL literal (ex.: "=CURRENT_TIMESTAMP()", "=NULL")
+
+@dataclass(frozen=True)
+class Transition:
+    """Movimento de linhas de `source` para `target`, com metadados no destino e auditoria."""
+    name: str
+    source: str
+    target: str
+    target_meta: tuple[tuple[str, str], ...] = ()
+    audit_table: str | None = None
+    audit_cols: tuple[tuple[str, str], ...] = ()
+
+
+@dataclass
+class TransitionResult:
+    name: str
+    moved: int = 0
+    timings: dict[str, float] = field(default_factory=dict)
+
+    def resumo(self) -> str:
+        return " · ".join(f"{k} {v * 1000:.0f} ms" for k, v in self.timings.items())
+
+
+_META_APROVACAO = (
+    ("USUARIO_APROVACAO", "@user_name"),
+    ("DATA_APROVACAO", "=CURRENT_TIMESTAMP()"),
+)
+_AUDIT_VALIDACAO = (
+    ("ITEM_ID", "ID"),
+    ("CODIGO_PRODUTO", "CODIGO_PRODUTO"),
+    ("ORIGEM_TABELA", "@source"),
+    ("DESTINO_TABELA", "@target"),
+    ("OBSERVACAO", "@note"),
+    ("APROVADO_POR_USER", "@user_login"),
+    ("APROVADO_POR_NOME", "@user_name"),
+)
+
+APROVAR = Transition(
+    "aprovar", FQN_MAIN, FQN_APR,
+    target_meta=_META_APROVACAO,
+    audit_table=FQN_LOG_VALID, audit_cols=_AUDIT_VALIDACAO,
+)
+
+REPROVAR = Transition(
+    "reprovar", FQN_MAIN, FQN_COR,
+    target_meta=(
+        ("USUARIO_REPROVACAO", "@user_name"),
+        ("DATA_REPROVACAO", "=CURRENT_TIMESTAMP()"),
+        ("MOTIVO", "@note"),
+    ),
+    audit_table=FQN_LOG_REPROV,
+    audit_cols=(
+        ("ITEM_ID", "ID"),
+        ("CODIGO_PRODUTO", "CODIGO_PRODUTO"),
+        ("ORIGEM_TABELA", "@source"),
+        ("DESTINO_TABELA", "@target"),
+        ("MOTIVO", "@note"),
+        ("REPROVADO_POR_USER", "@user_login"),
+        ("REPROVADO_POR_NOME", "@user_name"),
+    ),
+)
+
+APROVAR_CORRECAO = Transition(
+    "aprovar_correcao", FQN_COR, FQN_APR,
+    target_meta=_META_APROVACAO,
+    audit_table=FQN_LOG_VALID, audit_cols=_AUDIT_VALIDACAO,
+)
+
+REENVIAR_VALIDACAO = Transition(
+    "reenviar_validacao", FQN_COR, FQN_MAIN,
+    # volta para a fila: zera os campos de atualização
+    target_meta=(
+        ("DATA_ATUALIZACAO", "=NULL"),
+        ("USUARIO_ATUALIZACAO", "=NULL"),
+    ),
+)
+
+REMOVER = Transition(
+    "remover", FQN_APR, FQN_RMV,
+    audit_table=FQN_LOG_RMV,
+    audit_cols=(
+        ("ID", "ID"),
+        ("CODIGO_PRODUTO", "CODIGO_PRODUTO"),
+        ("INSUMO", "INSUMO"),
+        ("MOTIVO", "@note"),
+        ("DATA_REMOCAO", "@now_utc"),     # texto UTC (watermark do snapshot de aprovados)
+        ("USUARIO_REMOCAO", "@user_login"),
+    ),
+)
+
+
+ColumnResolver = Callable[[Session, str], list[str]]
+
+
+def _table_cols(session: Session, table_fqn: str) -> list[str]:
+    return [c.name for c in session.table(table_fqn).schema]
+
+
+def _txt(v: Any) -> str | None:
+    if v is None:
+        return None
+    try:
+        if pd.isna(v):
+            return None
+    except (TypeError, ValueError):
+        pass
+    return str(v)
+
+
+class _Sql:
+    """Monta uma expressão SQL acumulando os parâmetros `?` na ordem em que aparecem."""
+
+    def __init__(self, ctx: Mapping[str, Any], src_cols: Iterable[str], alias: str = "s"):
+        self.ctx = ctx
+        self.src_cols = set(src_cols)
+        self.alias = alias
+        self.params: list[Any] = []
+
+    def expr(self, spec: str) -> str:
+        if spec.startswith("="):
+            return spec[1:]
+        if spec.startswith("@"):
+            self.params.append(self.ctx.get(spec[1:]))
+            return "?"
+        return f"{self.alias}.{spec}" if spec in self.src_cols else "NULL"
+
+    def ids_in(self, ids_json: str) -> str:
+        self.params.append(ids_json)
+        return f"{self.alias}.ID IN (SELECT VALUE::NUMBER FROM TABLE(FLATTEN(INPUT => PARSE_JSON(?))))"
+
+
+def _edits_rows(edits: Iterable[Mapping[str, Any]], cols: Iterable[str]) -> list[dict[str, Any]]:
+    cols = list(cols)
+    return [{"ID": int(r["ID"]), **{c: _txt(r.get(c)) for c in cols if c in r}} for r in edits]
+
+
+def _edits_json(edits: Iterable[Mapping[str, Any]], cols: list[str]) -> str:
+    return json.dumps(_edits_rows(edits, cols), ensure_ascii=False)
+
+
+def run_transition(
+    session: Session,
+    tr: Transition,
+    ids: Iterable[Any],
+    *,
+    user: Mapping[str, Any] | None = None,
+    note: str | None = None,
+    edits: Iterable[Mapping[str, Any]] | None = None,
+    edit_cols: Iterable[str] = (),
+    columns: ColumnResolver | None = None,
+) -> TransitionResult:
+    """
+    Executa a transição para os IDs numa única transação, com nº fixo de comandos
+    (independe do tamanho do lote):
+      [UPDATE das edições na origem] -> INSERT ... SELECT no destino (com metadados)
+      -> [INSERT ... SELECT na auditoria] -> DELETE na origem
+    `edits`: linhas editadas (com ID) cujas colunas `edit_cols` são gravadas na origem antes de mover.
+    `columns(session, fqn)`: de onde vêm as colunas das tabelas (ex.: cache de schema do app);
+    sem ele, descreve as tabelas a cada execução.
+    Em erro faz ROLLBACK e propaga a exceção.
+    """
+    res = TransitionResult(tr.name)
+    ids = sorted({int(i) for i in ids})
+    if not ids:
+        return res
+    ids_json = json.dumps(ids)
+    ctx = {
+        "user_login": (user or {}).get("username"),
+        "user_name": (user or {}).get("name"),
+        "note": note,
+        "now_utc": datetime.now(timezone.utc).replace(tzinfo=None).strftime("%Y-%m-%d %H:%M:%S"),
+        "source": tr.source,
+        "target": tr.target,
+    }
+
+    def stage(name: str, t0: float) -> float:
+        t1 = time.perf_counter()
+        res.timings[name] = res.timings.get(name, 0.0) + (t1 - t0)
+        return t1
+
+    t = time.perf_counter()
+    resolve = columns or _table_cols
+    src_cols = resolve(session, tr.source)
+    tgt_cols = resolve(session, tr.target)
+    t = stage("schema", t)
+
+    # edições (um UPDATE ... FROM com as linhas num array JSON)
+    sql_edits, params_edits = None, []
+    edits = list(edits or [])
+    cols_e = [c for c in edit_cols if c in src_cols and any(c in r for r in edits)]
+    if edits and cols_e:
+        sets = [f"{c} = e.{c}" for c in cols_e]
+        if "DATA_ATUALIZACAO" in src_cols:
+            sets.append("DATA_ATUALIZACAO = CURRENT_TIMESTAMP()")
+        proj = ", ".join(f'VALUE:"{c}"::STRING AS {c}' for c in cols_e)
+        sql_edits = f"""
+            UPDATE {tr.source} t
+            SET {', '.join(sets)}
+            FROM (
+                SELECT VALUE:"ID"::NUMBER AS ID, {proj}
+                FROM TABLE(FLATTEN(INPUT => PARSE_JSON(?)))
+            ) e
+            WHERE t.ID = e.ID
+        """
+        params_edits = [_edits_json(edits, cols_e)]
+
+    # destino: colunas comuns + metadados (só os que existem no destino)
+    meta = [(c, e) for c, e in tr.target_meta if c in tgt_cols]
+    meta_cols = {c for c, _ in meta}
+    copy_cols = [c for c in src_cols if c in tgt_cols and c not in meta_cols]
+    q_ins = _Sql(ctx, src_cols)
+    sel = [f"s.{c}" for c in copy_cols] + [q_ins.expr(e) for _, e in meta]
+    where = q_ins.ids_in(ids_json)
+    sql_insert = f"""
+        INSERT INTO {tr.target} ({', '.join(copy_cols + [c for c, _ in meta])})
+        SELECT {', '.join(sel)}
+        FROM {tr.source} s
+        WHERE {where}
+    """
+
+    sql_audit = None
+    q_aud = _Sql(ctx, src_cols)
+    if tr.audit_table:
+        sel = [q_aud.expr(e) for _, e in tr.audit_cols]
+        where = q_aud.ids_in(ids_json)
+        sql_audit = f"""
+            INSERT INTO {tr.audit_table} ({', '.join(c for c, _ in tr.audit_cols)})
+            SELECT {', '.join(sel)}
+            FROM {tr.source} s
+            WHERE {where}
+        """
+
+    # documento de busca do destino: recalculado nas linhas movidas (edições mudam o texto)
+    sql_busca = refresh_busca_sql(
+        tr.target, tgt_cols, "ID IN (SELECT VALUE::NUMBER FROM TABLE(FLATTEN(INPUT => PARSE_JSON(?))))",
+    ) if BUSCA_COL in tgt_cols else None
+
+    q_del = _Sql(ctx, src_cols)
+    sql_delete = f"DELETE FROM {tr.source} s WHERE {q_del.ids_in(ids_json)}"
+
+    try:
+        session.sql("BEGIN").collect()
+        t = time.perf_counter()
+        if sql_edits:
+            session.sql(sql_edits, params=params_edits).collect()
+            t = stage("edicoes", t)
+        out = session.sql(sql_insert, params=q_ins.params).collect()
+        res.moved = int(out[0][0]) if out else 0
+        t = stage("destino", t)
+        if sql_busca:
+            session.sql(sql_busca, params=[ids_json]).collect()
+            t = stage("busca", t)
+        if sql_audit:
+            # lê da origem antes do DELETE (inclui as edições)
+            session.sql(sql_audit, params=q_aud.params).collect()
+            t = stage("auditoria", t)
+        session.sql(sql_delete, params=q_del.params).collect()
+        t = stage("remocao", t)
+        session.sql("COMMIT").collect()
+        stage("commit", t)
+    except Exception:
+        try:
+            session.sql("ROLLBACK").collect()
+        except Exception:
+            pass
+        raise
+    return res
+
+
+TRANSITIONS = {t.name: t for t in (APROVAR, REPROVAR, APROVAR_CORRECAO, REENVIAR_VALIDACAO, REMOVER)}
+
+# =========================
+# Stored procedure (mesma engine, executada dentro do Snowflake)
+# =========================
+
+def transition_handler(
+    session: Session,
+    nome: str,
+    ids: list,
+    user_login: str,
+    user_name: str,
+    note: str,
+    edits: list,
+    edit_cols: list,
+) -> dict:
+    """
+    Corpo da stored procedure: roda `run_transition` com a sessão da própria procedure.
+    Não depende do Snowflake em si, então pode ser chamado direto com uma sessão local
+    (ex.: Session.builder.config("local_testing", True)) ou um dublê com .table/.sql.
+    """
+    tr = TRANSITIONS[nome]
+    res = run_transition(
+        session, tr, ids or [],
+        user={"username": user_login, "name": user_name},
+        note=note,
+        edits=edits or None,
+        edit_cols=edit_cols or (),
+    )
+    return {"name": res.name, "moved": res.moved, "timings": res.timings}
+
+
+def register_transition_procedure(session: Session, name: str, *, stage_location: str) -> None:
+    """
+    Cria/substitui a procedure permanente `name` (ex.: DB.SCHEMA.SP_CATALOGO_TRANSICAO).
+    Roda com os direitos de quem chama (execute_as="caller"), como as chamadas feitas pelo app.
+    """
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    session.sproc.register(
+        transition_handler,
+        name=name,
+        is_permanent=True,
+        stage_location=stage_location,
+        replace=True,
+        execute_as="caller",
+        packages=["snowflake-snowpark-python", "pandas"],
+        imports=[
+            (os.path.join(src_dir, "transitions.py"), "src.transitions"),
+            (os.path.join(src_dir, "search_doc.py"), "src.search_doc"),
+            (os.path.join(src_dir, "variables.py"), "src.variables"),
+        ],
+    )
+
+
+def call_transition(
+    session: Session,
+    tr: Transition,
+    ids: Iterable[Any],
+    *,
+    user: Mapping[str, Any] | None = None,
+    note: str | None = None,
+    edits: Iterable[Mapping[str, Any]] | None = None,
+    edit_cols: Iterable[str] = (),
+    procedure: str | None = None,
+    columns: ColumnResolver | None = None,
+) -> TransitionResult:
+    """
+    Executa a transição com um único CALL na procedure `procedure`;
+    sem procedure, roda os comandos daqui mesmo (run_transition, com `columns`).
+    """
+    if not procedure:
+        return run_transition(
+            session, tr, ids, user=user, note=note, edits=edits, edit_cols=edit_cols, columns=columns,
+        )
+    ids = sorted({int(i) for i in ids})
+    if not ids:
+        return TransitionResult(tr.name)
+    edit_cols = list(edit_cols)
+    t0 = time.perf_counter()
+    out = session.call(
+        procedure,
+        tr.name,
+        ids,
+        (user or {}).get("username"),
+        (user or {}).get("name"),
+        note,
+        _edits_rows(edits or [], edit_cols),
+        edit_cols,
+    )
+    if isinstance(out, str):
+        out = json.loads(out)
+    res = TransitionResult(tr.name, moved=int(out.get("moved") or 0), timings=dict(out.get("timings") or {}))
+    res.timings["call"] = time.perf_counter() - t0
+    return res
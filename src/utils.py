@@ -4,9 +4,9 @@ from datetime import datetime
 from io import BytesIO
 from typing import Any, Iterable, List
 import io
+import numpy as np
 import pandas as pd
 import unicodedata
-import streamlit as st
 
 PT_DATE_FMT = "%d/%m/%Y"
 
@@ -182,6 +182,144 @@ def gerar_palavra_chave(subfamilia, item, marca, fabricante, emb_produto, qtd_me
         out = (out + ", " + qtd_un) if out else qtd_un
     return out.strip()
 
+# =========================
+# Versões vetorizadas (Series) — mesma saída das funções acima, linha a linha
+# =========================
+# As regras por campo rodam uma vez por valor distinto (factorize) e o resultado é
+# espalhado por índice; a montagem das frases é feita coluna a coluna.
+
+_WIPE_TOUCH_RE = re.compile(r"[-‐-‒–—−]|\s{2,}|^\s|\s$")
+
+def _broadcast(x, index: pd.Index) -> pd.Series:
+    if isinstance(x, pd.Series):
+        if isinstance(x.dtype, pd.CategoricalDtype):
+            # frame compacto: valores crus, nulo = None (como na leitura do banco)
+            x = x.astype(object).where(x.notna(), None)
+        elif x.dtype == np.float32:
+            x = x.astype(np.float64)
+        return x.reindex(index) if not x.index.equals(index) else x
+    return pd.Series([x] * len(index), index=index, dtype=object)
+
+def _common_index(*args) -> pd.Index:
+    for a in args:
+        if isinstance(a, pd.Series):
+            return a.index
+    return pd.RangeIndex(1)
+
+def _map_unique(s: pd.Series, fn) -> pd.Series:
+    """fn(valor) por valor distinto; nulos (None/NaN/NA) chegam como None."""
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    vals = np.empty(len(uniques) + 1, dtype=object)
+    vals[:-1] = [fn(u) for u in uniques]
+    vals[-1] = fn(None)
+    return pd.Series(vals[codes], index=s.index, dtype=object)
+
+def _map_unique_pairs(a: pd.Series, b: pd.Series, fn) -> pd.Series:
+    """fn(a, b) por par distinto; valores passam crus (NaN continua NaN, como no apply)."""
+    # o tipo entra na chave: 2 e 2.0 são iguais no hash, mas saem diferentes no f-string
+    va, vb = a.tolist(), b.tolist()
+    chaves = pd.Series(list(zip(va, map(type, va), vb, map(type, vb))), index=a.index, dtype=object)
+    codes, uniques = pd.factorize(chaves, use_na_sentinel=False)
+    vals = np.empty(len(uniques), dtype=object)
+    vals[:] = [fn(x, y) for x, _, y, _ in uniques]
+    return pd.Series(vals[codes], index=a.index, dtype=object)
+
+def _clean_series(s: pd.Series) -> pd.Series:
+    return _map_unique(s, wipe_dashes)
+
+def _clean_opt_series(s: pd.Series) -> pd.Series:
+    return _map_unique(s, lambda v: "" if is_dash_placeholder(v) else wipe_dashes(v))
+
+def _join_nonempty(parts: list[pd.Series], sep: str) -> pd.Series:
+    """sep.join das partes não vazias (partes já limpas, sem espaço nas pontas)."""
+    acc = parts[0].to_numpy(dtype=object)
+    for p in parts[1:]:
+        v = p.to_numpy(dtype=object)
+        acc_vazio = acc == ""
+        v_vazio = v == ""
+        acc = np.where(acc_vazio, v, np.where(v_vazio, acc, acc + sep + v))
+    return pd.Series(acc, index=parts[0].index, dtype=object)
+
+def wipe_dashes_series(s: pd.Series) -> pd.Series:
+    """wipe_dashes linha a linha; só passa pela regex quem tem traço ou espaço a normalizar."""
+    s = s.where(s.notna(), None)
+    out = s.to_numpy(dtype=object).copy()
+    vazio = np.array([not v for v in out], dtype=bool)
+    out[vazio] = ""
+    toca = ~vazio & s.astype(str).str.contains(_WIPE_TOUCH_RE).to_numpy(dtype=bool)
+    out[toca] = [wipe_dashes(v) for v in out[toca]]
+    return pd.Series(out, index=s.index, dtype=object)
+
+def extrair_valores_series(especificacao: pd.Series) -> pd.Series:
+    return _map_unique(especificacao, extrair_valores)
+
+def safe_qtd_un_series(qtd_med: pd.Series, un_med: pd.Series) -> pd.Series:
+    return _map_unique_pairs(qtd_med, un_med, safe_qtd_un)
+
+def _sufixo_emb_comercial(qtd_emb_comercial, emb_comercial: str) -> str:
+    try:
+        if (qtd_emb_comercial not in (None, "", 1)) and emb_comercial:
+            emb_plural = pluralize_pt(emb_comercial, qtd_emb_comercial).upper()
+            return f" COM {qtd_emb_comercial} {emb_plural}"
+    except Exception:
+        pass
+    return ""
+
+def _inteiro_series(s: pd.Series) -> pd.Series:
+    """
+    Quantidade inteira que chega como float (coluna float64 do banco / lote da UDF: 2.0) volta
+    a int, como no cadastro: SINONIMO sai "COM 2 CAIXAS" e não "COM 2.0 CAIXAS". NaN -> None.
+    """
+    def norm(v):
+        if isinstance(v, float):
+            return None if v != v else (int(v) if v.is_integer() else v)
+        return v
+    return pd.Series([norm(v) for v in s.tolist()], index=s.index, dtype=object)
+
+def gerar_sinonimo_series(item, descricao, marca, fabricante, qtd_med, un_med, emb_produto, qtd_emb_comercial, emb_comercial) -> pd.Series:
+    """gerar_sinonimo sobre colunas inteiras (escalares são replicados)."""
+    idx = _common_index(item, descricao, marca, fabricante, qtd_med, un_med, emb_produto, qtd_emb_comercial, emb_comercial)
+    item        = _clean_series(_broadcast(item, idx))
+    descricao   = _clean_series(_broadcast(descricao, idx))
+    marca       = _clean_opt_series(_broadcast(marca, idx))
+    fabricante  = _clean_opt_series(_broadcast(fabricante, idx))
+    emb_produto = _clean_opt_series(_broadcast(emb_produto, idx))
+    emb_comercial = _clean_series(_broadcast(emb_comercial, idx))
+
+    qtd_un = safe_qtd_un_series(_broadcast(qtd_med, idx), _broadcast(un_med, idx))
+
+    sinonimo = _join_nonempty([item, descricao, marca, fabricante, qtd_un], " ")
+
+    tem_emb = emb_produto.ne("")
+    if tem_emb.any():
+        emb_up = _map_unique(emb_produto[tem_emb], lambda v: (v or "").upper())
+        sinonimo[tem_emb] = (sinonimo[tem_emb] + " COMERCIALIZADO EM " + emb_up).str.strip()
+
+    sufixo = _map_unique_pairs(_inteiro_series(_broadcast(qtd_emb_comercial, idx)), emb_comercial, _sufixo_emb_comercial)
+    tem_suf = sufixo.ne("")
+    if tem_suf.any():
+        sinonimo[tem_suf] = (sinonimo[tem_suf] + sufixo[tem_suf]).str.strip()
+
+    return wipe_dashes_series(sinonimo)
+
+def gerar_palavra_chave_series(subfamilia, item, marca, fabricante, emb_produto, qtd_med, un_med, familia=None) -> pd.Series:
+    """gerar_palavra_chave sobre colunas inteiras (escalares são replicados)."""
+    idx = _common_index(subfamilia, item, marca, fabricante, emb_produto, qtd_med, un_med, familia)
+    marca_clean      = _clean_opt_series(_broadcast(marca, idx))
+    fabricante_clean = _clean_opt_series(_broadcast(fabricante, idx))
+
+    base_subfam = _clean_opt_series(_broadcast(subfamilia, idx))
+    sem_subfam = base_subfam.eq("")
+    if sem_subfam.any():
+        base_subfam[sem_subfam] = _clean_opt_series(_broadcast(familia, idx)[sem_subfam])
+
+    item_clean        = _clean_series(_broadcast(item, idx))
+    emb_produto_clean = _clean_opt_series(_broadcast(emb_produto, idx))
+    qtd_un            = safe_qtd_un_series(_broadcast(qtd_med, idx), _broadcast(un_med, idx))
+
+    out = _join_nonempty([base_subfam, item_clean, marca_clean, fabricante_clean, emb_produto_clean, qtd_un], ", ")
+    return out.str.strip()
+
 def gerar_excel(df: pd.DataFrame, sheet_name: str = "Catálogo") -> bytes:
     output = BytesIO()
     # use "xlsxwriter" (recomendado). Alternativa: engine="openpyxl"